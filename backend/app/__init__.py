@@ -1,12 +1,28 @@
+import logging
+
 from flask import Flask
 from dotenv import load_dotenv
 load_dotenv()
 from app.routes import api_blueprint
 from app.config import Config
+from app import serving
+
+log = logging.getLogger(__name__)
 
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     app.register_blueprint(api_blueprint)
+
+    if app.config.get("RAG_STORE_DIR"):
+        from app.rag_service import load_store
+        try:
+            load_store(app.config["RAG_STORE_DIR"])
+        except Exception:
+            # keep serving so /ready can report it, instead of crash-looping
+            log.exception("Loading the RAG store failed")
+            serving.mark_index_loaded(False)
+            return app
+    serving.mark_index_loaded()
     return app
@@ -0,0 +1,230 @@
+# app/asgi.py
+"""ASGI serving mode.
+
+    uvicorn app.asgi:application --host 0.0.0.0 --port 5000
+
+The OpenAI-bound endpoints (/chat, /generateImage, /ask_rag,
+/chat_rag_memory) are served by coroutines on AsyncOpenAI, so a single
+process can hold hundreds of upstream calls in flight. Every other route
+is handed to the regular Flask app through asgiref's WSGI adapter, as are
+streaming (Accept: text/event-stream) requests.
+"""
+import json
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app, metrics, serving
+from app.config import Config
+from app.openai_client import UpstreamUnavailable
+from app.openai_service import CHAT_MODEL
+from app.rate_limiter import RateLimited, get_limiter
+from app.response_cache import cached_call_async
+from app.openai_service import get_chat_response_async, get_image_response_async
+from app.rag_service import answer_query_async, answer_with_memory_and_rag_async
+from app.routes import (
+    parse_collection,
+    parse_image_size,
+    parse_search_kwargs,
+    rag_cache_extra,
+    request_tokens,
+)
+
+flask_app = create_app()
+_wsgi_app = WsgiToAsgi(flask_app)
+serving.warm_clients_in_background()
+
+
+class _Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.content_length = len(body)
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        try:
+            self.json = json.loads(body) if body else None
+        except ValueError:
+            self.json = None
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send(send, status, body, content_type="application/json", headers=()):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# --- request checks, mirroring require_api_key / admit_request / require_content in routes.py ---
+
+def _valid_key(key):
+    if flask_app.config.get("TESTING") and key == "my-secret-key":
+        return True
+    api_key = flask_app.config.get("API_KEY")
+    return bool(api_key) and key == api_key
+
+
+def _auth_error(req):
+    key = req.headers.get("x-api-key")
+    if not _valid_key(key):
+        return 401, {"error": "Invalid API key"}
+    get_limiter().admit_client(key, request_tokens(req.content_length))
+    return None
+
+
+def _admit(req):
+    key = req.headers.get("x-api-key")
+    address = (req.scope.get("client") or ("",))[0]
+    get_limiter().admit_client(key if _valid_key(key) else None, request_tokens(req.content_length), address=address)
+
+
+def _content_error(req, field_name):
+    if not req.json:
+        return 400, {"error": "Invalid JSON payload"}
+    value = req.json.get(field_name)
+    if not value or not isinstance(value, str) or not value.strip():
+        return 400, {"error": f"Missing or empty '{field_name}' field"}
+    return None
+
+
+def _cache_bypassed(req):
+    return "no-cache" in req.headers.get("cache-control", "")
+
+
+# --- async routes ---
+
+async def chat(req):
+    error = _auth_error(req) or _content_error(req, "content")
+    if error:
+        return error
+    content = req.json["content"]
+    response, cache_status = await cached_call_async(
+        "chat", content, lambda: get_chat_response_async(content),
+        extra=CHAT_MODEL, bypass=_cache_bypassed(req),
+    )
+    return 200, {"response": response, "version": "0.1.0"}, "application/json", [
+        (b"x-cache", cache_status.encode()),
+    ]
+
+
+async def generate_image(req):
+    error = _auth_error(req) or _content_error(req, "content")
+    if error:
+        return error
+    response_type = req.headers.get("response-type", "base64")
+    if response_type.lower() not in ("base64", "image"):
+        return 402, {"error": "Invalid response-type header, must be 'base64' or 'image'"}
+    size, error = parse_image_size(req.json)
+    if error:
+        return 400, {"error": error}
+
+    result = await get_image_response_async(req.json["content"], response_type, size)
+    if response_type.lower() == "base64":
+        return 200, result
+    return 200, result, "image/png", [
+        (b"content-disposition", b"attachment; filename=generated.png"),
+    ]
+
+
+async def ask_rag(req):
+    _admit(req)
+    error = _content_error(req, "query")
+    if error:
+        return error
+    search_kwargs, message = parse_search_kwargs(req.json)
+    if message:
+        return 400, {"error": message}
+    query = req.json["query"]
+    answer, cache_status = await cached_call_async(
+        "rag", query, lambda: answer_query_async(query, **search_kwargs),
+        extra=rag_cache_extra(search_kwargs), bypass=_cache_bypassed(req),
+    )
+    return 200, {"response": answer}, "application/json", [
+        (b"x-cache", cache_status.encode()),
+    ]
+
+
+async def chat_rag_memory(req):
+    error = _auth_error(req)
+    if error:
+        return error
+    data = req.json or {}
+    query = data.get("query", "")
+    if not query:
+        return 400, {"error": "Query missing"}
+    collection, message = parse_collection(data.get("collection"))
+    if message:
+        return 400, {"error": message}
+    usage = {}
+    answer = await answer_with_memory_and_rag_async(
+        data.get("session_id", "default"), query, usage, collection=collection
+    )
+    return 200, {"response": answer, **usage}
+
+
+ASYNC_ROUTES = {
+    ("POST", "/chat"): chat,
+    ("POST", "/generateImage"): generate_image,
+    ("POST", "/ask_rag"): ask_rag,
+    ("POST", "/chat_rag_memory"): chat_rag_memory,
+}
+
+
+def _accepts_event_stream(scope):
+    for name, value in scope["headers"]:
+        if name == b"accept" and b"text/event-stream" in value:
+            return True
+    return False
+
+
+async def application(scope, receive, send):
+    handler = None
+    if scope["type"] == "http":
+        handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+        # SSE responses are produced by the Flask routes
+        if handler is not None and _accepts_event_stream(scope):
+            handler = None
+    if handler is None:
+        return await _wsgi_app(scope, receive, send)
+
+    started = time.perf_counter()
+    metrics.start_request()
+    req = _Request(scope, await _read_body(receive))
+    try:
+        result = await handler(req)
+    except UpstreamUnavailable as e:
+        result = 503, {"error": str(e)}, "application/json", [
+            (b"retry-after", str(e.retry_after).encode()),
+        ]
+    except RateLimited as e:
+        result = 429, {"error": str(e)}, "application/json", [
+            (b"retry-after", str(e.retry_after).encode()),
+        ]
+    await _send(send, *_timed(scope, result, time.perf_counter() - started))
+
+
+def _timed(scope, result, elapsed):
+    """Observe the request like routes.record_timing, adding Server-Timing if enabled."""
+    if not Config.METRICS_ENABLED:
+        return result
+    status, body, content_type, headers = (tuple(result) + ("application/json", []))[:4]
+    metrics.http_seconds.observe(elapsed, endpoint=scope["path"], method=scope["method"], status=str(status))
+    if Config.SERVER_TIMING_ENABLED:
+        timing = metrics.server_timing(metrics.request_timings(), elapsed)
+        headers = [*headers, (b"server-timing", timing.encode())]
+    return status, body, content_type, headers
@@ -7,3 +7,148 @@ load_dotenv()
 class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     API_KEY = os.getenv("API_KEY", "my-secret-key")
+
+    # RAG persistence: directory for index snapshots (unset = in-memory only)
+    RAG_STORE_DIR = os.getenv("RAG_STORE_DIR")
+    # a snapshot rewrites the whole collection, so a burst of writes shares one: it is written
+    # RAG_SNAPSHOT_INTERVAL seconds after the first unsaved write, or at once after
+    # RAG_SNAPSHOT_EVERY of them (interval 0 = after every write)
+    RAG_SNAPSHOT_EVERY = int(os.getenv("RAG_SNAPSHOT_EVERY", "100"))
+    RAG_SNAPSHOT_INTERVAL = float(os.getenv("RAG_SNAPSHOT_INTERVAL", "1"))
+    # workers sharing RAG_STORE_DIR pick up each other's snapshots this often (seconds, 0 = never)
+    RAG_RELOAD_INTERVAL = float(os.getenv("RAG_RELOAD_INTERVAL", "5"))
+
+    # RAG index backend: flat | ivf_flat | ivf_pq | hnsw
+    RAG_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "flat")
+    # IVF kinds stay flat until the corpus reaches this size, then get trained
+    RAG_ANN_MIN_VECTORS = int(os.getenv("RAG_ANN_MIN_VECTORS", "50000"))
+    # retrain once the corpus has grown by this factor since the last build
+    RAG_REBUILD_GROWTH = float(os.getenv("RAG_REBUILD_GROWTH", "4"))
+    RAG_NLIST = int(os.getenv("RAG_NLIST", "0"))  # 0 = ~4*sqrt(n)
+    RAG_PQ_M = int(os.getenv("RAG_PQ_M", "16"))
+    RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+    # l2 | cosine (inner product on L2-normalized vectors; scores are cosine similarities)
+    RAG_METRIC = os.getenv("RAG_METRIC", "l2")
+    # drop vector hits below this similarity so irrelevant chunks never reach the prompt
+    RAG_MIN_SIMILARITY = float(os.environ["RAG_MIN_SIMILARITY"]) if os.getenv("RAG_MIN_SIMILARITY") else None
+    # vector precision in the index: fp32 | fp16 | int8 | pq (RAG_PQ_M bytes per vector)
+    RAG_VECTOR_STORAGE = os.getenv("RAG_VECTOR_STORAGE", "fp32")
+    # re-rank this many times top_k candidates of a quantized index at full precision (0/1 = off)
+    RAG_RERANK_FACTOR = int(os.getenv("RAG_RERANK_FACTOR", "0"))
+    # default search-time knobs, overridable per request
+    RAG_NPROBE = int(os.getenv("RAG_NPROBE", "16"))
+    RAG_EF_SEARCH = int(os.getenv("RAG_EF_SEARCH", "64"))
+    # retrieval: vector | hybrid (vector + BM25, reciprocal-rank fused) | lexical (BM25 only)
+    RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "vector")
+    RAG_HYBRID_FETCH_K = int(os.getenv("RAG_HYBRID_FETCH_K", "20"))  # candidates per retriever
+    RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+    # post-retrieval re-ranker: none | mmr (diversify near-duplicates) | cross_encoder (local model);
+    # mmr and cross_encoder pick top_k out of top_k * RAG_FETCH_K_FACTOR candidates
+    RAG_RERANKER = os.getenv("RAG_RERANKER", "none")
+    RAG_FETCH_K_FACTOR = int(os.getenv("RAG_FETCH_K_FACTOR", "4"))
+    RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.5"))  # 1 = relevance only, 0 = diversity only
+    RAG_CROSS_ENCODER_MODEL = os.getenv("RAG_CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    # metadata fields that get per-value bitmap indexes (low-cardinality, frequently filtered)
+    RAG_METADATA_BITMAP_FIELDS = [
+        f.strip() for f in os.getenv("RAG_METADATA_BITMAP_FIELDS", "tenant,source").split(",") if f.strip()
+    ]
+    # filtered searches over at most this many rows are scored exactly
+    RAG_FILTER_EXACT_MAX = int(os.getenv("RAG_FILTER_EXACT_MAX", "4096"))
+    # /ask_rag/batch: max questions per request, completions in flight per request
+    RAG_BATCH_MAX_QUERIES = int(os.getenv("RAG_BATCH_MAX_QUERIES", "1000"))
+    RAG_BATCH_CONCURRENCY = int(os.getenv("RAG_BATCH_CONCURRENCY", "8"))
+    # compact (rebuild without deleted rows) once this share of rows is deleted
+    RAG_COMPACT_RATIO = float(os.getenv("RAG_COMPACT_RATIO", "0.25"))
+    RAG_COMPACT_MIN_DELETED = int(os.getenv("RAG_COMPACT_MIN_DELETED", "1000"))
+
+    # Shortened text-embedding-3 vectors (the API's `dimensions` parameter); 0 = full size
+    EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+
+    # Embedding cache: in-process LRU entries, optional SQLite file, disk budget
+    EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+    EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH")
+    EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(1 << 30)))
+    # Small concurrent embedding requests are sent together: wait up to
+    # EMBED_BATCH_WINDOW_MS (0 disables) or until EMBED_BATCH_MAX_INPUTS texts are queued
+    EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+    EMBED_BATCH_MAX_INPUTS = int(os.getenv("EMBED_BATCH_MAX_INPUTS", "64"))
+    # batches in flight at once; the next one is collected while these are sent
+    EMBED_BATCH_CONCURRENCY = int(os.getenv("EMBED_BATCH_CONCURRENCY", "4"))
+
+    # Bulk ingestion: chunk size, per-request embedding batch limits, parallelism
+    INGEST_CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", "512"))
+    INGEST_BATCH_TOKENS = int(os.getenv("INGEST_BATCH_TOKENS", "100000"))
+    INGEST_BATCH_INPUTS = int(os.getenv("INGEST_BATCH_INPUTS", "256"))
+    INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+    INGEST_JOB_TTL = float(os.getenv("INGEST_JOB_TTL", "3600"))  # seconds a finished job stays pollable
+
+    # Shared OpenAI client: connection pool, per-operation timeouts (seconds),
+    # retry policy and circuit breaker
+    OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+    OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+    OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+    OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "1") == "1"
+    OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+    OPENAI_TIMEOUT_CHAT = float(os.getenv("OPENAI_TIMEOUT_CHAT", "60"))
+    OPENAI_TIMEOUT_EMBEDDINGS = float(os.getenv("OPENAI_TIMEOUT_EMBEDDINGS", "20"))
+    OPENAI_TIMEOUT_IMAGES = float(os.getenv("OPENAI_TIMEOUT_IMAGES", "120"))
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+    OPENAI_RETRY_BASE = float(os.getenv("OPENAI_RETRY_BASE", "0.5"))
+    OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))
+    OPENAI_RETRY_BUDGET_RATIO = float(os.getenv("OPENAI_RETRY_BUDGET_RATIO", "0.2"))
+    OPENAI_BREAKER_THRESHOLD = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))
+    OPENAI_BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "30"))
+
+    # Generated images: on-disk cache (off unless a directory is set), bulk generation
+    IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR")
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1 << 30)))
+    IMAGE_BATCH_MAX_PROMPTS = int(os.getenv("IMAGE_BATCH_MAX_PROMPTS", "16"))
+    IMAGE_BATCH_CONCURRENCY = int(os.getenv("IMAGE_BATCH_CONCURRENCY", "4"))
+
+    # Token-bucket admission control (limits per minute, 0 = unlimited)
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory | sqlite (shared by workers)
+    RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "rate_limits.sqlite")
+    RATE_LIMIT_KEY_RPM = float(os.getenv("RATE_LIMIT_KEY_RPM", "0"))  # per API key
+    RATE_LIMIT_KEY_TPM = float(os.getenv("RATE_LIMIT_KEY_TPM", "0"))
+    RATE_LIMIT_MODELS = os.getenv("RATE_LIMIT_MODELS", "")  # "model=rpm/tpm,..."
+    RATE_LIMIT_UPSTREAM_RPM = float(os.getenv("RATE_LIMIT_UPSTREAM_RPM", "0"))  # all models together
+    RATE_LIMIT_UPSTREAM_TPM = float(os.getenv("RATE_LIMIT_UPSTREAM_TPM", "0"))
+    RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "10"))
+    RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "2"))  # queue for upstream budget, then shed
+    RATE_LIMIT_COMPLETION_TOKENS = int(os.getenv("RATE_LIMIT_COMPLETION_TOKENS", "500"))  # assumed per chat call
+
+    # Response cache for /chat and /ask_rag (exact + semantic tiers)
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+    RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "1") == "1"
+    RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+    RESPONSE_CACHE_TTL_CHAT = float(os.getenv("RESPONSE_CACHE_TTL_CHAT", "3600"))
+    RESPONSE_CACHE_TTL_RAG = float(os.getenv("RESPONSE_CACHE_TTL_RAG", "600"))
+
+    # Concurrent identical chat/image/embedding calls share one upstream call
+    SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+    # Production serving (gunicorn.conf.py): pre-fork workers x threads per worker
+    WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))  # 0 = one per CPU available to the process
+    WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))  # requests mostly wait on OpenAI, not the CPU
+    WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "120"))  # seconds before a stuck worker is restarted
+
+    # Stage timers, token counters and gauges served at /metrics (Prometheus format)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+    # add a Server-Timing header with the stage timings to every response
+    SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "0") == "1"
+
+    # Chat memory store: memory | sqlite | redis
+    MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory")
+    MEMORY_SQLITE_PATH = os.getenv("MEMORY_SQLITE_PATH", "chat_memory.sqlite")
+    MEMORY_REDIS_URL = os.getenv("MEMORY_REDIS_URL", "redis://localhost:6379/0")
+    MEMORY_HISTORY_MESSAGES = int(os.getenv("MEMORY_HISTORY_MESSAGES", "5"))  # sent to the model
+    MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", "50"))  # ring buffer per session
+    MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", "3600"))
+    MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "10000"))
+    MEMORY_MAX_BYTES = int(os.getenv("MEMORY_MAX_BYTES", str(256 << 20)))
+
+    # Prompt packing for /chat_rag_memory
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    CONTEXT_RAG_SHARE = float(os.getenv("CONTEXT_RAG_SHARE", "0.6"))  # of the budget left after the query
+    SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
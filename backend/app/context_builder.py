@@ -0,0 +1,179 @@
+# app/context_builder.py
+"""Token-budgeted prompt assembly for answer_with_memory_and_rag.
+
+The prompt is packed into CONTEXT_TOKEN_BUDGET tokens:
+  - the user query and instructions are always kept
+  - retrieved chunks are added in relevance order, up to CONTEXT_RAG_SHARE
+    of the remaining budget
+  - chat history is added newest first with whatever is left, after the
+    session's running summary
+Unused budget on either side is handed to the other.
+
+Turns that slide out of the history window are folded into the running
+summary instead of being dropped (see `remember_turn`). Turns of one
+session are stored, and folded, one at a time and in order.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import memory_service, openai_client
+from app.config import Config
+from app.openai_service import CHAT_MODEL, _is_fake_mode
+from app.tokens import count_tokens, truncate_tokens
+
+# chat format overhead per message (role, separators)
+MESSAGE_OVERHEAD = 4
+
+CONTEXT_HEADER = "Use the following context:\n"
+NO_CONTEXT = "No external context found."
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+log = logging.getLogger(__name__)
+
+# summaries are updated off the request path in real mode
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+# striped per-session locks around reading the history and appending a turn
+_session_locks = [threading.Lock() for _ in range(64)]
+# session id -> messages waiting to be folded; present while that session's fold task runs
+_pending_folds = {}
+_pending_lock = threading.Lock()
+
+
+def _tokens(text):
+    return count_tokens(text) + MESSAGE_OVERHEAD
+
+
+def build_messages(session_id, user_query, chunks, budget=None, rag_share=None):
+    """Return (messages, usage) for a memory+RAG completion.
+
+    usage = {"prompt_tokens": packed estimate,
+             "prompt_tokens_saved": unbudgeted estimate - packed estimate}
+    """
+    budget = budget or Config.CONTEXT_TOKEN_BUDGET
+    rag_share = Config.CONTEXT_RAG_SHARE if rag_share is None else rag_share
+    history = memory_service.get_memory(session_id)
+    summary = memory_service.get_summary(session_id)
+
+    fixed = _tokens(user_query) + _tokens(CONTEXT_HEADER)
+    available = max(0, budget - fixed)
+    chunk_costs = [count_tokens(c) + 1 for c in chunks]  # +1 for the joining blank line
+    history_costs = [_tokens(m["content"]) for m in history]
+
+    # 1. chunks by relevance within their share
+    rag_budget = int(available * rag_share)
+    picked_chunks, rag_used = _pick(chunk_costs, rag_budget)
+
+    # 2. summary, then history newest first, with the rest
+    history_budget = available - rag_used
+    summary_cost = _tokens(SUMMARY_HEADER + summary) if summary else 0
+    use_summary = 0 < summary_cost <= history_budget
+    history_budget -= summary_cost if use_summary else 0
+    picked_history, history_used = 0, 0
+    for cost in reversed(history_costs):
+        if history_used + cost > history_budget:
+            break  # keep the history contiguous
+        picked_history += 1
+        history_used += cost
+
+    # 3. hand what history did not use back to the chunks
+    leftover = history_budget - history_used
+    if leftover > 0:
+        more, _ = _pick(
+            [c if i not in picked_chunks else None for i, c in enumerate(chunk_costs)], leftover
+        )
+        picked_chunks |= more
+
+    context = [chunks[i] for i in sorted(picked_chunks)]
+    context_text = "\n\n".join(context) if context else NO_CONTEXT
+    messages = []
+    if use_summary:
+        messages.append({"role": "system", "content": SUMMARY_HEADER + summary})
+    messages += history[len(history) - picked_history:] if picked_history else []
+    messages += [
+        {"role": "system", "content": CONTEXT_HEADER + context_text},
+        {"role": "user", "content": user_query},
+    ]
+
+    packed = sum(_tokens(m["content"]) for m in messages)
+    unbudgeted = (
+        sum(history_costs)
+        + _tokens(CONTEXT_HEADER + ("\n\n".join(chunks) if chunks else NO_CONTEXT))
+        + _tokens(user_query)
+    )
+    return messages, {"prompt_tokens": packed, "prompt_tokens_saved": max(0, unbudgeted - packed)}
+
+
+def _pick(costs, budget):
+    """Greedy in order: take every item that still fits. Returns (indices, used)."""
+    picked, used = set(), 0
+    for i, cost in enumerate(costs):
+        if cost is not None and used + cost <= budget:
+            picked.add(i)
+            used += cost
+    return picked, used
+
+
+def remember_turn(session_id, user_query, response):
+    """Store the turn and fold messages leaving the history window into the summary."""
+    window = Config.MEMORY_HISTORY_MESSAGES
+    lock = _session_locks[hash(session_id) % len(_session_locks)]
+    with lock:
+        # concurrent turns would otherwise see the same window and fold it twice
+        before = memory_service.get_memory(session_id)
+        memory_service.add_to_memory(session_id, "user", user_query)
+        memory_service.add_to_memory(session_id, "assistant", response)
+        leaving = before[: max(0, len(before) + 2 - window)]
+        if leaving and _is_fake_mode():
+            _fold(session_id, leaving)
+    if not leaving or _is_fake_mode():
+        return
+    with _pending_lock:
+        running = session_id in _pending_folds
+        _pending_folds.setdefault(session_id, []).extend(leaving)
+    if not running:
+        _summary_executor.submit(_drain_folds, session_id)
+
+
+def _drain_folds(session_id):
+    # the only fold task of this session, so no summary update is lost;
+    # turns that left the window meanwhile are folded together, in order
+    while True:
+        with _pending_lock:
+            leaving = _pending_folds[session_id]
+            if not leaving:
+                del _pending_folds[session_id]
+                return
+            _pending_folds[session_id] = []
+        try:
+            _fold(session_id, leaving)
+        except Exception:
+            log.exception("Updating the summary of session %s failed", session_id)
+
+
+def _fold(session_id, leaving):
+    summary = memory_service.get_summary(session_id)
+    memory_service.set_summary(session_id, summarize(summary, leaving))
+
+
+def summarize(summary, messages):
+    """Fold `messages` into the running `summary`, capped at SUMMARY_MAX_TOKENS."""
+    max_tokens = Config.SUMMARY_MAX_TOKENS
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if _is_fake_mode():
+        # deterministic extractive summary: the most recent text that fits
+        combined = f"{summary}\n{transcript}" if summary else transcript
+        return truncate_tokens(combined, max_tokens, keep="end")
+
+    completion = openai_client.create_chat_completion(
+        model=CHAT_MODEL,
+        max_tokens=max_tokens,
+        messages=[
+            {"role": "system", "content": (
+                "Update the running summary of a conversation with the new messages. "
+                "Keep names, facts, decisions and open questions; be concise."
+            )},
+            {"role": "user", "content": f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"},
+        ],
+    )
+    return completion.choices[0].message.content
@@ -0,0 +1,132 @@
+# app/embedding_batcher.py
+"""Micro-batching of small embedding requests.
+
+Concurrent `/ask_rag`-style callers each embed a single query. Instead of
+one upstream request per query, `submit` queues the texts and a worker
+thread sends everything that arrived within `window_ms` of the first
+queued request (or as soon as `max_inputs` texts are waiting) as one
+embeddings call, then resolves each caller's future with its own slice of
+the result. Identical texts within a batch are sent once.
+
+Batches are sent from a pool of `concurrency` threads, so the next batch
+is collected while earlier ones (and their retries) are still in flight.
+When every sender is busy the queue keeps filling and the next batch
+leaves, fuller, as soon as one is free.
+
+Futures are `concurrent.futures.Future`s, so threaded callers block on
+`result()` and coroutines await `asyncio.wrap_future(...)`. Requests with
+`max_inputs` or more texts (bulk ingest) gain nothing from batching;
+callers send those directly.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app.metrics import Histogram
+
+QUEUE_MS_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+
+class EmbeddingBatcher:
+    def __init__(self, embed, window_ms=5.0, max_inputs=64, concurrency=4):
+        """`embed(texts)` returns one embedding per text, in order."""
+        self.embed = embed
+        self.window_ms = window_ms
+        self.max_inputs = max_inputs
+        self.concurrency = concurrency
+        self._pending = deque()  # (texts, future, queued_at)
+        self._pending_inputs = 0
+        self._cond = threading.Condition()
+        self._worker = None
+        self._senders = None
+        self._free_senders = None
+        self._pid = None
+        self.queue_ms = Histogram(QUEUE_MS_BUCKETS)
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.batches = 0
+        self.requests = 0
+
+    def submit(self, texts):
+        """Queue `texts`; the returned future resolves to their embeddings."""
+        future = Future()
+        with self._cond:
+            self._ensure_worker()
+            self._pending.append((list(texts), future, time.perf_counter()))
+            self._pending_inputs += len(texts)
+            self.requests += 1
+            self._cond.notify()
+        return future
+
+    def _ensure_worker(self):
+        # threads do not survive fork, so a forked worker process starts its own
+        if self._worker is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._senders = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embedding-sender")
+            self._free_senders = threading.Semaphore(self.concurrency)
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            # wait for a free sender first, so a batch is collected from everything queued meanwhile
+            self._free_senders.acquire()
+            batch = self._next_batch()
+            self.batches += 1
+            self._senders.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            self._dispatch(batch)
+        finally:
+            self._free_senders.release()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0][2] + self.window_ms / 1000
+            while self._pending_inputs < self.max_inputs:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_inputs):
+                texts, future, queued_at = self._pending.popleft()
+                batch.append((texts, future, queued_at))
+                size += len(texts)
+            self._pending_inputs -= size
+            return batch
+
+    def _dispatch(self, batch):
+        now = time.perf_counter()
+        unique = {}
+        for texts, _, queued_at in batch:
+            self.queue_ms.observe(1000 * (now - queued_at))
+            for text in texts:
+                unique.setdefault(text, len(unique))
+        self.batch_size.observe(len(unique))
+
+        try:
+            vectors = self.embed(list(unique))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for texts, future, _ in batch:
+            future.set_result([vectors[unique[t]] for t in texts])
+
+    def stats(self):
+        return {
+            "window_ms": self.window_ms,
+            "max_inputs": self.max_inputs,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "batches": self.batches,
+            "queue_ms": self.queue_ms.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
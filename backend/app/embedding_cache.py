@@ -0,0 +1,177 @@
+# app/embedding_cache.py
+"""Content-addressed embedding cache.
+
+Keys are (model, sha256(text)). Lookups go through an in-process LRU first,
+then an optional SQLite tier that survives restarts and is shared by all
+workers on the host. The SQLite tier is bounded by total vector bytes and
+evicts the least recently used rows.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def cache_key(model, text):
+    return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries=10000, path=None, max_bytes=1 << 30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._path = path
+        self._disk_bytes = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+        if path:
+            self._open(path)
+
+    def _open(self, path):
+        # workers share the file: wait for another writer's lock instead of failing at once
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vec BLOB NOT NULL,"
+            " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+        )
+        row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        self._disk_bytes = row[0]
+
+    def reopen(self):
+        """Reconnect the SQLite tier; a forked worker must not use its parent's connection."""
+        if self._path:
+            self._lock = threading.Lock()
+            self._open(self._path)
+
+    def get_many(self, keys):
+        """Return a list aligned with `keys`; None marks a miss."""
+        found = [None] * len(keys)
+        disk_lookup = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    found[i] = vec
+                    self.hits_memory += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup and self._db is not None:
+                for key, vec in self._disk_get(list(disk_lookup)).items():
+                    for i in disk_lookup.pop(key):
+                        found[i] = vec
+                        self.hits_disk += 1
+                    self._remember(key, vec)
+
+            self.misses += sum(len(v) for v in disk_lookup.values())
+        return found
+
+    def put_many(self, keys, vectors):
+        with self._lock:
+            for key, vec in zip(keys, vectors):
+                self._remember(key, vec)
+            if self._db is not None:
+                self._disk_put(keys, vectors)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+                "memory_entries": len(self._lru),
+                "disk_bytes": self._disk_bytes,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._disk_bytes = 0
+
+    # -- internals (caller holds self._lock) --
+
+    def _remember(self, key, vec):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _disk_get(self, keys):
+        result = {}
+        now = time.time()
+        # stay well under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self._db.execute(
+                f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                result[key] = np.frombuffer(blob, dtype=np.float32).copy()
+            if rows:
+                self._db.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})",
+                    [now, *chunk],
+                )
+        return result
+
+    def _disk_put(self, keys, vectors):
+        now = time.time()
+        rows = []
+        for key, vec in zip(keys, vectors):
+            blob = np.asarray(vec, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+        grown = 0
+        self._db.execute("BEGIN")
+        try:
+            for row in rows:
+                old = self._db.execute(
+                    "SELECT size FROM embeddings WHERE key = ?", (row[0],)
+                ).fetchone()
+                grown += row[2] - (old[0] if old else 0)
+                self._db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", row)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._disk_bytes += grown
+        if self._disk_bytes > self.max_bytes:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # other workers write to the same file, so resync the byte count first
+        self._disk_bytes = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()[0]
+        # drop LRU rows until we are back to 90% of the budget
+        target = int(self.max_bytes * 0.9)
+        while self._disk_bytes > target:
+            rows = self._db.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            self._db.executemany("DELETE FROM embeddings WHERE key = ?", [(r[0],) for r in rows])
+            self._disk_bytes -= sum(r[1] for r in rows)
+            self.evictions += len(rows)
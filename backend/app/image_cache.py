@@ -0,0 +1,187 @@
+# app/image_cache.py
+"""Content-addressed on-disk cache of generated images.
+
+An image is stored once per (model, prompt, size) as
+<IMAGE_CACHE_DIR>/<id[:2]>/<id>.png, where the id is the sha256 of the key.
+The id doubles as the HTTP ETag and as the path segment of GET /images/<id>.
+Files are written to a temporary name and renamed into place, so readers
+(and other workers sharing the directory) never see a partial image.
+
+Lookups return an open file rather than a path: the handle stays readable
+when another request or worker evicts the file before it is served.
+
+The API's base64 payload is decoded into the file in slices, and the base64
+form is re-encoded from the file in slices (`iter_base64`), so neither
+encoding of a large image has to sit next to the other in memory.
+
+Total size is bounded by IMAGE_CACHE_MAX_BYTES across all workers sharing
+the directory: sizes and last-served times live in a SQLite index next to
+the images (INDEX_FILE), and beyond the cap the least recently served
+images are removed, oldest first, without scanning the directory. A hit
+refreshes its image's time at most every `touch_seconds`, so hits rarely
+write to the index.
+"""
+import base64
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+INDEX_FILE = "index.sqlite"
+
+# base64 is decoded/encoded in whole 4-char/3-byte groups
+DECODE_CHUNK = 4 * 64 * 1024
+ENCODE_CHUNK = 3 * 64 * 1024
+
+
+def image_id(model, prompt, size=None):
+    return hashlib.sha256(f"{model}\x00{size or ''}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+def iter_base64(f, chunk_size=ENCODE_CHUNK):
+    """Base64 of the open binary file `f`, as ASCII chunks; closes `f`."""
+    with f:
+        while chunk := f.read(chunk_size):
+            yield base64.b64encode(chunk).decode("ascii")
+
+
+class ImageCache:
+    def __init__(self, directory, max_bytes=1 << 30, touch_seconds=10.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.touch_seconds = touch_seconds
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._open()
+
+    def reopen(self):
+        """Reconnect the index; a forked worker must not use its parent's connection."""
+        self._lock = threading.Lock()
+        try:
+            self._db.close()
+        except sqlite3.Error:
+            pass
+        self._open()
+
+    def _open(self):
+        self._db = sqlite3.connect(os.path.join(self.directory, INDEX_FILE), check_same_thread=False,
+                                   isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS images (id TEXT PRIMARY KEY, size INTEGER NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_by_use ON images (used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS total (bytes INTEGER NOT NULL)")
+        with self._transaction():
+            if self._db.execute("SELECT bytes FROM total").fetchone() is None:
+                self._index_files()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across workers
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _index_files(self):
+        """Index images already in the directory (a new index); runs once per directory."""
+        rows = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".png") and _ID_RE.match(name[:-4]):
+                    stat = os.stat(os.path.join(root, name))
+                    rows.append((name[:-4], stat.st_size, stat.st_mtime))
+        self._db.executemany("INSERT OR REPLACE INTO images (id, size, used) VALUES (?, ?, ?)", rows)
+        self._db.execute("INSERT INTO total (bytes) VALUES (?)", (sum(row[1] for row in rows),))
+
+    def path(self, image_id):
+        return os.path.join(self.directory, image_id[:2], f"{image_id}.png")
+
+    def open(self, image_id):
+        """The cached image opened for binary reading, or None."""
+        if not _ID_RE.match(image_id):
+            return None
+        try:
+            f = open(self.path(image_id), "rb")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            self._touch(image_id)
+        except BaseException:
+            f.close()
+            raise
+        self.hits += 1
+        return f
+
+    def _touch(self, image_id):
+        # LRU order only needs to be roughly right: most hits just read (WAL readers do not block)
+        # and the write lock is taken when the stored time is older than `touch_seconds`
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT used FROM images WHERE id = ?", (image_id,)).fetchone()
+            if row is not None and now - row[0] > self.touch_seconds:
+                self._db.execute("UPDATE images SET used = ? WHERE id = ?", (now, image_id))
+
+    def put_base64(self, image_id, image_base64):
+        """Decode `image_base64` into the cache; returns the image opened for reading."""
+        path = self.path(image_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        f = os.fdopen(fd, "w+b")
+        try:
+            for start in range(0, len(image_base64), DECODE_CHUNK):
+                f.write(base64.b64decode(image_base64[start:start + DECODE_CHUNK]))
+            f.flush()
+            os.replace(tmp, path)
+        except BaseException:
+            f.close()
+            os.unlink(tmp)
+            raise
+        try:
+            self._account(image_id, os.fstat(f.fileno()).st_size)
+        except BaseException:
+            f.close()
+            raise
+        f.seek(0)
+        return f
+
+    def _account(self, image_id, size):
+        with self._transaction():
+            row = self._db.execute("SELECT size FROM images WHERE id = ?", (image_id,)).fetchone()
+            total = self._db.execute("SELECT bytes FROM total").fetchone()[0] + size - (row[0] if row else 0)
+            self._db.execute("INSERT OR REPLACE INTO images (id, size, used) VALUES (?, ?, ?)",
+                             (image_id, size, time.time()))
+            while total > self.max_bytes:
+                oldest = self._db.execute(  # never the image just written
+                    "SELECT id, size FROM images WHERE id != ? ORDER BY used LIMIT 64", (image_id,)
+                ).fetchall()
+                if not oldest:
+                    break
+                for old_id, old_size in oldest:
+                    if total <= self.max_bytes:
+                        break
+                    try:
+                        os.unlink(self.path(old_id))
+                    except FileNotFoundError:
+                        pass
+                    self._db.execute("DELETE FROM images WHERE id = ?", (old_id,))
+                    total -= old_size
+            self._db.execute("UPDATE total SET bytes = ?", (total,))
+
+    def stats(self):
+        with self._lock:
+            total = self._db.execute("SELECT bytes FROM total").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "bytes": total}
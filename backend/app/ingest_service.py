@@ -0,0 +1,268 @@
+# app/ingest_service.py
+"""Bulk ingestion pipeline for the RAG store.
+
+texts -> chunks (<= INGEST_CHUNK_TOKENS) -> token-budgeted batches ->
+embedded concurrently (bounded; retried by the shared OpenAI client's
+policy, see app.openai_client) -> appended to the index batch by batch,
+so a failed batch does not lose the others. Chunks
+already stored with identical text and metadata are skipped before
+embedding. A document may be given as a (text, metadata) pair; each of its
+chunks carries that metadata.
+
+Large uploads run as background jobs; their input is spooled to a temp
+file and read back line by line, so the corpus is never fully in memory.
+Finished jobs can be polled for INGEST_JOB_TTL seconds.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app import rag_service
+from app.vector_store import DEFAULT_COLLECTION, content_id
+from app.config import Config
+from app.tokens import count_tokens
+
+MAX_JOB_ERRORS = 20  # error messages kept per job
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+# --- chunking / batching ---
+
+def chunk_text(text, max_tokens=None):
+    """Split `text` into chunks of at most ~max_tokens, on paragraph then word boundaries."""
+    max_tokens = max_tokens or Config.INGEST_CHUNK_TOKENS
+    text = text.strip()
+    if not text:
+        return []
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    chunks, current, current_tokens = [], [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        for word in paragraph.split():
+            tokens = count_tokens(word) + 1
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += tokens
+        if current and current_tokens > max_tokens // 2:
+            # close the chunk on a paragraph boundary when it is reasonably full
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def iter_batches(texts, max_tokens=None, max_inputs=None, with_metadata=False):
+    """Chunk `texts` (any iterable) and pack the chunks into batches.
+
+    With `with_metadata` the items are (text, metadata) pairs and so are the
+    batch entries, each chunk keeping its document's metadata.
+    """
+    max_tokens = max_tokens or Config.INGEST_BATCH_TOKENS
+    max_inputs = max_inputs or Config.INGEST_BATCH_INPUTS
+    batch, batch_tokens = [], 0
+    for item in texts:
+        text, metadata = item if with_metadata else (item, None)
+        for chunk in chunk_text(text):
+            tokens = count_tokens(chunk)
+            if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_inputs):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append((chunk, metadata) if with_metadata else chunk)
+            batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+# --- jobs ---
+
+class IngestJob:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.documents = 0
+        self.chunks_stored = 0
+        self.chunks_failed = 0
+        self.chunks_duplicate = 0
+        self.batches_done = 0
+        self.errors = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def _count_document(self):
+        with self._lock:
+            self.documents += 1
+
+    def _batch_done(self, size, error=None, duplicates=0):
+        with self._lock:
+            self.batches_done += 1
+            if error is None:
+                self.chunks_stored += size - duplicates
+                self.chunks_duplicate += duplicates
+            else:
+                self.chunks_failed += size
+                if len(self.errors) < MAX_JOB_ERRORS:
+                    self.errors.append(str(error))
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "documents": self.documents,
+                "chunks_stored": self.chunks_stored,
+                "chunks_failed": self.chunks_failed,
+                "chunks_duplicate": self.chunks_duplicate,
+                "batches_done": self.batches_done,
+                "errors": list(self.errors),
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+def ingest(texts, job=None, concurrency=None, collection=DEFAULT_COLLECTION):
+    """Run the pipeline over `texts` into `collection` in the calling thread; returns the job.
+
+    Items of `texts` are strings or (text, metadata) pairs.
+    """
+    job = job or IngestJob()
+    concurrency = concurrency or Config.INGEST_CONCURRENCY
+    job.status = "running"
+
+    def counted(items):
+        for item in items:
+            job._count_document()
+            yield (item, None) if isinstance(item, str) else item
+
+    def store(batch):
+        # exact duplicates (of each other or of stored chunks) are not re-embedded
+        unique = {content_id(text): (text, metadata) for text, metadata in batch}
+        ids = list(unique)
+        texts, metadatas = [t for t, _ in unique.values()], [m for _, m in unique.values()]
+        todo = rag_service.get_store(collection).changed(ids, texts, metadatas)
+        if todo:
+            fresh = [texts[i] for i in todo]
+            rag_service.add_embeddings(
+                fresh, rag_service.embed_text(fresh), snapshot=False,
+                collection=collection, ids=[ids[i] for i in todo],
+                metadatas=[metadatas[i] for i in todo],
+            )
+        return len(batch) - len(todo)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            in_flight = {}
+            for batch in iter_batches(counted(texts), with_metadata=True):
+                # bounded queue: never read far ahead of the embedding workers
+                while len(in_flight) >= concurrency * 2:
+                    _collect(job, in_flight, wait(in_flight, return_when=FIRST_COMPLETED).done)
+                in_flight[pool.submit(store, batch)] = len(batch)
+            _collect(job, in_flight, wait(in_flight).done)
+        job.status = "completed" if job.chunks_failed == 0 else "completed_with_errors"
+    except Exception as e:
+        job.status = "failed"
+        job.errors.append(str(e))
+    finally:
+        job.finished_at = time.time()
+        if job.chunks_stored:
+            rag_service.snapshot_store(collection)
+    return job
+
+
+def _collect(job, in_flight, done):
+    for future in done:
+        size = in_flight.pop(future)
+        error = future.exception()
+        job._batch_done(size, error, duplicates=0 if error else future.result())
+
+
+def start_job(texts, on_done=None, collection=DEFAULT_COLLECTION):
+    """Run `ingest(texts)` in a background thread and register the job."""
+    job = IngestJob()
+    with _jobs_lock:
+        _prune_jobs(time.time() - Config.INGEST_JOB_TTL)
+        _jobs[job.id] = job
+
+    def run():
+        try:
+            ingest(texts, job, collection=collection)
+        finally:
+            if on_done is not None:
+                on_done()
+
+    threading.Thread(target=run, daemon=True, name=f"ingest-{job.id}").start()
+    return job
+
+
+def _prune_jobs(finished_before):
+    # caller holds _jobs_lock
+    for job_id in [j.id for j in _jobs.values() if j.finished_at is not None and j.finished_at < finished_before]:
+        del _jobs[job_id]
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def start_file_job(path, fmt="ndjson", collection=DEFAULT_COLLECTION):
+    """Ingest a spooled file in the background; the file is removed afterwards."""
+    return start_job(read_file(path, fmt), on_done=lambda: os.unlink(path), collection=collection)
+
+
+def spool(stream):
+    """Copy a request stream to a temp file in fixed-size chunks; returns its path."""
+    fd, path = tempfile.mkstemp(prefix="ingest-", suffix=".upload")
+    with os.fdopen(fd, "wb") as f:
+        while True:
+            block = stream.read(1 << 20)
+            if not block:
+                break
+            f.write(block)
+    return path
+
+
+def read_file(path, fmt):
+    """Yield documents from a spooled file.
+
+    ndjson: one JSON string or {"text": ..., "metadata": {...}} object per
+            line; objects are yielded as (text, metadata) pairs.
+    text:   documents separated by blank lines.
+    """
+    with open(path, encoding="utf-8") as f:
+        if fmt == "ndjson":
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    raise ValueError(f"Invalid JSON on line {lineno}")
+                if isinstance(item, dict):
+                    text = item.get("text")
+                    if isinstance(text, str) and text.strip():
+                        yield text, item.get("metadata")
+                elif isinstance(item, str) and item.strip():
+                    yield item
+        else:
+            paragraph = []
+            for line in f:
+                if line.strip():
+                    paragraph.append(line)
+                elif paragraph:
+                    yield "".join(paragraph)
+                    paragraph = []
+            if paragraph:
+                yield "".join(paragraph)
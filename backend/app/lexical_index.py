@@ -0,0 +1,162 @@
+# app/lexical_index.py
+"""In-process BM25 inverted index for the RAG store.
+
+Each term maps to array-backed postings (parallel int32 row / tf arrays
+that grow by doubling), so adding a batch only appends and a query is a
+handful of vectorized numpy operations over the query terms' postings,
+without any embedding call. Callers serialize `add` against `search`
+(the vector store does so with its reader-writer lock).
+
+Rows are the vector store's rows. Rows deleted from the store keep their
+postings until the next compaction rebuilds the index; callers pass the
+tombstoned rows to `search` to skip them.
+"""
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+# identifiers like "AB-1234", "ERR_CONN_RESET" or "v2.3.1" stay one token;
+# their parts are indexed too so "1234" also finds "AB-1234"
+_TOKEN_RE = re.compile(r"\w+(?:[-.:/]\w+)*")
+_PART_RE = re.compile(r"[-.:/]")
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if _PART_RE.search(token):
+            tokens.extend(p for p in _PART_RE.split(token) if p)
+    return tokens
+
+
+class _Postings:
+    """Row / tf arrays for one term.
+
+    New entries are buffered in small lists and moved into the arrays
+    FLUSH_EVERY at a time, which keeps incremental adds cheap for the many
+    terms that only gain an entry or two per batch.
+    """
+
+    FLUSH_EVERY = 64
+    __slots__ = ("rows", "tfs", "n", "_pending_rows", "_pending_tfs")
+
+    def __init__(self):
+        self.rows = np.empty(0, dtype=np.int32)
+        self.tfs = np.empty(0, dtype=np.float32)
+        self.n = 0
+        self._pending_rows = []
+        self._pending_tfs = []
+
+    def __len__(self):
+        return self.n + len(self._pending_rows)
+
+    def append(self, row, tf):
+        self._pending_rows.append(row)
+        self._pending_tfs.append(tf)
+        if len(self._pending_rows) >= self.FLUSH_EVERY:
+            self._flush()
+
+    def _flush(self):
+        end = self.n + len(self._pending_rows)
+        if end > len(self.rows):
+            size = max(end, len(self.rows) * 2)
+            self.rows = np.resize(self.rows, size)
+            self.tfs = np.resize(self.tfs, size)
+        self.rows[self.n:end] = self._pending_rows
+        self.tfs[self.n:end] = self._pending_tfs
+        self.n = end
+        self._pending_rows, self._pending_tfs = [], []
+
+    def arrays(self):
+        if not self._pending_rows:
+            return self.rows[:self.n], self.tfs[:self.n]
+        return (
+            np.concatenate([self.rows[:self.n], np.array(self._pending_rows, dtype=np.int32)]),
+            np.concatenate([self.tfs[:self.n], np.array(self._pending_tfs, dtype=np.float32)]),
+        )
+
+
+class BM25Index:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._lengths = np.empty(1024, dtype=np.float32)
+        self._n_docs = 0
+        self._total_length = 0.0
+
+    def __len__(self):
+        return self._n_docs
+
+    @staticmethod
+    def analyze(texts):
+        """Term counts per text; done before taking the store's write lock."""
+        return [Counter(tokenize(t)) for t in texts]
+
+    def add(self, analyzed):
+        """Append documents (as returned by `analyze`) as the next rows."""
+        for counts in analyzed:
+            row = self._n_docs
+            if row == len(self._lengths):
+                self._lengths = np.resize(self._lengths, row * 2)
+            length = sum(counts.values())
+            self._lengths[row] = length
+            self._total_length += length
+            self._n_docs += 1
+            for term, tf in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = _Postings()
+                postings.append(row, tf)
+
+    def search(self, query, top_k, exclude=None, allow=None):
+        """Return [(row, score)] of the `top_k` best BM25 matches for `query`.
+
+        `exclude` is an optional collection of rows to skip; `allow` an
+        optional packed little-endian bitmap of the only rows to consider.
+        """
+        if not self._n_docs:
+            return []
+        avg_length = self._total_length / self._n_docs or 1.0
+        rows, scores = [], []
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            r, tf = postings.arrays()
+            df = len(r)
+            idf = math.log(1 + (self._n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[r] / avg_length)
+            rows.append(r)
+            scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not rows:
+            return []
+
+        rows, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        if exclude:
+            keep = ~np.isin(rows, np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+            rows, totals = rows[keep], totals[keep]
+        if allow is not None:
+            keep = (allow[rows >> 3] >> (rows & 7).astype(np.uint8)) & 1 == 1
+            rows, totals = rows[keep], totals[keep]
+        if len(rows) > top_k:
+            best = np.argpartition(-totals, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(rows))
+        best = best[np.argsort(-totals[best], kind="stable")]
+        return [(int(rows[i]), float(totals[i])) for i in best]
+
+
+def reciprocal_rank_fusion(result_lists, top_k, k=60):
+    """Fuse ranked hit lists by id: score = sum of 1 / (k + rank) over the lists."""
+    fused, hits = {}, {}
+    for results in result_lists:
+        for rank, hit in enumerate(results, 1):
+            fused[hit["id"]] = fused.get(hit["id"], 0.0) + 1.0 / (k + rank)
+            hits.setdefault(hit["id"], hit)
+    best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return [{**hits[doc_id], "score": fused[doc_id]} for doc_id in best]
@@ -1,6 +1,8 @@
-from app import create_app
+from app import create_app, serving
 
 app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    # development server; in production: gunicorn -c gunicorn.conf.py app.main:app
+    serving.warm_clients_in_background()
+    app.run(host="0.0.0.0", port=5000, threaded=True)
@@ -1,17 +1,402 @@
 # app/memory_service.py
-from collections import defaultdict
+"""Chat memory per user/session.
+
+Sessions live in a bounded store: each session is a ring buffer of the
+last MEMORY_MAX_MESSAGES messages, idle sessions expire after
+MEMORY_IDLE_TTL seconds, and the least recently used sessions are evicted
+once MEMORY_MAX_SESSIONS or MEMORY_MAX_BYTES is exceeded.
+
+MEMORY_BACKEND selects where sessions live:
+  - memory  per-process (default)
+  - sqlite  file at MEMORY_SQLITE_PATH in WAL mode, shared by all workers
+  - redis   MEMORY_REDIS_URL (Redis or any compatible server), shared by hosts
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from app.config import Config
+from app.metrics import registry, stage
+
+# rough per-message overhead of the dict + deque slot, for memory accounting
+_MESSAGE_OVERHEAD = 200
+
+
+def _message_size(message):
+    return len(message["content"].encode("utf-8")) + _MESSAGE_OVERHEAD
+
+
+class InMemorySessionStore:
+    def __init__(self, max_messages, idle_ttl, max_sessions, max_bytes):
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # session_id -> [deque, last_access, bytes, summary]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def append(self, session_id, message):
+        now = time.time()
+        with self._lock:
+            session = self._session(session_id, now)
+            messages = session[0]
+            if len(messages) == messages.maxlen:
+                dropped = _message_size(messages[0])
+                session[2] -= dropped
+                self._bytes -= dropped
+            messages.append(message)
+            size = _message_size(message)
+            session[2] += size
+            self._bytes += size
+            self._evict(now)
+
+    def recent(self, session_id, n):
+        with self._lock:
+            session = self._touch(session_id, time.time())
+            return list(session[0])[-n:] if session else []
+
+    def get_summary(self, session_id):
+        with self._lock:
+            session = self._touch(session_id, time.time())
+            return session[3] if session else ""
+
+    def set_summary(self, session_id, summary):
+        now = time.time()
+        with self._lock:
+            session = self._session(session_id, now)
+            delta = len(summary.encode("utf-8")) - len(session[3].encode("utf-8"))
+            session[2] += delta
+            self._bytes += delta
+            session[3] = summary
+            self._evict(now)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "evictions": self.evictions,
+            }
+
+    def _session(self, session_id, now):
+        session = self._touch(session_id, now)
+        if session is None:
+            session = [deque(maxlen=self.max_messages), now, 0, ""]
+            self._sessions[session_id] = session
+        return session
+
+    def _touch(self, session_id, now):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if now - session[1] > self.idle_ttl:
+            self._drop(session_id)
+            self.evictions += 1
+            return None
+        session[1] = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session[2]
+
+    def _evict(self, now):
+        # oldest-first order means idle sessions sit at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            over_budget = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if not over_budget and now - session[1] <= self.idle_ttl:
+                break
+            self._drop(session_id)
+            self.evictions += 1
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file (WAL), so every worker sees the same history."""
+
+    def __init__(self, path, max_messages, idle_ttl, max_sessions, max_bytes):
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, id);
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_access REAL NOT NULL,
+                summary TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions(last_access);
+            """
+        )
+        columns = [r[1] for r in self._db.execute("PRAGMA table_info(sessions)")]
+        if "summary" not in columns:  # files created before summaries existed
+            self._db.execute("ALTER TABLE sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+        self._lock = threading.Lock()
+        self._appends = 0
+        self.evictions = 0
+
+    def append(self, session_id, message):
+        now = time.time()
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(session_id, now)
+                db.execute(
+                    "INSERT INTO messages (session_id, role, content, size) VALUES (?, ?, ?, ?)",
+                    (session_id, message["role"], message["content"], _message_size(message)),
+                )
+                # ring buffer: keep only the newest max_messages rows
+                db.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND id NOT IN ("
+                    " SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                    (session_id, session_id, self.max_messages),
+                )
+                db.execute(
+                    "INSERT INTO sessions (session_id, last_access) VALUES (?, ?)"
+                    " ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+                    (session_id, now),
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            self._appends += 1
+            if self._appends % 100 == 0:
+                self._evict(now)
+
+    def recent(self, session_id, n):
+        now = time.time()
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._expire(session_id, now):
+                    db.execute("COMMIT")
+                    return []
+                db.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+                rows = db.execute(
+                    "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, n),
+                ).fetchall()
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def get_summary(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summary, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.idle_ttl:
+            return ""
+        return row[0]
+
+    def set_summary(self, session_id, summary):
+        now = time.time()
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(session_id, now)
+                db.execute(
+                    "INSERT INTO sessions (session_id, last_access, summary) VALUES (?, ?, ?)"
+                    " ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary,"
+                    " last_access = excluded.last_access",
+                    (session_id, now, summary),
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def clear(self, session_id):
+        with self._lock:
+            self._delete_sessions([session_id])
+
+    def stats(self):
+        with self._lock:
+            sessions = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+        return {"backend": "sqlite", "sessions": sessions, "bytes": size, "evictions": self.evictions}
+
+    def _expire(self, session_id, now):
+        # caller holds the lock inside a transaction; an idle session's
+        # history is deleted before it is touched again, so it cannot come
+        # back. Returns True if there is no live session (any more).
+        row = self._db.execute(
+            "SELECT last_access FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or now - row[0] <= self.idle_ttl:
+            return row is None
+        self._db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self.evictions += 1
+        return True
+
+    def _delete_sessions(self, session_ids):
+        if not session_ids:
+            return
+        rows = [(s,) for s in session_ids]
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany("DELETE FROM messages WHERE session_id = ?", rows)
+            self._db.executemany("DELETE FROM sessions WHERE session_id = ?", rows)
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _evict(self, now):
+        idle = [r[0] for r in self._db.execute(
+            "SELECT session_id FROM sessions WHERE last_access < ?", (now - self.idle_ttl,)
+        )]
+        self._delete_sessions(idle)
+        self.evictions += len(idle)
+
+        count = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+        while count > self.max_sessions or size > self.max_bytes:
+            # drop the least recently used 10% (at least one) per round
+            batch = max(1, count // 10)
+            lru = [r[0] for r in self._db.execute(
+                "SELECT session_id FROM sessions ORDER BY last_access LIMIT ?", (batch,)
+            )]
+            if not lru:
+                break
+            self._delete_sessions(lru)
+            self.evictions += len(lru)
+            count = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+
+
+class RedisSessionStore:
+    """Sessions as capped Redis lists; idle TTL via key expiry.
+
+    Global LRU eviction is delegated to the server's maxmemory-policy
+    (allkeys-lru), which also bounds memory across all workers.
+    """
+
+    def __init__(self, url, max_messages, idle_ttl):
+        import redis  # optional dependency, only needed for this backend
+
+        self.max_messages = max_messages
+        self.idle_ttl = int(idle_ttl)
+        self._redis = redis.Redis.from_url(url)
+
+    def _key(self, session_id):
+        return f"chat_memory:{session_id}"
+
+    def append(self, session_id, message):
+        key = self._key(session_id)
+        pipe = self._redis.pipeline()
+        pipe.rpush(key, json.dumps(message))
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.idle_ttl)
+        pipe.execute()
+
+    def recent(self, session_id, n):
+        key = self._key(session_id)
+        pipe = self._redis.pipeline()
+        pipe.lrange(key, -n, -1)
+        pipe.expire(key, self.idle_ttl)
+        items, _ = pipe.execute()
+        return [json.loads(item) for item in items]
+
+    def get_summary(self, session_id):
+        value = self._redis.get(f"chat_summary:{session_id}")
+        return value.decode("utf-8") if value else ""
+
+    def set_summary(self, session_id, summary):
+        self._redis.set(f"chat_summary:{session_id}", summary, ex=self.idle_ttl)
+
+    def clear(self, session_id):
+        self._redis.delete(self._key(session_id), f"chat_summary:{session_id}")
+
+    def stats(self):
+        info = self._redis.info("memory")
+        return {"backend": "redis", "bytes": info.get("used_memory"), "evictions": None}
+
+
+def _create_store():
+    backend = Config.MEMORY_BACKEND
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            Config.MEMORY_SQLITE_PATH, Config.MEMORY_MAX_MESSAGES, Config.MEMORY_IDLE_TTL,
+            Config.MEMORY_MAX_SESSIONS, Config.MEMORY_MAX_BYTES,
+        )
+    if backend == "redis":
+        return RedisSessionStore(
+            Config.MEMORY_REDIS_URL, Config.MEMORY_MAX_MESSAGES, Config.MEMORY_IDLE_TTL,
+        )
+    if backend != "memory":
+        raise ValueError(f"Unknown MEMORY_BACKEND '{backend}'")
+    return InMemorySessionStore(
+        Config.MEMORY_MAX_MESSAGES, Config.MEMORY_IDLE_TTL,
+        Config.MEMORY_MAX_SESSIONS, Config.MEMORY_MAX_BYTES,
+    )
+
 
 # Stores memory per user/session
-chat_memory = defaultdict(list)
+store = _create_store()
+
+
+def reopen_store():
+    """Re-create the store in a forked worker; SQLite connections must not cross a fork."""
+    global store
+    store = _create_store()
+
+
+registry.register("memory_sessions", "Chat sessions held by the memory store.",
+                  lambda: store.stats().get("sessions"))
+registry.register("memory_bytes", "Bytes of chat history held by the memory store.",
+                  lambda: store.stats().get("bytes"))
+
 
 def add_to_memory(session_id, role, content):
     """Append a message to memory."""
-    chat_memory[session_id].append({"role": role, "content": content})
+    with stage("memory_write"):
+        store.append(session_id, {"role": role, "content": content})
 
 def get_memory(session_id):
     """Get chat history for a session."""
-    return chat_memory[session_id][-5:]  # Keep last 5 turns only
+    with stage("memory_read"):
+        return store.recent(session_id, Config.MEMORY_HISTORY_MESSAGES)  # last 5 messages by default
 
 def clear_memory(session_id):
     """Reset the conversation memory."""
-    chat_memory[session_id] = []
+    store.clear(session_id)
+
+def get_summary(session_id):
+    """Running summary of the turns that fell out of the history window."""
+    with stage("memory_read"):
+        return store.get_summary(session_id)
+
+def set_summary(session_id, summary):
+    with stage("memory_write"):
+        store.set_summary(session_id, summary)
@@ -0,0 +1,376 @@
+# app/metadata.py
+"""Columnar metadata side table and filters for the RAG store.
+
+Every metadata field is a column aligned with the store's rows:
+  - numeric fields (int/float values): a float64 array, NaN where missing
+  - other fields (str/bool values): dictionary-encoded, an int32 code per
+    row (-1 where missing) plus the list of distinct values
+
+Fields listed in RAG_METADATA_BITMAP_FIELDS (tenant, source, ...) also keep
+a packed bitmap per distinct value, so equality and $in filters on them
+are a few bitwise ORs over n/8 bytes instead of a scan of the column.
+
+Filters are JSON objects; top-level keys are ANDed:
+  {"tenant": "acme"}                     equality
+  {"source": {"$in": ["wiki", "faq"]}}   $eq $ne $in $nin
+  {"year": {"$gte": 2020, "$lt": 2024}}  $gt $gte $lt $lte (numbers, or
+                                         strings such as ISO dates)
+  {"$or": [...]}, {"$and": [...]}, {"$not": {...}}
+
+`evaluate` returns a packed little-endian bitmap over the rows, which is
+the layout faiss.IDSelectorBitmap takes, so a filter becomes a FAISS
+pre-filter without materializing row ids.
+"""
+import json
+import math
+import os
+import operator
+
+import numpy as np
+
+METADATA_FILE = "metadata.json"
+COLUMNS_FILE = "metadata.npz"
+
+COMPARISONS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+FIELD_OPS = ("$eq", "$ne", "$in", "$nin", *COMPARISONS)
+MAX_FILTER_DEPTH = 8
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, bool)) or _is_number(value)
+
+
+def validate_filter(where, depth=0):
+    """Raise ValueError if `where` is not a valid filter expression."""
+    if not isinstance(where, dict):
+        raise ValueError("A filter must be a JSON object")
+    if depth > MAX_FILTER_DEPTH:
+        raise ValueError("Filter is nested too deeply")
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(cond, list) or not cond:
+                raise ValueError(f"'{key}' takes a non-empty list of filters")
+            for sub in cond:
+                validate_filter(sub, depth + 1)
+        elif key == "$not":
+            validate_filter(cond, depth + 1)
+        elif key.startswith("$"):
+            raise ValueError(f"Unknown filter operator '{key}'")
+        elif isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op not in FIELD_OPS:
+                    raise ValueError(f"Unknown operator '{op}' for field '{key}'")
+                if op in ("$in", "$nin"):
+                    if not isinstance(arg, list) or not all(_is_scalar(v) for v in arg):
+                        raise ValueError(f"'{op}' takes a list of values")
+                elif not _is_scalar(arg):
+                    raise ValueError(f"'{op}' takes a string, number or boolean")
+        elif not _is_scalar(cond):
+            raise ValueError(f"Invalid value for field '{key}'")
+    return where
+
+
+def validate_metadata(metadata):
+    """Raise ValueError unless `metadata` is None or a flat object of scalars."""
+    if metadata is None:
+        return None
+    if not isinstance(metadata, dict):
+        raise ValueError("Metadata must be a JSON object")
+    for key, value in metadata.items():
+        if not isinstance(key, str) or not key or key.startswith("$"):
+            raise ValueError(f"Invalid metadata field name '{key}'")
+        if value is not None and not _is_scalar(value):
+            raise ValueError(f"Metadata field '{key}' must be a string, number, boolean or null")
+        if _is_number(value) and not math.isfinite(value):
+            raise ValueError(f"Metadata field '{key}' must be finite")
+    return metadata
+
+
+def _bits(mask):
+    return np.packbits(mask, bitorder="little")
+
+
+class _NumericColumn:
+    kind = "number"
+
+    def __init__(self, capacity):
+        self.values = np.full(capacity, np.nan)
+
+    def resize(self, capacity):
+        old = len(self.values)
+        self.values = np.resize(self.values, capacity)
+        self.values[old:] = np.nan
+
+    @staticmethod
+    def accepts(value):
+        return _is_number(value)
+
+    def set(self, row, value):
+        self.values[row] = value
+
+    def get(self, row):
+        value = self.values[row]
+        return None if np.isnan(value) else (int(value) if value.is_integer() else float(value))
+
+    def match(self, op, arg, n):
+        values = self.values[:n]
+        if op in ("$eq", "$in"):
+            args = [v for v in (arg if op == "$in" else [arg]) if _is_number(v)]
+            return _bits(np.isin(values, args))
+        if not _is_number(arg):
+            return None  # comparing numbers with a string matches nothing
+        with np.errstate(invalid="ignore"):
+            return _bits(COMPARISONS[op](values, arg))
+
+    def take(self, rows, capacity):
+        column = _NumericColumn(capacity)
+        column.values[: len(rows)] = self.values[rows]
+        return column
+
+
+class _CategoryColumn:
+    kind = "category"
+
+    def __init__(self, capacity, bitmap=False):
+        self.codes = np.full(capacity, -1, dtype=np.int32)
+        self.values = []
+        self.lookup = {}
+        self.bitmaps = {} if bitmap else None  # code -> packed bitmap
+
+    def resize(self, capacity):
+        old = len(self.codes)
+        self.codes = np.resize(self.codes, capacity)
+        self.codes[old:] = -1
+        if self.bitmaps is not None:
+            nbytes = (capacity + 7) // 8
+            for code, bitmap in self.bitmaps.items():
+                grown = np.zeros(nbytes, dtype=np.uint8)
+                grown[: len(bitmap)] = bitmap
+                self.bitmaps[code] = grown
+
+    @staticmethod
+    def accepts(value):
+        return isinstance(value, (str, bool))
+
+    def _code(self, value):
+        # bools and strings never share a code ("true" != True)
+        key = (type(value) is bool, value)
+        code = self.lookup.get(key)
+        if code is None:
+            code = self.lookup[key] = len(self.values)
+            self.values.append(value)
+            if self.bitmaps is not None:
+                self.bitmaps[code] = np.zeros((len(self.codes) + 7) // 8, dtype=np.uint8)
+        return code
+
+    def set(self, row, value):
+        code = self._code(value)
+        self.codes[row] = code
+        if self.bitmaps is not None:
+            self.bitmaps[code][row >> 3] |= np.uint8(1 << (row & 7))
+
+    def get(self, row):
+        code = self.codes[row]
+        return None if code < 0 else self.values[code]
+
+    def match(self, op, arg, n):
+        nbytes = (n + 7) // 8
+        if op in ("$eq", "$in"):
+            codes = [
+                self.lookup[key] for key in ((type(v) is bool, v) for v in (arg if op == "$in" else [arg]))
+                if key in self.lookup
+            ]
+            if self.bitmaps is not None:
+                bits = np.zeros(nbytes, dtype=np.uint8)
+                for code in codes:
+                    bits |= self.bitmaps[code][:nbytes]
+                return bits
+            return _bits(np.isin(self.codes[:n], codes))
+        if not isinstance(arg, str):
+            return None
+        matching = [
+            code for code, value in enumerate(self.values)
+            if isinstance(value, str) and COMPARISONS[op](value, arg)
+        ]
+        return _bits(np.isin(self.codes[:n], matching))
+
+    def take(self, rows, capacity):
+        column = _CategoryColumn(capacity, bitmap=self.bitmaps is not None)
+        column.values, column.lookup = list(self.values), dict(self.lookup)
+        column.codes[: len(rows)] = self.codes[rows]
+        column.rebuild_bitmaps(len(rows))
+        return column
+
+    def rebuild_bitmaps(self, n):
+        if self.bitmaps is None:
+            return
+        nbytes = (len(self.codes) + 7) // 8
+        for code in range(len(self.values)):
+            bitmap = np.zeros(nbytes, dtype=np.uint8)
+            packed = _bits(self.codes[:n] == code)
+            bitmap[: len(packed)] = packed
+            self.bitmaps[code] = bitmap
+
+
+def _column_class(value):
+    return _NumericColumn if _is_number(value) else _CategoryColumn
+
+
+class MetadataTable:
+    """Per-row metadata, stored column by column."""
+
+    def __init__(self, bitmap_fields=()):
+        self.bitmap_fields = frozenset(bitmap_fields)
+        self.n = 0
+        self._capacity = 1024
+        self._columns = {}
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def fields(self):
+        return {name: column.kind for name, column in self._columns.items()}
+
+    def check(self, metadatas):
+        """Raise ValueError if `metadatas` do not fit the column types.
+
+        A field without a column yet takes the type of its first value in
+        the batch, and later values of the field must match it.
+        """
+        new = {}  # field -> column class, for fields this batch adds
+        for metadata in metadatas:
+            validate_metadata(metadata)
+            for key, value in (metadata or {}).items():
+                if value is None:
+                    continue
+                column = self._columns.get(key) or new.get(key)
+                if column is None:
+                    new[key] = _column_class(value)
+                elif not column.accepts(value):
+                    raise ValueError(f"Metadata field '{key}' holds {column.kind} values")
+
+    def append(self, metadatas):
+        """Add one row per entry of `metadatas` (dicts or None); call `check` first."""
+        end = self.n + len(metadatas)
+        if end > self._capacity:
+            self._capacity = max(end, self._capacity * 2)
+            for column in self._columns.values():
+                column.resize(self._capacity)
+        for row, metadata in enumerate(metadatas, self.n):
+            for key, value in (metadata or {}).items():
+                if value is None:
+                    continue
+                column = self._columns.get(key)
+                if column is None:
+                    column = self._columns[key] = self._new_column(key, value)
+                column.set(row, value)
+        self.n = end
+
+    def _new_column(self, key, value):
+        if _column_class(value) is _NumericColumn:
+            return _NumericColumn(self._capacity)
+        return _CategoryColumn(self._capacity, bitmap=key in self.bitmap_fields)
+
+    def row(self, r):
+        values = {name: column.get(r) for name, column in self._columns.items()}
+        return {name: value for name, value in values.items() if value is not None}
+
+    # --- filters ---
+
+    def evaluate(self, where):
+        """Packed little-endian bitmap of the rows matching filter `where`."""
+        nbytes = (self.n + 7) // 8
+        bits = self._all(nbytes)
+        for key, cond in where.items():
+            if key == "$and":
+                for sub in cond:
+                    bits &= self.evaluate(sub)
+            elif key == "$or":
+                any_bits = np.zeros(nbytes, dtype=np.uint8)
+                for sub in cond:
+                    any_bits |= self.evaluate(sub)
+                bits &= any_bits
+            elif key == "$not":
+                bits &= self._invert(self.evaluate(cond))
+            else:
+                ops = cond if isinstance(cond, dict) else {"$eq": cond}
+                for op, arg in ops.items():
+                    bits &= self._field(key, op, arg, nbytes)
+        return bits
+
+    def _field(self, key, op, arg, nbytes):
+        negate = op in ("$ne", "$nin")
+        if negate:
+            op = "$eq" if op == "$ne" else "$in"
+        column = self._columns.get(key)
+        bits = column.match(op, arg, self.n) if column is not None else None
+        if bits is None:
+            bits = np.zeros(nbytes, dtype=np.uint8)
+        return self._invert(bits) if negate else bits
+
+    def _all(self, nbytes):
+        return self._invert(np.zeros(nbytes, dtype=np.uint8))
+
+    def _invert(self, bits):
+        bits = ~bits
+        if self.n % 8:
+            bits[-1] &= np.uint8((1 << (self.n % 8)) - 1)  # no bits past the last row
+        return bits
+
+    # --- compaction / persistence ---
+
+    def take(self, rows):
+        """A new table holding `rows` (in that order)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        table = MetadataTable(self.bitmap_fields)
+        table._capacity = max(1024, len(rows))
+        table.n = len(rows)
+        table._columns = {
+            name: column.take(rows, table._capacity) for name, column in self._columns.items()
+        }
+        return table
+
+    def write(self, path):
+        schema = {"n": self.n, "columns": {}}
+        arrays = {}
+        for i, (name, column) in enumerate(self._columns.items()):
+            schema["columns"][name] = {"kind": column.kind, "array": f"c{i}"}
+            if column.kind == "number":
+                arrays[f"c{i}"] = column.values[: self.n]
+            else:
+                schema["columns"][name]["values"] = column.values
+                arrays[f"c{i}"] = column.codes[: self.n]
+        with open(os.path.join(path, METADATA_FILE), "w") as f:
+            json.dump(schema, f)
+        with open(os.path.join(path, COLUMNS_FILE), "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def read(cls, path, bitmap_fields=()):
+        """Load the table written to `path`, or None if there is none."""
+        if not os.path.exists(os.path.join(path, METADATA_FILE)):
+            return None
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            schema = json.load(f)
+        table = cls(bitmap_fields)
+        table.n = schema["n"]
+        table._capacity = max(1024, table.n)
+        with np.load(os.path.join(path, COLUMNS_FILE)) as arrays:
+            for name, spec in schema["columns"].items():
+                data = arrays[spec["array"]]
+                if spec["kind"] == "number":
+                    column = _NumericColumn(table._capacity)
+                    column.values[: table.n] = data
+                else:
+                    column = _CategoryColumn(table._capacity, bitmap=name in table.bitmap_fields)
+                    column.values = spec["values"]
+                    column.lookup = {(type(v) is bool, v): code for code, v in enumerate(column.values)}
+                    column.codes[: table.n] = data
+                    column.rebuild_bitmaps(table.n)
+                table._columns[name] = column
+        return table
@@ -0,0 +1,300 @@
+"""In-process metrics, rendered in the Prometheus text format at /metrics.
+
+Hot paths time themselves with `stage(name)`:
+
+    with stage("search"):
+        hits = store.search(...)
+
+Each stage is observed into `stage_duration_seconds{stage=...}` and, while
+a request is being served (see `start_request`), appended to that
+request's timings for the optional Server-Timing header. A stage costs
+two clock reads, a dict lookup and one short lock, so it is cheap
+enough to leave on in production; METRICS_ENABLED=0 turns it off.
+
+Values that already live elsewhere (index sizes, cache counters, RSS) are
+not mirrored on every change; modules register a callback with
+`registry.register` that is read at scrape time.
+
+Metrics are per process: behind several workers each one reports its own.
+"""
+import bisect
+import contextvars
+import os
+import resource
+import sys
+import threading
+import time
+
+from app.config import Config
+
+# seconds; from a cache hit to a slow completion
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram; `snapshot` reports cumulative bucket counts."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": cumulative, "sum": total}
+
+
+class _Family:
+    """A named metric with one child per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _child(self, values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class Counter(_Family):
+    kind = "counter"
+
+    def _new_child(self):
+        return [0]
+
+    def inc(self, amount=1, **labels):
+        child = self._child(tuple(labels[name] for name in self.labels))
+        with self._lock:
+            child[0] += amount
+
+    def value(self, **labels):
+        return self._child(tuple(labels[name] for name in self.labels))[0]
+
+    def samples(self):
+        for values, child in self._items():
+            yield self.name, dict(zip(self.labels, values)), child[0]
+
+
+class HistogramFamily(_Family):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def _new_child(self):
+        return Histogram(self.buckets)
+
+    def observe(self, value, **labels):
+        self._child(tuple(labels[name] for name in self.labels)).observe(value)
+
+    def snapshot(self, **labels):
+        return self._child(tuple(labels[name] for name in self.labels)).snapshot()
+
+    def samples(self):
+        for values, child in self._items():
+            labels = dict(zip(self.labels, values))
+            snap = child.snapshot()
+            for bound, count in snap["buckets"].items():
+                yield f"{self.name}_bucket", {**labels, "le": bound}, count
+            yield f"{self.name}_sum", labels, snap["sum"]
+            yield f"{self.name}_count", labels, snap["count"]
+
+
+class Callback:
+    """A gauge or counter whose value is read from `fn` at scrape time.
+
+    Without labels `fn` returns a number; with labels, a dict mapping a
+    tuple of label values to a number. None values are skipped.
+    """
+
+    def __init__(self, name, help, fn, kind="gauge", labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labels = tuple(labels)
+
+    def samples(self):
+        values = self.fn()
+        if not self.labels:
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            if value is not None:
+                yield self.name, dict(zip(self.labels, key)), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Callback):
+                return existing
+            # re-registering a callback replaces it (e.g. a reloaded store)
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        return self._add(HistogramFamily(name, help, labels, buckets))
+
+    def register(self, name, help, fn, kind="gauge", labels=()):
+        return self._add(Callback(name, help, fn, kind, labels))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                continue  # one failing callback must not break the scrape
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "stage_duration_seconds", "Time spent in each stage of request handling.", ("stage",)
+)
+http_seconds = registry.histogram(
+    "http_request_duration_seconds", "Request handling time, until the response starts.",
+    ("endpoint", "method", "status"),
+)
+tokens_total = registry.counter(
+    "openai_tokens_total", "Tokens reported by the OpenAI API, by model and type.", ("model", "type")
+)
+
+
+def rss_bytes():
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # peak rather than current RSS off Linux (bytes on macOS, KiB elsewhere)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+registry.register("process_resident_memory_bytes", "Resident memory size in bytes.", rss_bytes)
+
+
+# --- stage timers and per-request timings ---
+
+# (name, seconds) of the stages run while serving the current request
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+class stage:
+    """Context manager timing a block as stage `name`."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not Config.METRICS_ENABLED:
+            return False
+        elapsed = time.perf_counter() - self.start
+        stage_seconds.observe(elapsed, stage=self.name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((self.name, elapsed))
+        return False
+
+
+def start_request():
+    """Begin collecting stage timings for the request served in this context."""
+    _timings.set([])
+
+
+def request_timings():
+    """[(stage, seconds)] recorded so far for the current request."""
+    return list(_timings.get() or ())
+
+
+def server_timing(timings, total=None):
+    """Server-Timing header value; repeated stages are summed."""
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+def record_usage(model, usage):
+    """Count the tokens of an OpenAI response's `usage` block."""
+    if usage is None or not Config.METRICS_ENABLED:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if isinstance(value, int) and value:
+            tokens_total.inc(value, model=model or "unknown", type=kind.split("_")[0])
@@ -0,0 +1,431 @@
+# app/openai_client.py
+"""Shared OpenAI client factory with retry and circuit breaking.
+
+Every service goes through the helpers below instead of building its own
+client, so the process has one keep-alive connection pool per client
+flavour (sync/async), explicit per-operation timeouts, and one retry
+policy:
+
+  - jittered exponential backoff, honouring Retry-After on 429s
+  - a retry budget so retries cannot multiply load during an outage
+  - a circuit breaker per operation that fails fast while upstream is down
+  - per-model and global request/token budgets (see app.rate_limiter),
+    taken once per call before the first attempt
+
+Each call is timed as stage "openai_<operation>" (retries and backoff
+included) and the tokens in the response's usage block are counted
+(see app.metrics).
+
+The SDK's own retries are disabled (max_retries=0) in favour of this policy.
+The SDK itself is imported on first use (it is by far the slowest import
+of the app); serving.py imports it in the master before forking workers.
+Clients are rebuilt in a forked child rather than sharing the parent's
+connection pool.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import httpx
+
+from app.config import Config
+from app.metrics import record_usage, registry, stage
+from app.rate_limiter import get_limiter
+from app.tokens import count_tokens
+
+OPERATIONS = ("chat", "embeddings", "images")
+
+
+def _sdk():
+    """The openai package."""
+    import openai
+    return openai
+
+
+def _retryable_errors():
+    openai = _sdk()
+    return (
+        openai.APIConnectionError,  # includes APITimeoutError
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling upstream while the operation's circuit is open."""
+
+    def __init__(self, operation, retry_after):
+        super().__init__(f"OpenAI {operation} is temporarily unavailable")
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half-open after `cooldown`."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self, operation):
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True  # let one probe through
+                return
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            raise UpstreamUnavailable(operation, max(1, int(remaining + 0.999)))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class RetryBudget:
+    """Token bucket: each call deposits `ratio` tokens, each retry spends one."""
+
+    def __init__(self, ratio, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_client = None
+_async_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_breakers = {}
+_budget = None
+
+
+def _http_options():
+    return {
+        "limits": httpx.Limits(
+            max_connections=Config.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=Config.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        "http2": Config.OPENAI_HTTP2 and _h2_available(),
+        "timeout": httpx.Timeout(Config.OPENAI_TIMEOUT_CHAT, connect=Config.OPENAI_CONNECT_TIMEOUT),
+    }
+
+
+def _h2_available():
+    try:
+        import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    except ImportError:
+        return False
+    return True
+
+
+def _forget_forked_clients():
+    # caller holds _client_lock; a pool's connections must not be shared with the parent
+    global _client, _async_client, _client_pid
+    if _client_pid != os.getpid():
+        _client = _async_client = None
+        _client_pid = os.getpid()
+
+
+def get_client():
+    """The process-wide sync OpenAI client."""
+    global _client
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            _forget_forked_clients()
+            if _client is None:
+                openai = _sdk()
+                _client = openai.OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    max_retries=0,
+                    http_client=openai.DefaultHttpxClient(**_http_options()),
+                )
+    return _client
+
+
+def get_async_client():
+    """The process-wide AsyncOpenAI client."""
+    global _async_client
+    if _async_client is None or _client_pid != os.getpid():
+        with _client_lock:
+            _forget_forked_clients()
+            if _async_client is None:
+                openai = _sdk()
+                _async_client = openai.AsyncOpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    max_retries=0,
+                    http_client=openai.DefaultAsyncHttpxClient(**_http_options()),
+                )
+    return _async_client
+
+
+def warm_up():
+    """Build both clients now rather than on the first request."""
+    get_client()
+    get_async_client()
+
+
+def clients_ready():
+    """Whether this process has built its clients."""
+    return _client is not None and _async_client is not None and _client_pid == os.getpid()
+
+
+def breaker(operation):
+    with _client_lock:
+        if operation not in _breakers:
+            _breakers[operation] = CircuitBreaker(
+                Config.OPENAI_BREAKER_THRESHOLD, Config.OPENAI_BREAKER_COOLDOWN
+            )
+        return _breakers[operation]
+
+
+def _open_circuits():
+    with _client_lock:
+        breakers = dict(_breakers)
+    return {(operation,): int(b.state != "closed") for operation, b in breakers.items()}
+
+
+registry.register(
+    "openai_circuit_open", "1 while the operation's circuit breaker is open or half-open.",
+    _open_circuits, labels=("operation",),
+)
+
+
+def _retry_budget():
+    global _budget
+    if _budget is None:
+        _budget = RetryBudget(Config.OPENAI_RETRY_BUDGET_RATIO)
+    return _budget
+
+
+def _timeout(operation):
+    return {
+        "chat": Config.OPENAI_TIMEOUT_CHAT,
+        "embeddings": Config.OPENAI_TIMEOUT_EMBEDDINGS,
+        "images": Config.OPENAI_TIMEOUT_IMAGES,
+    }[operation]
+
+
+def _backoff(attempt, error):
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, Config.OPENAI_RETRY_MAX_DELAY)
+    # full jitter
+    cap = min(Config.OPENAI_RETRY_MAX_DELAY, Config.OPENAI_RETRY_BASE * 2 ** attempt)
+    return random.uniform(0, cap)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _counts_against_breaker(error):
+    # 429s mean "slow down", not "upstream is broken"
+    return not isinstance(error, _sdk().RateLimitError)
+
+
+def estimated_tokens(kwargs):
+    """Tokens a request will count against the model's TPM limit, roughly."""
+    if "messages" in kwargs:
+        prompt = sum(count_tokens(m["content"]) for m in kwargs["messages"] if isinstance(m.get("content"), str))
+        return prompt + (kwargs.get("max_tokens") or Config.RATE_LIMIT_COMPLETION_TOKENS)
+    texts = kwargs.get("input", ())
+    if isinstance(texts, str):
+        texts = [texts]
+    return sum(count_tokens(t) for t in texts)
+
+
+def call(operation, fn, model=None, tokens=0):
+    """Run `fn(client, timeout)` under the rate limits, retry policy and circuit breaker."""
+    with stage(f"openai_{operation}"):
+        return _call(operation, fn, model, tokens)
+
+
+def _call(operation, fn, model, tokens):
+    circuit = breaker(operation)
+    budget = _retry_budget()
+    budget.deposit()
+    attempt = 0
+    while True:
+        # every attempt, retries included, is a request against the upstream limits
+        if model is not None:
+            get_limiter().acquire_upstream(model, tokens)
+        circuit.before_call(operation)
+        try:
+            result = fn(get_client(), _timeout(operation))
+        except _retryable_errors() as e:
+            if _counts_against_breaker(e):
+                circuit.record_failure()
+            else:
+                circuit.release_trial()
+            if attempt >= Config.OPENAI_MAX_RETRIES or not budget.withdraw():
+                raise
+            time.sleep(_backoff(attempt, e))
+            attempt += 1
+            continue
+        except _sdk().APIStatusError:
+            # upstream answered (4xx), so it is not degraded
+            circuit.record_success()
+            raise
+        except Exception:
+            circuit.release_trial()
+            raise
+        circuit.record_success()
+        return result
+
+
+async def acall(operation, fn, model=None, tokens=0):
+    """Async version of `call`; `fn(client, timeout)` must return an awaitable."""
+    with stage(f"openai_{operation}"):
+        return await _acall(operation, fn, model, tokens)
+
+
+async def _acall(operation, fn, model, tokens):
+    circuit = breaker(operation)
+    budget = _retry_budget()
+    budget.deposit()
+    attempt = 0
+    while True:
+        # every attempt, retries included, is a request against the upstream limits
+        if model is not None:
+            await get_limiter().acquire_upstream_async(model, tokens)
+        circuit.before_call(operation)
+        try:
+            result = await fn(get_async_client(), _timeout(operation))
+        except _retryable_errors() as e:
+            if _counts_against_breaker(e):
+                circuit.record_failure()
+            else:
+                circuit.release_trial()
+            if attempt >= Config.OPENAI_MAX_RETRIES or not budget.withdraw():
+                raise
+            await asyncio.sleep(_backoff(attempt, e))
+            attempt += 1
+            continue
+        except _sdk().APIStatusError:
+            # upstream answered (4xx), so it is not degraded
+            circuit.record_success()
+            raise
+        except Exception:
+            circuit.release_trial()
+            raise
+        circuit.record_success()
+        return result
+
+
+# --- operation helpers used by the services ---
+
+def _budget_of(kwargs):
+    return kwargs.get("model"), estimated_tokens(kwargs)
+
+
+def _counted(kwargs, response):
+    record_usage(kwargs.get("model"), getattr(response, "usage", None))
+    return response
+
+
+def _stream_usage(kwargs):
+    """`kwargs` asking a streamed completion for a final chunk with its usage block."""
+    if not kwargs.get("stream"):
+        return kwargs
+    return {**kwargs, "stream_options": {"include_usage": True, **(kwargs.get("stream_options") or {})}}
+
+
+def _counted_stream(model, stream):
+    for chunk in stream:
+        # the usage block comes in a last chunk without choices
+        record_usage(model, getattr(chunk, "usage", None))
+        yield chunk
+
+
+async def _counted_stream_async(model, stream):
+    async for chunk in stream:
+        record_usage(model, getattr(chunk, "usage", None))
+        yield chunk
+
+
+def create_chat_completion(**kwargs):
+    kwargs = _stream_usage(kwargs)
+    response = call("chat", lambda c, t: c.chat.completions.create(timeout=t, **kwargs), *_budget_of(kwargs))
+    if kwargs.get("stream"):
+        return _counted_stream(kwargs.get("model"), response)
+    return _counted(kwargs, response)
+
+
+def create_embeddings(**kwargs):
+    response = call("embeddings", lambda c, t: c.embeddings.create(timeout=t, **kwargs), *_budget_of(kwargs))
+    return _counted(kwargs, response)
+
+
+def generate_image(**kwargs):
+    response = call("images", lambda c, t: c.images.generate(timeout=t, **kwargs), *_budget_of(kwargs))
+    return _counted(kwargs, response)
+
+
+async def create_chat_completion_async(**kwargs):
+    kwargs = _stream_usage(kwargs)
+    response = await acall(
+        "chat", lambda c, t: c.chat.completions.create(timeout=t, **kwargs), *_budget_of(kwargs)
+    )
+    if kwargs.get("stream"):
+        return _counted_stream_async(kwargs.get("model"), response)
+    return _counted(kwargs, response)
+
+
+async def create_embeddings_async(**kwargs):
+    response = await acall("embeddings", lambda c, t: c.embeddings.create(timeout=t, **kwargs), *_budget_of(kwargs))
+    return _counted(kwargs, response)
+
+
+async def generate_image_async(**kwargs):
+    response = await acall("images", lambda c, t: c.images.generate(timeout=t, **kwargs), *_budget_of(kwargs))
+    return _counted(kwargs, response)
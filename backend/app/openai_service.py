@@ -1,10 +1,30 @@
-import openai
+import asyncio
 import os
+import re
 import base64
-from typing import Optional
-
-# configure openai key from env if present
-openai.api_key = os.getenv("OPENAI_API_KEY")
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import BinaryIO, Iterator, Optional
+
+from app import openai_client
+from app.config import Config
+from app.image_cache import ImageCache, image_id, iter_base64
+from app.metrics import registry, stage
+from app.single_flight import flight_key, single_flight
+
+CHAT_MODEL = "gpt-4o-mini"
+IMAGE_MODEL = "gpt-image-1"
+IMAGE_SIZES = ("1024x1024", "1024x1536", "1536x1024", "auto")
+
+# generated images are kept on disk when IMAGE_CACHE_DIR is set
+image_cache = (
+    ImageCache(Config.IMAGE_CACHE_DIR, Config.IMAGE_CACHE_MAX_BYTES) if Config.IMAGE_CACHE_DIR else None
+)
+if image_cache is not None:
+    registry.register("image_cache_bytes", "Size of the on-disk image cache.", lambda: image_cache.stats()["bytes"])
+    registry.register(
+        "image_cache_lookups_total", "Image cache lookups by result.",
+        lambda: {("hit",): image_cache.hits, ("miss",): image_cache.misses}, kind="counter", labels=("result",),
+    )
 
 # Small 1x1 PNG (transparent) base64 used for test fallbacks
 _TEST_PNG_B64 = (
@@ -43,24 +63,189 @@ def get_chat_response(prompt: str) -> str:
     if _is_fake_mode():
         return f"(test) Echo: {prompt}"
 
-    response = openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-    )
-    return response.choices[0].message.content
+    return complete_chat([{"role": "user", "content": prompt}])
+
+
+def complete_chat(messages) -> str:
+    """Completion text for `messages`; identical concurrent calls share one request."""
+    def call():
+        response = openai_client.create_chat_completion(model=CHAT_MODEL, messages=messages)
+        return response.choices[0].message.content
+
+    with stage("completion"):
+        return single_flight.do("chat", flight_key(CHAT_MODEL, messages), call)
+
+
+def stream_chat_response(prompt: str) -> Iterator[str]:
+    """Yield the chat response as text deltas. Fake mode streams word by word."""
+    if _is_fake_mode():
+        yield from fake_stream(f"(test) Echo: {prompt}")
+        return
+
+    yield from stream_completion([{"role": "user", "content": prompt}])
+
+
+def stream_completion(messages: list[dict]) -> Iterator[str]:
+    """Text deltas of a streamed completion for `messages`, timed as the completion stage."""
+    with stage("completion"):
+        yield from iter_deltas(openai_client.create_chat_completion(model=CHAT_MODEL, messages=messages, stream=True))
+
+
+def iter_deltas(stream) -> Iterator[str]:
+    """Extract the non-empty content deltas from a chat completion stream."""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def fake_stream(text: str) -> Iterator[str]:
+    """Deterministic stand-in for a completion stream: one word per delta."""
+    yield from re.findall(r"\S+\s*", text)
+
+
+async def get_chat_response_async(prompt: str) -> str:
+    """Async version of `get_chat_response`."""
+    if _is_fake_mode():
+        return f"(test) Echo: {prompt}"
+
+    return await complete_chat_async([{"role": "user", "content": prompt}])
+
+
+async def complete_chat_async(messages) -> str:
+    """Async version of `complete_chat`."""
+    async def call():
+        response = await openai_client.create_chat_completion_async(model=CHAT_MODEL, messages=messages)
+        return response.choices[0].message.content
 
+    with stage("completion"):
+        return await single_flight.do_async("chat", flight_key(CHAT_MODEL, messages), call)
 
-def get_image_response(prompt: str, response_type: str) -> Optional[bytes | dict]:
+
+def get_image_response(prompt: str, response_type: str, size: Optional[str] = None) -> Optional[bytes | dict]:
     """Return either a JSON with base64 or raw image bytes.
 
     If running in fake mode, return a small test PNG (base64 or bytes).
+    The /generateImage route serves cached images from their file instead.
     """
+    if image_cache is not None:
+        return _read_image(get_image_file(prompt, size)[0], response_type)
+    return _format_image(generate_image_base64(prompt, size), response_type)
+
+
+async def get_image_response_async(prompt: str, response_type: str, size: Optional[str] = None) -> Optional[bytes | dict]:
+    """Async version of `get_image_response`."""
+    if image_cache is not None:
+        f, _ = await get_image_file_async(prompt, size)
+        return await asyncio.to_thread(_read_image, f, response_type)
+    return _format_image(await generate_image_base64_async(prompt, size), response_type)
+
+
+def _image_kwargs(prompt: str, size: Optional[str]) -> dict:
+    return {"prompt": prompt, **({"size": size} if size else {})}
+
+
+def _request_image(prompt: str, size: Optional[str]) -> str:
     if _is_fake_mode():
-        image_base64 = _TEST_PNG_B64
-    else:
-        response = openai.images.generate(model="gpt-image-1", prompt=prompt)
-        image_base64 = response.data[0].b64_json
+        return _TEST_PNG_B64
+    return openai_client.generate_image(model=IMAGE_MODEL, **_image_kwargs(prompt, size)).data[0].b64_json
+
+
+async def _request_image_async(prompt: str, size: Optional[str]) -> str:
+    if _is_fake_mode():
+        return _TEST_PNG_B64
+    response = await openai_client.generate_image_async(model=IMAGE_MODEL, **_image_kwargs(prompt, size))
+    return response.data[0].b64_json
+
+
+def generate_image_base64(prompt: str, size: Optional[str] = None) -> str:
+    """Base64 PNG for `prompt`; identical concurrent prompts share one request."""
+    key = flight_key(IMAGE_MODEL, _image_kwargs(prompt, size))
+    with stage("image"):
+        return single_flight.do("image", key, lambda: _request_image(prompt, size))
+
+
+async def generate_image_base64_async(prompt: str, size: Optional[str] = None) -> str:
+    """Async version of `generate_image_base64`."""
+    key = flight_key(IMAGE_MODEL, _image_kwargs(prompt, size))
+    with stage("image"):
+        return await single_flight.do_async("image", key, lambda: _request_image_async(prompt, size))
+
+
+def get_image_file(prompt: str, size: Optional[str] = None) -> tuple[BinaryIO, str]:
+    """(open file, id) of the cached image for `prompt`, generating it on a miss.
+
+    Needs the image cache (IMAGE_CACHE_DIR). The caller closes the file.
+    """
+    image = image_id(IMAGE_MODEL, prompt, size)
+    f = image_cache.open(image)
+    while f is None:
+        # the caller that writes the image keeps its handle; callers sharing the flight
+        # open the file, and generate again in the rare case it was evicted meanwhile
+        written = []
+        with stage("image"):
+            single_flight.do(
+                "image_file", image,
+                lambda: written.append(image_cache.put_base64(image, _request_image(prompt, size))),
+            )
+        f = written[0] if written else image_cache.open(image)
+    return f, image
+
+
+async def get_image_file_async(prompt: str, size: Optional[str] = None) -> tuple[BinaryIO, str]:
+    """Async version of `get_image_file`."""
+    image = image_id(IMAGE_MODEL, prompt, size)
+    f = await asyncio.to_thread(image_cache.open, image)
+    while f is None:
+        written = []
+
+        async def call():
+            image_base64 = await _request_image_async(prompt, size)
+            written.append(await asyncio.to_thread(image_cache.put_base64, image, image_base64))
+
+        with stage("image"):
+            await single_flight.do_async("image_file", image, call)
+        f = written[0] if written else await asyncio.to_thread(image_cache.open, image)
+    return f, image
+
+
+def generate_images(prompts: list[str], size: Optional[str] = None, concurrency: Optional[int] = None) -> Iterator[dict]:
+    """Generate many images, at most `concurrency` (default IMAGE_BATCH_CONCURRENCY) at once.
+
+    Yields one result per prompt as it finishes: {"index", "prompt", "id"} when
+    the image cache is on (fetch it from GET /images/<id>), {"index", "prompt",
+    "base64"} otherwise, or {"index", "prompt", "error"}.
+    """
+    def one(prompt):
+        if image_cache is not None:
+            f, image = get_image_file(prompt, size)
+            f.close()
+            return {"id": image}
+        return {"base64": generate_image_base64(prompt, size)}
+
+    pool = ThreadPoolExecutor(max_workers=concurrency or Config.IMAGE_BATCH_CONCURRENCY)
+    try:
+        futures = {pool.submit(one, prompt): i for i, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            result = {"index": i, "prompt": prompts[i]}
+            try:
+                result.update(future.result())
+            except Exception as e:
+                result["error"] = str(e)
+            yield result
+    finally:
+        # stop queued generations if the consumer goes away early
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _read_image(f: BinaryIO, response_type: str) -> Optional[bytes | dict]:
+    if response_type.lower() == "base64":
+        return {"base64": "".join(iter_base64(f)), "version": "0.1.0"}
+    with f:
+        return f.read() if response_type.lower() == "image" else None
+
 
+def _format_image(image_base64: str, response_type: str) -> Optional[bytes | dict]:
     if response_type.lower() == "base64":
         return {"base64": image_base64, "version": "0.1.0"}
     elif response_type.lower() == "image":
@@ -0,0 +1,153 @@
+# app/rag_index.py
+"""FAISS index construction for the RAG store.
+
+Supported kinds:
+  - flat      exact brute-force search (IndexFlatL2 / IndexFlatIP)
+  - ivf_flat  inverted lists over full vectors (IndexIVFFlat)
+  - ivf_pq    inverted lists over product-quantized codes (IndexIVFPQ)
+  - hnsw      graph-based search (IndexHNSWFlat)
+
+Independently of the kind, vectors can be stored at reduced precision:
+  - fp32  full precision, 4 bytes per dimension
+  - fp16  half precision scalar quantizer, 2 bytes per dimension
+  - int8  8-bit scalar quantizer, 1 byte per dimension (trained min/max)
+  - pq    product quantization, `pq_m` bytes per vector
+ivf_pq always stores PQ codes.
+
+The metric is either L2 distance or, for "cosine", inner product; cosine
+indexes expect L2-normalized vectors (the vector store normalizes them).
+
+IVF kinds and trained storage need training data, so the store starts out
+untrained and is rebuilt into the configured index once the corpus is
+large enough (see app.vector_store).
+"""
+import math
+
+import faiss
+import numpy as np
+
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+STORAGE_KINDS = ("fp32", "fp16", "int8", "pq")
+METRICS = ("l2", "cosine")
+
+_SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+
+def default_nlist(n):
+    """~4*sqrt(n) lists, keeping >= 39 training points per centroid."""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def resolve(kind, storage="fp32"):
+    """The (kind, storage) an index built with these settings ends up as.
+
+    PQ codes in inverted lists are an ivf_pq index, whichever IVF kind was asked for.
+    """
+    if kind == "ivf_pq" or (kind == "ivf_flat" and storage == "pq"):
+        return "ivf_pq", "pq"
+    return kind, storage
+
+
+def needs_training(kind, storage="fp32"):
+    return kind in ("ivf_flat", "ivf_pq") or storage in ("int8", "pq")
+
+
+def build_index(kind, dim, vectors=None, nlist=None, pq_m=16, hnsw_m=32, storage="fp32", metric="l2"):
+    """Create an index of `kind` and fill it with `vectors` (training if needed)."""
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS}")
+    if storage not in STORAGE_KINDS:
+        raise ValueError(f"Unknown vector storage '{storage}', expected one of {STORAGE_KINDS}")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+    mt = faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+    n = 0 if vectors is None else len(vectors)
+    if n == 0 and needs_training(kind, storage):
+        raise ValueError(f"'{kind}' index with {storage} storage needs vectors to train on")
+    kind, storage = resolve(kind, storage)
+
+    if kind == "flat":
+        if storage == "fp32":
+            index = faiss.IndexFlatIP(dim) if metric == "cosine" else faiss.IndexFlatL2(dim)
+        elif storage == "pq":
+            index = faiss.IndexPQ(dim, pq_m, 8, mt)
+        else:
+            index = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[storage], mt)
+    elif kind == "hnsw":
+        if storage == "fp32":
+            index = faiss.IndexHNSWFlat(dim, hnsw_m, mt)
+        elif storage == "pq":
+            index = faiss.IndexHNSWPQ(dim, pq_m, hnsw_m, 8, mt)
+        else:
+            index = faiss.IndexHNSWSQ(dim, _SQ_TYPES[storage], hnsw_m, mt)
+    else:
+        nlist = min(nlist or default_nlist(n), n)
+        quantizer = faiss.IndexFlatIP(dim) if metric == "cosine" else faiss.IndexFlatL2(dim)
+        if kind == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8, mt)
+        elif storage == "fp32":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, mt)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, _SQ_TYPES[storage], mt)
+
+    if not index.is_trained:
+        index.train(vectors)
+    if isinstance(index, faiss.IndexIVF):
+        # keep ids reconstructable so the index can be rebuilt later
+        index.make_direct_map()
+    if n:
+        index.add(vectors)
+    return index
+
+
+def index_kind(index):
+    """Return the kind name of an existing index."""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def index_storage(index):
+    """Return the storage name (see STORAGE_KINDS) of an existing index."""
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        qtype = index.sq.qtype
+        return next((name for name, qt in _SQ_TYPES.items() if qt == qtype), "int8")
+    return "fp32"
+
+
+def index_metric(index):
+    """Return the metric name (see METRICS) of an existing index."""
+    return "cosine" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def all_vectors(index, start=0):
+    """Reconstruct vectors [start, ntotal) from `index`.
+
+    Exact for fp32 storage, approximate for quantized storage.
+    """
+    n = index.ntotal - start
+    if n <= 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(start, n)
+
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    """Per-request search parameters for `index.search`, or None.
+
+    `sel` is an optional faiss.IDSelector restricting which ids may be returned.
+    """
+    if isinstance(index, faiss.IndexIVF) and (nprobe or sel is not None):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe or index.nprobe), sel=sel)
+    if isinstance(index, faiss.IndexHNSW) and (ef_search or sel is not None):
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search or index.hnsw.efSearch), sel=sel)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
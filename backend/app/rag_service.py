@@ -1,7 +1,20 @@
-import faiss
+import asyncio
 import numpy as np
-from openai import OpenAI
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app import openai_client, rerank, vector_store
+from app.config import Config
+from app.embedding_batcher import EmbeddingBatcher
+from app.embedding_cache import EmbeddingCache, cache_key
+from app.lexical_index import reciprocal_rank_fusion
+from app.metadata import validate_metadata
+from app.metrics import registry, stage
+from app.openai_service import CHAT_MODEL, complete_chat, complete_chat_async, fake_stream, stream_completion
+from app.rerank import RERANKERS
+from app.response_cache import response_cache
+from app.single_flight import flight_key, single_flight
+from app.vector_store import DEFAULT_COLLECTION
 
 # Determine fake mode at runtime using env var or Flask testing config
 def _is_fake_mode() -> bool:
@@ -24,110 +37,531 @@ def _is_fake_mode() -> bool:
     return True
 
 
-_client = None
-def _get_client():
-    global _client
-    if _is_fake_mode():
-        return None
-    if _client is None:
-        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    return _client
+# Vector stores live in app.vector_store, one per named collection
+EMBEDDING_MODEL = "text-embedding-3-small"
+RETRIEVAL_MODES = ("vector", "hybrid", "lexical")
+# text-embedding-3 models can return shortened (Matryoshka) embeddings
+embedding_dim = Config.EMBEDDING_DIMENSIONS or 1536  # 1536 for text-embedding-3-small
 
-# In-memory FAISS store
-embedding_dim = 1536  # for text-embedding-3-small
-index = faiss.IndexFlatL2(embedding_dim)
-documents = []  # parallel list to store text data
+embedding_cache = EmbeddingCache(
+    max_entries=Config.EMBED_CACHE_SIZE,
+    path=Config.EMBED_CACHE_PATH,
+    max_bytes=Config.EMBED_CACHE_MAX_BYTES,
+)
 
 
 def embed_text(texts):
     """Convert list of texts into embeddings.
 
     If running in fake mode, return simple deterministic vectors so tests
-    can run offline.
+    can run offline. Otherwise only texts missing from `embedding_cache` are
+    sent to the API, small requests batched with concurrent ones
+    (see `embedding_batcher`).
     """
+    with stage("embed"):
+        return _embed(texts)
+
+
+def _embed(texts):
+    if _is_fake_mode():
+        return _fake_embeddings(texts)
+
+    embeddings, missing = _cache_lookup(texts)
+    if missing:
+        inputs = [texts[idx[0]] for idx in missing.values()]
+
+        def call():
+            if _batched(inputs):
+                return embedding_batcher.submit(inputs).result()
+            return _create_embeddings(inputs)
+
+        data = single_flight.do("embeddings", _embeddings_key(inputs), call)
+        _cache_fill(embeddings, missing, data)
+    return embeddings
+
+
+async def embed_text_async(texts):
+    """Async version of `embed_text` built on AsyncOpenAI."""
+    with stage("embed"):
+        return await _embed_async(texts)
+
+
+async def _embed_async(texts):
     if _is_fake_mode():
-        # deterministic pseudo-embeddings: depend on text length and index
-        embeddings = []
-        for i, t in enumerate(texts):
-            vec = np.full((embedding_dim,), float((i + 1) % 10), dtype=np.float32)
-            # mix in length to vary values
-            vec += float(len(t) % 5)
-            embeddings.append(vec)
-        return embeddings
-
-    client = _get_client()
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=texts
+        return _fake_embeddings(texts)
+
+    embeddings, missing = _cache_lookup(texts)
+    if missing:
+        inputs = [texts[idx[0]] for idx in missing.values()]
+
+        async def call():
+            if _batched(inputs):
+                return await asyncio.wrap_future(embedding_batcher.submit(inputs))
+            response = await openai_client.create_embeddings_async(
+                model=EMBEDDING_MODEL, input=inputs, **_dimensions_kwargs()
+            )
+            return response.data
+
+        data = await single_flight.do_async("embeddings", _embeddings_key(inputs), call)
+        _cache_fill(embeddings, missing, data)
+    return embeddings
+
+
+def _create_embeddings(inputs):
+    return openai_client.create_embeddings(model=EMBEDDING_MODEL, input=inputs, **_dimensions_kwargs()).data
+
+
+# single queries from concurrent requests are sent as one embeddings call;
+# the batcher's sender threads make the (sync) call for async callers too
+embedding_batcher = EmbeddingBatcher(
+    _create_embeddings,
+    window_ms=Config.EMBED_BATCH_WINDOW_MS,
+    max_inputs=Config.EMBED_BATCH_MAX_INPUTS,
+    concurrency=Config.EMBED_BATCH_CONCURRENCY,
+)
+
+
+def _per_collection(value):
+    return lambda: {(name,): value(store) for name, store in vector_store.collections().items()}
+
+
+registry.register("rag_documents", "Live documents per collection.", _per_collection(len), labels=("collection",))
+registry.register(
+    "rag_index_rows", "Rows in the vector index per collection, tombstoned ones included.",
+    _per_collection(lambda store: store.ntotal), labels=("collection",),
+)
+registry.register(
+    "rag_deleted_rows", "Tombstoned rows awaiting compaction per collection.",
+    _per_collection(lambda store: store.deleted), labels=("collection",),
+)
+registry.register(
+    "embedding_cache_lookups_total", "Embedding cache lookups by result.",
+    lambda: {(result,): embedding_cache.stats()[field]
+             for result, field in (("memory_hit", "hits_memory"), ("disk_hit", "hits_disk"), ("miss", "misses"))},
+    kind="counter", labels=("result",),
+)
+registry.register("embedding_cache_entries", "Embeddings held in memory.",
+                  lambda: embedding_cache.stats()["memory_entries"])
+registry.register("embedding_cache_disk_bytes", "Size of the on-disk embedding cache.",
+                  lambda: embedding_cache.stats()["disk_bytes"])
+registry.register("embedding_batcher_requests_total", "Embedding requests submitted to the batcher.",
+                  lambda: embedding_batcher.requests, kind="counter")
+registry.register("embedding_batcher_batches_total", "Embeddings calls made by the batcher.",
+                  lambda: embedding_batcher.batches, kind="counter")
+
+
+def _batched(inputs):
+    return embedding_batcher.window_ms > 0 and len(inputs) < embedding_batcher.max_inputs
+
+
+def _embeddings_key(inputs):
+    # concurrent misses for the same texts (e.g. one hot query) share a request
+    return flight_key(EMBEDDING_MODEL, {"input": inputs, **_dimensions_kwargs()})
+
+
+def _dimensions_kwargs():
+    return {"dimensions": Config.EMBEDDING_DIMENSIONS} if Config.EMBEDDING_DIMENSIONS else {}
+
+
+def _fake_embeddings(texts):
+    # deterministic pseudo-embeddings: depend on text length and index
+    positions = np.arange(1, len(texts) + 1) % 10
+    lengths = np.fromiter((len(t) % 5 for t in texts), dtype=np.int64, count=len(texts))
+    values = (positions + lengths).astype(np.float32)
+    return list(np.repeat(values[:, None], embedding_dim, axis=1))
+
+
+def _cache_lookup(texts):
+    """Return (embeddings with None for misses, {key: [positions]} of misses)."""
+    # shortened embeddings are cached apart from full-size ones
+    model = f"{EMBEDDING_MODEL}@{embedding_dim}" if Config.EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
+    keys = [cache_key(model, t) for t in texts]
+    embeddings = embedding_cache.get_many(keys)
+
+    # each distinct missing text is embedded once, even if repeated in `texts`
+    missing = {}
+    for i, key in enumerate(keys):
+        if embeddings[i] is None:
+            missing.setdefault(key, []).append(i)
+    return embeddings, missing
+
+
+def _cache_fill(embeddings, missing, data):
+    vectors = [np.array(d.embedding, dtype=np.float32) for d in data]
+    embedding_cache.put_many(list(missing), vectors)
+    for positions, vec in zip(missing.values(), vectors):
+        for i in positions:
+            embeddings[i] = vec
+    return embeddings
+
+
+def get_store(collection=DEFAULT_COLLECTION, create=True):
+    """The vector store of `collection` (None if missing and not `create`)."""
+    return vector_store.get_store(collection, dim=embedding_dim, create=create)
+
+
+def add_documents(text_list, collection=DEFAULT_COLLECTION, metadatas=None):
+    """Store text data + embeddings in FAISS; identical texts are stored once."""
+    return upsert_documents(text_list, collection=collection, metadatas=metadatas)
+
+
+def upsert_documents(texts, ids=None, collection=DEFAULT_COLLECTION, metadatas=None):
+    """Insert or replace documents by id (default: derived from the text).
+
+    `metadatas` holds an optional metadata dict per text. Only new or
+    changed documents are embedded. Returns {"added", "updated",
+    "unchanged"} counts; raises ValueError for invalid metadata.
+    """
+    ids = ids or [vector_store.content_id(t) for t in texts]
+    metadatas = metadatas or [None] * len(texts)
+    for metadata in metadatas:
+        validate_metadata(metadata)
+    latest = {doc_id: (text, meta) for doc_id, text, meta in zip(ids, texts, metadatas)}  # last one wins
+    ids = list(latest)
+    texts, metadatas = [t for t, _ in latest.values()], [m for _, m in latest.values()]
+    todo = get_store(collection).changed(ids, texts, metadatas)
+    counts = {"added": 0, "updated": 0, "unchanged": len(ids) - len(todo)}
+    if todo:
+        batch = [texts[i] for i in todo]
+        stored = add_embeddings(
+            batch, embed_text(batch), ids=[ids[i] for i in todo], collection=collection,
+            metadatas=[metadatas[i] for i in todo],
+        )
+        for key, n in stored.items():
+            counts[key] += n
+    return counts
+
+
+def add_embeddings(text_list, embeddings, snapshot=True, collection=DEFAULT_COLLECTION, ids=None,
+                   metadatas=None):
+    """Upsert already-embedded texts into `collection` as one atomic batch.
+
+    With snapshot=False the change is only counted as pending, so bulk
+    ingestion can write a single snapshot at the end.
+    """
+    store = get_store(collection)
+    ids = ids or [vector_store.content_id(t) for t in text_list]
+    counts = store.upsert(ids, text_list, embeddings, snapshot=snapshot, metadatas=metadatas)
+    if counts["added"] or counts["updated"]:
+        # cached RAG answers may no longer match the corpus
+        response_cache.invalidate("rag")
+    return counts
+
+
+def delete_documents(ids, collection=DEFAULT_COLLECTION):
+    """Delete documents by id; returns how many existed."""
+    store = get_store(collection, create=False)
+    deleted = store.delete(ids) if store is not None else 0
+    if deleted:
+        response_cache.invalidate("rag")
+    return deleted
+
+
+def get_document(doc_id, collection=DEFAULT_COLLECTION):
+    store = get_store(collection, create=False)
+    return store.get(doc_id) if store is not None else None
+
+
+def get_metadata(doc_id, collection=DEFAULT_COLLECTION):
+    store = get_store(collection, create=False)
+    return store.metadata(doc_id) if store is not None else None
+
+
+def compact_store(collection=DEFAULT_COLLECTION, wait=True):
+    """Rebuild `collection` without its deleted rows."""
+    get_store(collection).compact(wait=wait)
+
+
+def rebuild_index(kind=None, wait=True, collection=DEFAULT_COLLECTION):
+    """Retrain `collection`'s index as `kind` (default RAG_INDEX_TYPE)."""
+    get_store(collection).rebuild(kind, wait=wait)
+
+
+def load_store(directory=None):
+    """Restore every collection from its latest snapshot under `directory`.
+
+    Enables snapshotting into `directory` even when no snapshot exists yet.
+    Returns the number of documents loaded.
+    """
+    directory = directory or Config.RAG_STORE_DIR
+    if not directory:
+        return 0
+    return vector_store.open_root(directory, dim=embedding_dim)
+
+
+def refresh_stores():
+    """Reload the collections other worker processes have changed; returns their names."""
+    reloaded = vector_store.refresh_all(dim=embedding_dim)
+    if reloaded:
+        response_cache.invalidate("rag")
+    return reloaded
+
+
+def snapshot_store(collection=DEFAULT_COLLECTION):
+    """Write a snapshot of `collection` now if persistence is enabled."""
+    return get_store(collection).snapshot()
+
+
+def retrieve_context(query, top_k=3, nprobe=None, ef_search=None, collection=DEFAULT_COLLECTION,
+                     mode=None, where=None, min_similarity=None, fetch_k=None, reranker=None):
+    """Find most relevant documents for a query, as {"id", "text", "score", "metadata"} hits.
+
+    `nprobe` (IVF) and `ef_search` (HNSW) trade recall for latency per call.
+    `mode` (default RAG_RETRIEVAL_MODE) is one of RETRIEVAL_MODES; "lexical"
+    answers from the BM25 index alone, without an embeddings call.
+    `where` restricts the search to documents whose metadata matches the
+    filter (see app.metadata). Vector hits less similar than
+    `min_similarity` (default RAG_MIN_SIMILARITY) are dropped, so a query
+    without good matches gets less, not worse, context.
+    With a `reranker` (default RAG_RERANKER, see app.rerank) `fetch_k`
+    candidates (default top_k * RAG_FETCH_K_FACTOR) are retrieved and
+    re-ranked down to top_k.
+    """
+    store = get_store(collection, create=False)
+    if store is None:
+        return []
+    mode = mode or Config.RAG_RETRIEVAL_MODE
+    reranker = reranker or Config.RAG_RERANKER
+    if mode == "lexical":
+        with stage("search"):
+            hits = store.search_lexical(query, _candidates(top_k, fetch_k, reranker), where)
+        return _rerank(store, query, None, hits, top_k, reranker)
+    query_emb = embed_text([query])[0]
+    return _search(store, query, query_emb, top_k, nprobe, ef_search, mode, where, min_similarity,
+                   fetch_k, reranker)
+
+
+async def retrieve_context_async(query, top_k=3, nprobe=None, ef_search=None, collection=DEFAULT_COLLECTION,
+                                 mode=None, where=None, min_similarity=None, fetch_k=None, reranker=None):
+    store = get_store(collection, create=False)
+    if store is None:
+        return []
+    mode = mode or Config.RAG_RETRIEVAL_MODE
+    reranker = reranker or Config.RAG_RERANKER
+    if mode == "lexical":
+        with stage("search"):
+            hits = store.search_lexical(query, _candidates(top_k, fetch_k, reranker), where)
+        return await asyncio.to_thread(_rerank, store, query, None, hits, top_k, reranker)
+    query_emb = (await embed_text_async([query]))[0]
+    # FAISS releases the GIL, so large searches don't stall the event loop
+    return await asyncio.to_thread(
+        _search, store, query, query_emb, top_k, nprobe, ef_search, mode, where, min_similarity, fetch_k, reranker
     )
-    return [np.array(d.embedding, dtype=np.float32) for d in response.data]
 
 
-def add_documents(text_list):
-    """Store text data + embeddings in FAISS."""
-    global documents
-    embeddings = embed_text(text_list)
-    faiss_matrix = np.vstack(embeddings)
-    index.add(faiss_matrix)
-    documents.extend(text_list)
+def retrieve_context_batch(queries, top_k=3, nprobe=None, ef_search=None, collection=DEFAULT_COLLECTION,
+                           mode=None, where=None, min_similarity=None, fetch_k=None, reranker=None):
+    """`retrieve_context` for many queries: one embeddings request, one FAISS search."""
+    store = get_store(collection, create=False)
+    if store is None or not queries:
+        return [[] for _ in queries]
+    mode = mode or Config.RAG_RETRIEVAL_MODE
+    reranker = reranker or Config.RAG_RERANKER
+    candidates = _candidates(top_k, fetch_k, reranker)
+    if mode == "lexical":
+        with stage("search"):
+            results = [store.search_lexical(q, candidates, where) for q in queries]
+        return [_rerank(store, q, None, hits, top_k, reranker) for q, hits in zip(queries, results)]
+    per_retriever = _fetch_k(candidates, mode)
+    query_embs = np.vstack(embed_text(queries))
+    with stage("search"):
+        results = store.search_batch(query_embs, per_retriever, nprobe, ef_search, where,
+                                     _min_similarity(min_similarity))
+        if mode == "hybrid":
+            results = [_fuse(hits, store.search_lexical(q, per_retriever, where), candidates)
+                       for q, hits in zip(queries, results)]
+    return [_rerank(store, q, emb, hits, top_k, reranker) for q, emb, hits in zip(queries, query_embs, results)]
+
+
+def _search(store, query, query_emb, top_k, nprobe, ef_search, mode, where=None, min_similarity=None,
+            fetch_k=None, reranker="none"):
+    candidates = _candidates(top_k, fetch_k, reranker)
+    with stage("search"):
+        hits = _search_store(store, query, query_emb, candidates, nprobe, ef_search, mode, where, min_similarity)
+    return _rerank(store, query, query_emb, hits, top_k, reranker)
+
+
+def _search_store(store, query, query_emb, top_k, nprobe, ef_search, mode, where, min_similarity):
+    fetch_k = _fetch_k(top_k, mode)
+    dense = store.search(query_emb, fetch_k, nprobe, ef_search, where, _min_similarity(min_similarity))
+    if mode != "hybrid":
+        return dense
+    return _fuse(dense, store.search_lexical(query, fetch_k, where), top_k)
+
+
+def _candidates(top_k, fetch_k, reranker):
+    # how many hits to retrieve before re-ranking down to top_k
+    if reranker == "none":
+        return top_k
+    return max(top_k, fetch_k or top_k * Config.RAG_FETCH_K_FACTOR)
 
 
-def retrieve_context(query, top_k=3):
-    """Find most relevant documents for a query."""
-    query_emb = embed_text([query])[0].reshape(1, -1)
-    distances, indices = index.search(query_emb, top_k)
-    results = [documents[i] for i in indices[0] if i < len(documents)]
-    return results
+def _rerank(store, query, query_emb, hits, top_k, reranker):
+    if reranker == "none" or len(hits) <= top_k:
+        return hits[:top_k]
+    with stage("rerank"):
+        if reranker == "cross_encoder":
+            order = rerank.cross_encode(query, [hit["text"] for hit in hits], top_k)
+        elif query_emb is not None:
+            vectors = store.vectors([hit["id"] for hit in hits])
+            order = rerank.mmr(query_emb, vectors, top_k, Config.RAG_MMR_LAMBDA)
+        else:
+            return hits[:top_k]  # lexical retrieval has no query embedding to diversify against
+        return [hits[i] for i in order]
 
 
-def answer_query(query):
+def _min_similarity(value):
+    return Config.RAG_MIN_SIMILARITY if value is None else value
+
+
+def _fetch_k(top_k, mode):
+    # fusion needs a deeper candidate list from each retriever than it returns
+    return max(top_k, Config.RAG_HYBRID_FETCH_K) if mode == "hybrid" else top_k
+
+
+def _fuse(dense, lexical, top_k):
+    return reciprocal_rank_fusion([dense, lexical], top_k, k=Config.RAG_RRF_K)
+
+
+def answer_query(query, **search_kwargs):
     """Retrieve context + ask GPT. In fake mode, return a canned response."""
-    context = retrieve_context(query)
+    return _complete_rag(query, retrieve_context(query, **search_kwargs))
+
+
+def _complete_rag(query, context):
     if _is_fake_mode():
         return f"(test) Answer to: {query}"
 
-    context_text = "\n\n".join(context)
-    prompt = f"Use the following context to answer:\n{context_text}\n\nQuestion: {query}"
-    client = _get_client()
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    return completion.choices[0].message.content
+    return complete_chat([{"role": "user", "content": _rag_prompt(query, context)}])
 
 
-from app.memory_service import add_to_memory, get_memory
+def answer_queries(queries, concurrency=None, **search_kwargs):
+    """Answer many questions; yield one result dict per question as it finishes.
 
+    Retrieval is batched (see `retrieve_context_batch`), then at most
+    `concurrency` (default RAG_BATCH_CONCURRENCY) completions run at once.
+    Results are {"index", "query", "response", "sources"} or, for a failed
+    completion, {"index", "query", "error"}.
+    """
+    contexts = retrieve_context_batch(queries, **search_kwargs)
+    pool = ThreadPoolExecutor(max_workers=concurrency or Config.RAG_BATCH_CONCURRENCY)
+    try:
+        futures = {
+            pool.submit(_complete_rag, query, context): i
+            for i, (query, context) in enumerate(zip(queries, contexts))
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            result = {"index": i, "query": queries[i]}
+            try:
+                result["response"] = future.result()
+                result["sources"] = [{"id": h["id"], "score": h["score"]} for h in contexts[i]]
+            except Exception as e:
+                result["error"] = str(e)
+            yield result
+    finally:
+        # stop queued completions if the consumer goes away early
+        pool.shutdown(wait=False, cancel_futures=True)
 
-def answer_with_memory_and_rag(session_id, user_query):
-    """Combine RAG context and chat memory for a better answer."""
 
-    # Step 1: Retrieve relevant RAG context
-    context = retrieve_context(user_query)
-    context_text = "\n\n".join(context) if context else "No external context found."
+async def answer_query_async(query, **search_kwargs):
+    """Async version of `answer_query`."""
+    context = await retrieve_context_async(query, **search_kwargs)
+    if _is_fake_mode():
+        return f"(test) Answer to: {query}"
 
-    # Step 2: Get chat memory
-    history = get_memory(session_id)
+    return await complete_chat_async([{"role": "user", "content": _rag_prompt(query, context)}])
 
-    # Step 3: Construct messages
-    messages = history + [
-        {"role": "system", "content": f"Use the following context:\n{context_text}"},
-        {"role": "user", "content": user_query},
-    ]
+
+def stream_answer_query(query, **search_kwargs):
+    """Like `answer_query`, but yield the answer as text deltas."""
+    context = retrieve_context(query, **search_kwargs)
+    if _is_fake_mode():
+        yield from fake_stream(f"(test) Answer to: {query}")
+        return
+
+    yield from stream_completion([{"role": "user", "content": _rag_prompt(query, context)}])
+
+
+def _rag_prompt(query, context):
+    context_text = "\n\n".join(hit["text"] for hit in context)
+    return f"Use the following context to answer:\n{context_text}\n\nQuestion: {query}"
+
+
+from app.context_builder import build_messages, remember_turn
+
+
+def answer_with_memory_and_rag(session_id, user_query, usage=None, collection=DEFAULT_COLLECTION):
+    """Combine RAG context and chat memory for a better answer.
+
+    If `usage` is a dict it receives the prompt token estimate and how many
+    tokens the budgeted context saved.
+    """
+
+    # Step 1: Retrieve relevant RAG context
+    context = retrieve_context(user_query, collection=collection)
+
+    # Step 2-3: Get chat memory and pack history + context into the token budget
+    messages, stats = build_messages(session_id, user_query, [hit["text"] for hit in context])
+    if usage is not None:
+        usage.update(stats)
 
     # Step 4: Query the model
     if _is_fake_mode():
         response = f"(test) Memory+RAG answer to: {user_query}"
     else:
-        client = _get_client()
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
-        )
+        with stage("completion"):
+            completion = openai_client.create_chat_completion(
+                model=CHAT_MODEL,
+                messages=messages
+            )
         response = completion.choices[0].message.content
 
-    # Step 5: Update memory
-    add_to_memory(session_id, "user", user_query)
-    add_to_memory(session_id, "assistant", response)
+    # Step 5: Update memory (older turns roll into the session summary)
+    remember_turn(session_id, user_query, response)
 
     return response
+
+
+async def answer_with_memory_and_rag_async(session_id, user_query, usage=None, collection=DEFAULT_COLLECTION):
+    """Async version of `answer_with_memory_and_rag`."""
+    context = await retrieve_context_async(user_query, collection=collection)
+    messages, stats = build_messages(session_id, user_query, [hit["text"] for hit in context])
+    if usage is not None:
+        usage.update(stats)
+
+    if _is_fake_mode():
+        response = f"(test) Memory+RAG answer to: {user_query}"
+    else:
+        with stage("completion"):
+            completion = await openai_client.create_chat_completion_async(
+                model=CHAT_MODEL,
+                messages=messages
+            )
+        response = completion.choices[0].message.content
+
+    await asyncio.to_thread(remember_turn, session_id, user_query, response)
+    return response
+
+
+def stream_answer_with_memory_and_rag(session_id, user_query, usage=None, collection=DEFAULT_COLLECTION):
+    """Like `answer_with_memory_and_rag`, but yield text deltas.
+
+    Memory is only updated once the stream has completed, with the full answer.
+    """
+    context = retrieve_context(user_query, collection=collection)
+    messages, stats = build_messages(session_id, user_query, [hit["text"] for hit in context])
+    if usage is not None:
+        usage.update(stats)
+
+    if _is_fake_mode():
+        deltas = fake_stream(f"(test) Memory+RAG answer to: {user_query}")
+    else:
+        deltas = stream_completion(messages)
+
+    parts = []
+    for delta in deltas:
+        parts.append(delta)
+        yield delta
+
+    remember_turn(session_id, user_query, "".join(parts))
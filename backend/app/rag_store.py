@@ -0,0 +1,295 @@
+# app/rag_store.py
+"""On-disk snapshots for the RAG index and its document table.
+
+A snapshot is a directory holding:
+  - index.faiss  the FAISS index (mapped read-only, see `read_index`)
+  - docs.bin     all document texts, utf-8 encoded and concatenated
+  - docs.idx     uint64 byte offsets into docs.bin (len = n_docs + 1), .npy
+  - ids.bin/.idx the stable document id of every row, same layout (optional)
+  - deleted.npy  int64 rows deleted since the last compaction (optional)
+  - metadata.*   the columnar metadata table (optional, see app.metadata)
+  - vectors.npy  full-precision float32 vectors, kept when the index stores
+                 quantized ones (optional)
+
+Snapshots are written to a temp directory, renamed into place and then
+published by atomically replacing the CURRENT pointer file, so readers
+never see a half-written snapshot. Because everything is mmap'd, several
+worker processes loading the same snapshot share the OS page cache.
+Processes writing to the same directory serialize on `directory_lock`.
+"""
+import mmap
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single writer process is assumed
+    fcntl = None
+
+import faiss
+import numpy as np
+
+from app.config import Config
+from app.metadata import MetadataTable
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "LOCK"
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "docs.bin"
+OFFSETS_FILE = "docs.idx"
+IDS_FILE = "ids.bin"
+IDS_OFFSETS_FILE = "ids.idx"
+DELETED_FILE = "deleted.npy"
+VECTORS_FILE = "vectors.npy"
+KEEP_SNAPSHOTS = 2
+
+
+class DocumentTable:
+    """List-like document store backed by an mmap'd offset-indexed file.
+
+    Documents loaded from a snapshot stay on disk and are decoded on access;
+    documents added afterwards are kept in memory until the next snapshot.
+    """
+
+    def __init__(self, data_path=None, offsets_path=None):
+        self._mmap = None
+        self._offsets = np.zeros(1, dtype=np.uint64)
+        self._tail = []
+        if data_path and offsets_path:
+            self._offsets = np.load(offsets_path, mmap_mode="r")
+            if os.path.getsize(data_path) > 0:
+                with open(data_path, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def _base_len(self):
+        return len(self._offsets) - 1
+
+    def __len__(self):
+        return self._base_len + len(self._tail)
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("document index out of range")
+        if i >= self._base_len:
+            return self._tail[i - self._base_len]
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._mmap[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, text):
+        self._tail.append(text)
+
+    def extend(self, texts):
+        self._tail.extend(texts)
+
+    def write(self, data_path, offsets_path):
+        """Write the full table; the mmap'd part is copied without decoding."""
+        base_end = int(self._offsets[-1])
+        offsets = np.empty(len(self) + 1, dtype=np.uint64)
+        offsets[: self._base_len + 1] = self._offsets
+        with open(data_path, "wb") as f:
+            if self._mmap is not None:
+                f.write(memoryview(self._mmap)[:base_end])
+            pos = base_end
+            for j, text in enumerate(self._tail):
+                data = text.encode("utf-8")
+                f.write(data)
+                pos += len(data)
+                offsets[self._base_len + j + 1] = pos
+            f.flush()
+            os.fsync(f.fileno())
+        with open(offsets_path, "wb") as f:
+            np.save(f, offsets)
+
+
+class VectorTable:
+    """Append-only float32 matrix backed by an mmap'd .npy file.
+
+    Like DocumentTable, rows loaded from a snapshot stay on disk (so the
+    full-precision copy next to a quantized index costs page cache, not
+    heap) and rows added afterwards are kept in memory until the next
+    snapshot.
+    """
+
+    def __init__(self, dim=None, path=None):
+        if path:
+            self._base = np.load(path, mmap_mode="r")
+            dim = self._base.shape[1]
+        else:
+            self._base = np.zeros((0, dim), dtype=np.float32)
+        self.dim = dim
+        self._tail = np.zeros((0, dim), dtype=np.float32)
+        self._tail_len = 0
+
+    def __len__(self):
+        return len(self._base) + self._tail_len
+
+    def append(self, matrix):
+        end = self._tail_len + len(matrix)
+        if end > len(self._tail):
+            grown = np.empty((max(end, 2 * len(self._tail), 1024), self.dim), dtype=np.float32)
+            grown[: self._tail_len] = self._tail[: self._tail_len]
+            self._tail = grown
+        self._tail[self._tail_len:end] = matrix
+        self._tail_len = end
+
+    def take(self, rows):
+        """The vectors of `rows`, as a new (len(rows), dim) array."""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        in_base = rows < len(self._base)
+        out[in_base] = self._base[rows[in_base]]
+        out[~in_base] = self._tail[rows[~in_base] - len(self._base)]
+        return out
+
+    def write(self, path, block=65536):
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(len(self), self.dim))
+        for start in range(0, len(self), block):
+            out[start:start + block] = self.take(np.arange(start, min(start + block, len(self))))
+        out.flush()
+        del out
+
+
+def current_snapshot(directory):
+    """Return the path of the published snapshot, or None."""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(directory, name)
+    return path if name and os.path.isdir(path) else None
+
+
+@contextmanager
+def directory_lock(directory):
+    """Hold an exclusive flock on `directory` (across processes, not reentrant)."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _as_table(rows):
+    if isinstance(rows, DocumentTable):
+        return rows
+    table = DocumentTable()
+    table.extend(rows)
+    return table
+
+
+def save_snapshot(directory, index, documents, ids=None, deleted=None, metadata=None, vectors=None):
+    """Atomically write `index` and `documents` (plus row ids/tombstones/metadata/vectors) as a new snapshot."""
+    os.makedirs(directory, exist_ok=True)
+    name = f"snap-{time.time_ns()}"
+    tmp_path = os.path.join(directory, name + ".tmp")
+    os.makedirs(tmp_path)
+    try:
+        faiss.write_index(index, os.path.join(tmp_path, INDEX_FILE))
+        _as_table(documents).write(
+            os.path.join(tmp_path, DOCS_FILE),
+            os.path.join(tmp_path, OFFSETS_FILE),
+        )
+        if ids is not None:
+            _as_table(ids).write(
+                os.path.join(tmp_path, IDS_FILE),
+                os.path.join(tmp_path, IDS_OFFSETS_FILE),
+            )
+        if deleted is not None:
+            with open(os.path.join(tmp_path, DELETED_FILE), "wb") as f:
+                np.save(f, np.asarray(sorted(deleted), dtype=np.int64))
+        if metadata is not None:
+            metadata.write(tmp_path)
+        if vectors is not None:
+            vectors.write(os.path.join(tmp_path, VECTORS_FILE))
+        os.rename(tmp_path, os.path.join(directory, name))
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    pointer_tmp = os.path.join(directory, CURRENT_FILE + ".tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(directory, CURRENT_FILE))
+    _prune(directory, keep=name)
+    return os.path.join(directory, name)
+
+
+def read_index(path):
+    """Map the index file at `path` read-only.
+
+    Flat and SQ codes, HNSW vectors and IVF lists stay in the page cache
+    instead of being copied onto the heap. Adding to the result aborts
+    the process: take a `writable` copy first.
+    """
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+
+
+def writable(index):
+    """An in-memory copy of a mapped index, which can be added to."""
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+def load_snapshot(directory, with_rows=False):
+    """Load the published snapshot as (index, DocumentTable), or None.
+
+    With `with_rows` the result is (index, documents, ids, deleted, metadata,
+    vectors), where `ids`/`metadata`/`vectors` are None and `deleted` empty
+    for snapshots written without them.
+    """
+    path = current_snapshot(directory)
+    if path is None:
+        return None
+    index = read_index(os.path.join(path, INDEX_FILE))
+    tables = open_tables(path, with_metadata=with_rows)
+    return (index, *tables) if with_rows else (index, tables[0])
+
+
+def open_tables(path, with_metadata=True):
+    """Open the (documents, ids, deleted, metadata, vectors) tables of the snapshot at `path`."""
+    documents = DocumentTable(
+        os.path.join(path, DOCS_FILE), os.path.join(path, OFFSETS_FILE)
+    )
+    ids = None
+    if os.path.exists(os.path.join(path, IDS_FILE)):
+        ids = DocumentTable(
+            os.path.join(path, IDS_FILE), os.path.join(path, IDS_OFFSETS_FILE)
+        )
+    deleted = np.zeros(0, dtype=np.int64)
+    if os.path.exists(os.path.join(path, DELETED_FILE)):
+        deleted = np.load(os.path.join(path, DELETED_FILE))
+    metadata = None
+    if with_metadata:
+        metadata = MetadataTable.read(path, Config.RAG_METADATA_BITMAP_FIELDS)
+    vectors = None
+    if os.path.exists(os.path.join(path, VECTORS_FILE)):
+        vectors = VectorTable(path=os.path.join(path, VECTORS_FILE))
+    return documents, ids, deleted, metadata, vectors
+
+
+def _prune(directory, keep):
+    # Processes that already mmap'd an old snapshot keep their mapping after
+    # the files are unlinked, so removing them here is safe.
+    snaps = sorted(
+        d for d in os.listdir(directory)
+        if d.startswith("snap-") and not d.endswith(".tmp") and d != keep
+    )
+    for d in snaps[: max(0, len(snaps) - (KEEP_SNAPSHOTS - 1))]:
+        shutil.rmtree(os.path.join(directory, d), ignore_errors=True)
@@ -0,0 +1,235 @@
+# app/rate_limiter.py
+"""Token-bucket admission control.
+
+Tokens are taken in two places:
+  - `admit_client` (from require_api_key, and from admit_request on the
+    routes that take no key): per API key, or per client address when no
+    valid key is sent, one request plus the estimated tokens of the
+    request body. Over the limit the request is rejected with 429 +
+    Retry-After before any work is done.
+  - `acquire_upstream` (from openai_client, before every upstream call,
+    retries included):
+    per model and for the process-wide upstream budget, one request plus
+    the estimated prompt and completion tokens. When the budget is short
+    the call waits for it for up to RATE_LIMIT_MAX_WAIT seconds (queueing),
+    longer waits are refused with RateLimited (shedding).
+
+Limits are per minute; 0 disables a bucket. A bucket holds
+RATE_LIMIT_BURST_SECONDS worth of its rate. All buckets of one admission
+are taken together or not at all, so a refused call does not use up
+another bucket. Bucket state lives in process memory or, with
+RATE_LIMIT_BACKEND=sqlite, in a SQLite file shared by all workers on the
+host.
+"""
+import asyncio
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from app.config import Config
+
+
+class RateLimited(Exception):
+    """Raised instead of admitting a request or upstream call over its limit."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"Rate limit exceeded ({scope}), retry later")
+        self.scope = scope
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def _level(tokens, updated, rate, capacity, now):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _shortfall(demands, levels):
+    """Seconds until every bucket holds its amount (0 if they all do now)."""
+    wait = 0.0
+    for (_, amount, rate, capacity), level in zip(demands, levels):
+        # a request bigger than the bucket waits for a full one and leaves it in debt
+        amount = min(amount, capacity)
+        if amount > level:
+            wait = max(wait, (amount - level) / rate)
+    return wait
+
+
+class InMemoryBuckets:
+    def __init__(self):
+        self._buckets = {}  # name -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, demands):
+        """Take [(name, amount, rate/s, capacity)] all at once; return the wait if refused."""
+        now = time.time()
+        with self._lock:
+            levels = [
+                _level(*self._buckets.get(name, (capacity, now)), rate, capacity, now)
+                for name, _, rate, capacity in demands
+            ]
+            wait = _shortfall(demands, levels)
+            if not wait:
+                for (name, amount, _, _), level in zip(demands, levels):
+                    self._buckets[name] = (level - amount, now)
+            return wait
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite file (WAL), so every worker on the host shares them."""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def take(self, demands):
+        names = [d[0] for d in demands]
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so read-refill-write is atomic across processes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                rows = {name: (tokens, updated) for name, tokens, updated in self._db.execute(
+                    f"SELECT name, tokens, updated FROM buckets WHERE name IN ({','.join('?' * len(names))})",
+                    names,
+                )}
+                levels = [
+                    _level(*rows.get(name, (capacity, now)), rate, capacity, now)
+                    for name, _, rate, capacity in demands
+                ]
+                wait = _shortfall(demands, levels)
+                if not wait:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                        [(name, level - amount, now) for (name, amount, _, _), level in zip(demands, levels)],
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return wait
+
+
+def parse_model_limits(value):
+    """"gpt-4o-mini=500/200000,text-embedding-3-small=3000/1000000" -> {model: (rpm, tpm)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        model, _, rpm_tpm = item.partition("=")
+        rpm, _, tpm = rpm_tpm.partition("/")
+        limits[model.strip()] = (float(rpm or 0), float(tpm or 0))
+    return limits
+
+
+class RateLimiter:
+    def __init__(self, buckets, client_rpm=0, client_tpm=0, model_limits=None,
+                 upstream_rpm=0, upstream_tpm=0, burst_seconds=10, max_wait=0):
+        self.buckets = buckets
+        self.client_rpm = client_rpm
+        self.client_tpm = client_tpm
+        self.model_limits = model_limits or {}
+        self.upstream_rpm = upstream_rpm
+        self.upstream_tpm = upstream_tpm
+        self.burst_seconds = burst_seconds
+        self.max_wait = max_wait
+
+    def _demand(self, name, amount, per_minute):
+        rate = per_minute / 60
+        return name, amount, rate, max(1.0, rate * self.burst_seconds)
+
+    def _demands(self, pairs):
+        """[(name, amount, per_minute)] -> bucket demands, skipping disabled limits."""
+        return [self._demand(name, amount, limit) for name, amount, limit in pairs if limit > 0]
+
+    def admit_client(self, api_key, tokens, address=None):
+        """Admit one request of about `tokens` tokens or raise RateLimited.
+
+        The bucket is the API key's, or the client address's when
+        `api_key` is None; pass only keys that were checked, so made-up
+        keys cannot each get a fresh bucket.
+        """
+        if api_key is not None:
+            prefix, client, scope = "key:", api_key, "API key"
+        else:
+            prefix, client, scope = "addr:", address or "", "client address"
+        # bucket names are persisted by the sqlite backend, so they are hashed
+        name = prefix + hashlib.sha256(client.encode("utf-8")).hexdigest()[:16]
+        demands = self._demands([(name + ":rpm", 1, self.client_rpm), (name + ":tpm", tokens, self.client_tpm)])
+        wait = self.buckets.take(demands) if demands else 0
+        if wait:
+            raise RateLimited(scope, wait)
+
+    def _upstream_demands(self, model, tokens):
+        rpm, tpm = self.model_limits.get(model, (0, 0))
+        return self._demands([
+            (f"model:{model}:rpm", 1, rpm), (f"model:{model}:tpm", tokens, tpm),
+            ("upstream:rpm", 1, self.upstream_rpm), ("upstream:tpm", tokens, self.upstream_tpm),
+        ])
+
+    def acquire_upstream(self, model, tokens):
+        """Wait (up to `max_wait` in total) for budget for one call to `model`."""
+        demands = self._upstream_demands(model, tokens)
+        waited = 0.0
+        while demands:
+            wait = self.buckets.take(demands)
+            if not wait:
+                return
+            if waited + wait > self.max_wait:
+                raise RateLimited(f"upstream {model}", wait)
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_upstream_async(self, model, tokens):
+        """Async version of `acquire_upstream`."""
+        demands = self._upstream_demands(model, tokens)
+        waited = 0.0
+        while demands:
+            if isinstance(self.buckets, InMemoryBuckets):
+                wait = self.buckets.take(demands)
+            else:
+                # a SQLite write transaction may wait on other workers; keep it off the event loop
+                wait = await asyncio.to_thread(self.buckets.take, demands)
+            if not wait:
+                return
+            if waited + wait > self.max_wait:
+                raise RateLimited(f"upstream {model}", wait)
+            await asyncio.sleep(wait)
+            waited += wait
+
+
+def _create_buckets():
+    backend = Config.RATE_LIMIT_BACKEND
+    if backend == "sqlite":
+        return SQLiteBuckets(Config.RATE_LIMIT_SQLITE_PATH)
+    if backend != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{backend}'")
+    return InMemoryBuckets()
+
+
+_limiter = None
+_limiter_pid = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """The process's limiter; created on first use (and again after a fork)."""
+    global _limiter, _limiter_pid
+    with _limiter_lock:
+        if _limiter is None or _limiter_pid != os.getpid():
+            _limiter = RateLimiter(
+                _create_buckets(),
+                client_rpm=Config.RATE_LIMIT_KEY_RPM,
+                client_tpm=Config.RATE_LIMIT_KEY_TPM,
+                model_limits=parse_model_limits(Config.RATE_LIMIT_MODELS),
+                upstream_rpm=Config.RATE_LIMIT_UPSTREAM_RPM,
+                upstream_tpm=Config.RATE_LIMIT_UPSTREAM_TPM,
+                burst_seconds=Config.RATE_LIMIT_BURST_SECONDS,
+                max_wait=Config.RATE_LIMIT_MAX_WAIT,
+            )
+            _limiter_pid = os.getpid()
+        return _limiter
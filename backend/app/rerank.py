@@ -0,0 +1,85 @@
+# app/rerank.py
+"""Post-retrieval re-ranking: choose top_k of the fetch_k retrieved hits.
+
+The nearest neighbours of a query are often near-duplicate chunks (the
+same paragraph in two uploads, overlapping chunks of one page), which
+crowd everything else out of a small top_k. Retrieval therefore
+over-fetches and one of RERANKERS picks the context:
+
+  - mmr            Maximal Marginal Relevance on the candidates' stored
+                   vectors, no extra API call: each pick maximizes
+                   lambda * sim(query, d) - (1 - lambda) * max sim(d, picked)
+  - cross_encoder  scores each (query, text) pair with a local
+                   cross-encoder (RAG_CROSS_ENCODER_MODEL; needs
+                   `pip install sentence-transformers`)
+
+Both return positions into the candidate list, best first.
+"""
+import threading
+
+import numpy as np
+
+from app.config import Config
+
+RERANKERS = ("none", "mmr", "cross_encoder")
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+
+def mmr(query, vectors, top_k, lambda_mult=0.5):
+    """Positions of `top_k` rows of `vectors` picked by Maximal Marginal Relevance.
+
+    Similarities are cosine; the candidate-candidate matrix is computed
+    once and each greedy step only updates a running max.
+    """
+    n = len(vectors)
+    top_k = min(top_k, n)
+    if top_k <= 0:
+        return []
+    vectors = _unit(np.asarray(vectors, dtype=np.float32))
+    query = _unit(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    picked = [int(np.argmax(relevance))]
+    redundancy = similarity[picked[0]].copy()  # max similarity to anything picked so far
+    available = np.ones(n, dtype=bool)
+    available[picked[0]] = False
+    while len(picked) < top_k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return picked
+
+
+def _unit(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def cross_encode(query, texts, top_k):
+    """Positions of the `top_k` of `texts` the cross-encoder scores highest for `query`."""
+    if not texts:
+        return []
+    scores = np.asarray(_get_cross_encoder().predict([(query, text) for text in texts]), dtype=np.float32)
+    return [int(i) for i in np.argsort(-scores, kind="stable")[:top_k]]
+
+
+def _get_cross_encoder():
+    global _cross_encoder
+    if _cross_encoder is None:
+        with _cross_encoder_lock:
+            if _cross_encoder is None:
+                try:
+                    # optional dependency, only needed for this re-ranker
+                    from sentence_transformers import CrossEncoder
+                except ImportError as e:
+                    raise RuntimeError(
+                        "The cross_encoder re-ranker needs `pip install sentence-transformers`"
+                    ) from e
+                _cross_encoder = CrossEncoder(Config.RAG_CROSS_ENCODER_MODEL)
+    return _cross_encoder
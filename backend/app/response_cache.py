@@ -0,0 +1,213 @@
+# app/response_cache.py
+"""Response cache for /chat and /ask_rag.
+
+Two tiers per kind ("chat", "rag"):
+  - exact:    prompt with whitespace collapsed + model (+ search options) -> answer
+  - semantic: cosine similarity between the new prompt's embedding and
+              the embeddings of cached prompts, served when it reaches
+              RESPONSE_CACHE_SIMILARITY
+
+Entries expire after the kind's TTL. RAG answers depend on the corpus, so
+`invalidate("rag")` (called by rag_service whenever documents change)
+drops them and bumps a generation counter so answers computed against the
+old corpus are not stored afterwards.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.config import Config
+from app.metrics import registry
+
+# values for the X-Cache response header
+HIT_EXACT = "HIT-EXACT"
+HIT_SEMANTIC = "HIT-SEMANTIC"
+MISS = "MISS"
+BYPASS = "BYPASS"
+
+
+def normalize(prompt):
+    # whitespace only: case can change the answer ("US" vs "us"); near matches are the semantic tier's job
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+class _Tier:
+    """LRU of entries for one kind plus a matrix of their unit-norm embeddings."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, expires_at, slot)
+        self.vectors = None           # (max_entries, dim) float32, allocated lazily
+        self.slot_keys = [None] * max_entries
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+        self.generation = 0
+
+    def clear(self):
+        self.entries.clear()
+        self.slot_keys = [None] * self.max_entries
+        self.free_slots = list(range(self.max_entries - 1, -1, -1))
+        self.generation += 1
+
+    def remove(self, key):
+        _, _, slot = self.entries.pop(key)
+        if slot is not None:
+            self.slot_keys[slot] = None
+            self.free_slots.append(slot)
+
+
+class ResponseCache:
+    def __init__(self, max_entries=2048, ttls=None, similarity=0.95):
+        self.similarity = similarity
+        ttls = ttls or {"chat": 3600, "rag": 600}
+        self._tiers = {kind: _Tier(max_entries, ttl) for kind, ttl in ttls.items()}
+        self._lock = threading.Lock()
+        self.stats = {HIT_EXACT: 0, HIT_SEMANTIC: 0, MISS: 0}
+
+    def generation(self, kind):
+        with self._lock:
+            return self._tiers[kind].generation
+
+    def get(self, kind, prompt, extra="", embedding=None):
+        """Return (value, status); value is None on a miss."""
+        value = self.get_exact(kind, prompt, extra)
+        if value is not None:
+            return value, HIT_EXACT
+        return self.get_similar(kind, embedding, extra)
+
+    def get_exact(self, kind, prompt, extra=""):
+        """The value cached for this exact prompt, or None (not counted as a miss yet)."""
+        key = f"{normalize(prompt)}\x00{extra}"
+        with self._lock:
+            tier = self._tiers[kind]
+            entry = tier.entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                tier.remove(key)  # expired entries are dropped lazily
+                entry = None
+            if entry is None:
+                return None
+            tier.entries.move_to_end(key)
+            self.stats[HIT_EXACT] += 1
+            return entry[0]
+
+    def get_similar(self, kind, embedding, extra=""):
+        """(value, status) from the semantic tier, after `get_exact` missed."""
+        with self._lock:
+            tier = self._tiers[kind]
+            if embedding is not None and tier.vectors is not None:
+                match = self._nearest(tier, _unit(embedding), extra, time.time())
+                if match is not None:
+                    tier.entries.move_to_end(match)
+                    self.stats[HIT_SEMANTIC] += 1
+                    return tier.entries[match][0], HIT_SEMANTIC
+            self.stats[MISS] += 1
+            return None, MISS
+
+    def put(self, kind, prompt, value, extra="", embedding=None, generation=None):
+        key = f"{normalize(prompt)}\x00{extra}"
+        with self._lock:
+            tier = self._tiers[kind]
+            if generation is not None and generation != tier.generation:
+                return  # computed against data that has since changed
+            if key in tier.entries:
+                tier.remove(key)
+            while len(tier.entries) >= tier.max_entries:
+                tier.remove(next(iter(tier.entries)))
+
+            slot = None
+            if embedding is not None:
+                vec = _unit(embedding)
+                if tier.vectors is None:
+                    tier.vectors = np.zeros((tier.max_entries, vec.shape[0]), dtype=np.float32)
+                slot = tier.free_slots.pop()
+                tier.vectors[slot] = vec
+                tier.slot_keys[slot] = key
+            tier.entries[key] = (value, time.time() + tier.ttl, slot)
+
+    def invalidate(self, kind):
+        with self._lock:
+            self._tiers[kind].clear()
+
+    def _nearest(self, tier, vec, extra, now):
+        # one matrix-vector product over all slots; empty slots are masked out
+        sims = tier.vectors @ vec
+        occupied = np.fromiter((k is not None for k in tier.slot_keys), dtype=bool)
+        sims[~occupied] = -1.0
+        for slot in np.argsort(-sims)[:8]:
+            if sims[slot] < self.similarity:
+                break
+            key = tier.slot_keys[slot]
+            if tier.entries[key][1] <= now:
+                tier.remove(key)
+                continue
+            if key.endswith(f"\x00{extra}"):  # search options must match too
+                return key
+        return None
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+response_cache = ResponseCache(
+    max_entries=Config.RESPONSE_CACHE_SIZE,
+    ttls={"chat": Config.RESPONSE_CACHE_TTL_CHAT, "rag": Config.RESPONSE_CACHE_TTL_RAG},
+    similarity=Config.RESPONSE_CACHE_SIMILARITY,
+)
+
+lookups_total = registry.counter(
+    "response_cache_requests_total", "Cached calls by kind and X-Cache status.", ("kind", "status")
+)
+
+
+def _semantic_enabled():
+    from app.rag_service import _is_fake_mode
+
+    # fake-mode embeddings are all collinear, so every prompt would "match"
+    return Config.RESPONSE_CACHE_SEMANTIC and not _is_fake_mode()
+
+
+def cached_call(kind, prompt, compute, extra="", bypass=False):
+    """Serve `compute()` through the cache; returns (value, cache_status)."""
+    if not Config.RESPONSE_CACHE_ENABLED or bypass:
+        lookups_total.inc(kind=kind, status=BYPASS)
+        return compute(), BYPASS
+    embedding = None
+    value, status = response_cache.get_exact(kind, prompt, extra), HIT_EXACT
+    if value is None:
+        # only an exact miss pays for embedding the prompt; put reuses the embedding
+        if _semantic_enabled():
+            from app.rag_service import embed_text
+            embedding = embed_text([prompt])[0]
+        value, status = response_cache.get_similar(kind, embedding, extra)
+    lookups_total.inc(kind=kind, status=status)
+    if status == MISS:
+        generation = response_cache.generation(kind)
+        value = compute()
+        response_cache.put(kind, prompt, value, extra, embedding, generation)
+    return value, status
+
+
+async def cached_call_async(kind, prompt, compute, extra="", bypass=False):
+    """Async version of `cached_call`; `compute` returns an awaitable."""
+    if not Config.RESPONSE_CACHE_ENABLED or bypass:
+        lookups_total.inc(kind=kind, status=BYPASS)
+        return await compute(), BYPASS
+    embedding = None
+    value, status = response_cache.get_exact(kind, prompt, extra), HIT_EXACT
+    if value is None:
+        if _semantic_enabled():
+            from app.rag_service import embed_text_async
+            embedding = (await embed_text_async([prompt]))[0]
+        value, status = response_cache.get_similar(kind, embedding, extra)
+    lookups_total.inc(kind=kind, status=status)
+    if status == MISS:
+        generation = response_cache.generation(kind)
+        value = await compute()
+        response_cache.put(kind, prompt, value, extra, embedding, generation)
+    return value, status
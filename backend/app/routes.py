@@ -1,27 +1,66 @@
-from flask import Blueprint, jsonify, request
-from app.openai_service import get_chat_response, get_image_response
+from flask import Blueprint, Response, g, jsonify, request, stream_with_context
+from app import metrics, openai_service, serving
+from app.image_cache import iter_base64
+from app.openai_service import (
+    CHAT_MODEL,
+    IMAGE_SIZES,
+    generate_images,
+    get_chat_response,
+    get_image_file,
+    get_image_response,
+    stream_chat_response,
+)
+from app.openai_client import UpstreamUnavailable
+from app.rate_limiter import RateLimited, get_limiter
+from app.response_cache import cached_call
+from app.config import Config
 from flask import current_app as app
 from flask import send_file
 import io
+import json
+import os
+import time
 from functools import wraps
 
 api_blueprint = Blueprint('api', __name__)
 
 # --- Authentication Decorator ---
+def valid_api_key(key):
+    """True if `key` is the configured API key."""
+    # Allow a special test key when running tests so unit tests don't need a real secret
+    if app.config.get("TESTING") and key == "my-secret-key":
+        return True
+    api_key = app.config.get("API_KEY")
+    return bool(api_key) and key == api_key
+
 def require_api_key(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         key = request.headers.get("x-api-key")
-        # Allow a special test key when running tests so unit tests don't need a real secret
-        if app.config.get("TESTING") and key == "my-secret-key":
-            return f(*args, **kwargs)
-
-        api_key = app.config.get("API_KEY")
-        if not api_key or key != api_key:
+        if not valid_api_key(key):
             return jsonify({"error": "Invalid API key"}), 401
+        get_limiter().admit_client(key, request_tokens(request.content_length))
         return f(*args, **kwargs)
     return wrapper
 
+def admit_request(f):
+    """Per-client admission for routes that do not require a key.
+
+    Charged to the API key when a valid one is sent, else to the client address.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("x-api-key")
+        get_limiter().admit_client(key if valid_api_key(key) else None,
+                                   request_tokens(request.content_length), address=request.remote_addr)
+        return f(*args, **kwargs)
+    return wrapper
+
+def request_tokens(content_length):
+    """Token estimate of a request body for per-key admission (~4 bytes per token)."""
+    return (content_length or 0) // 4
+
+
 def require_content(field_name, expected_type=str):
     """Decorator to validate that `field_name` exists in JSON and matches expected_type.
 
@@ -56,6 +95,89 @@ def require_content(field_name, expected_type=str):
     return decorator
 
 
+@api_blueprint.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    """The circuit breaker is open: fail fast instead of waiting on upstream."""
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+
+
+@api_blueprint.errorhandler(RateLimited)
+def rate_limited(e):
+    """Over a per-key limit, or upstream budget exhausted beyond RATE_LIMIT_MAX_WAIT."""
+    return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+
+# --- Metrics ---
+@api_blueprint.before_request
+def start_timing():
+    g.started = time.perf_counter()
+    metrics.start_request()
+
+@api_blueprint.after_request
+def record_timing(response):
+    """Observe the request's duration and, if enabled, report its stages in Server-Timing.
+
+    For streamed responses this covers the work done before the first byte.
+    """
+    if not Config.METRICS_ENABLED or "started" not in g:
+        return response
+    elapsed = time.perf_counter() - g.started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.http_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=str(response.status_code))
+    if Config.SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = metrics.server_timing(metrics.request_timings(), elapsed)
+    return response
+
+@api_blueprint.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Stage timers, token counters and gauges in the Prometheus text format."""
+    if not Config.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@api_blueprint.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 once this worker's index and OpenAI clients are warm, 503 before."""
+    is_ready, checks = serving.readiness()
+    return jsonify({"ready": is_ready, **checks}), 200 if is_ready else 503
+
+# --- Server-Sent Events ---
+def wants_stream():
+    """Streaming is opt-in through `Accept: text/event-stream`."""
+    return request.accept_mimetypes.best == "text/event-stream"
+
+def sse_response(deltas, usage=None, **final_fields):
+    """Stream text deltas as SSE `data` events, then a `done` event with the full text.
+
+    `usage` may be filled by the generator while it runs; it is merged into `done`.
+    """
+    def events():
+        parts = []
+        try:
+            for delta in deltas:
+                parts.append(delta)
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        done = {"response": "".join(parts), **(usage or {}), **final_fields}
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Response cache ---
+def cache_bypassed():
+    return "no-cache" in request.headers.get("Cache-Control", "")
+
+def with_cache_status(response, status):
+    response.headers["X-Cache"] = status
+    return response
+
+
 # --- Routes ---
 @api_blueprint.route("/", methods=["GET"])
 @require_api_key
@@ -68,70 +190,474 @@ def home():
 def chat():
     data = request.get_json()
     content = data.get("content")
-    response = get_chat_response(content)
-    return jsonify({"response": response, "version": "0.1.0"})
+    if wants_stream():
+        return sse_response(stream_chat_response(content), version="0.1.0")
+    response, cache_status = cached_call(
+        "chat", content, lambda: get_chat_response(content),
+        extra=CHAT_MODEL, bypass=cache_bypassed(),
+    )
+    return with_cache_status(jsonify({"response": response, "version": "0.1.0"}), cache_status)
+
+def parse_image_size(data):
+    """Optional "size" field; returns (size, error)."""
+    size = data.get("size")
+    if size is not None and size not in IMAGE_SIZES:
+        return None, f"'size' must be one of {', '.join(IMAGE_SIZES)}"
+    return size, None
+
+def base64_json_response(f, image_id):
+    """{"base64": ..., "version"} streamed from the open cached file, slice by slice."""
+    def body():
+        yield '{"base64": "'
+        yield from iter_base64(f)
+        yield '", "version": "0.1.0"}'
+
+    return Response(body(), mimetype="application/json", headers={
+        "ETag": f'"{image_id}"', "Content-Location": f"/images/{image_id}",
+    })
+
+def send_image(f, image_id, conditional=False, **kwargs):
+    """send_file for an open cached image, which stays readable if its file is evicted."""
+    size = os.fstat(f.fileno()).st_size
+    response = send_file(f, mimetype="image/png", etag=image_id, **kwargs)
+    response.content_length = size
+    if conditional:
+        # send_file only knows the length of paths, which Range requests need
+        try:
+            response = response.make_conditional(request, accept_ranges=True, complete_length=size)
+        except Exception:
+            f.close()
+            raise
+    return response
 
 @api_blueprint.route("/generateImage", methods=["POST"])
 @require_api_key
 @require_content("content")
 def generate_image():
     data = request.get_json()
-    response_type = request.headers.get("response-type", "base64")
+    response_type = request.headers.get("response-type", "base64").lower()
     content = data.get("content")
-
-    result = get_image_response(content, response_type)
-
-    if response_type.lower() == "base64":
-        # Return JSON with base64
-        return result
-    elif response_type.lower() == "image":
-        # Stream the image bytes to the client as PNG
-        return send_file(
-            io.BytesIO(result),
-            mimetype="image/png",
-            as_attachment=True,
-            download_name="generated.png"
-        )
-    else:
+    if response_type not in ("base64", "image"):
         return {"error": "Invalid response-type header, must be 'base64' or 'image'"}, 402
+    size, error = parse_image_size(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    if openai_service.image_cache is None:
+        result = get_image_response(content, response_type, size)
+        if response_type == "base64":
+            return result
+        return send_file(io.BytesIO(result), mimetype="image/png", as_attachment=True,
+                         download_name="generated.png")
 
-from app.rag_service import add_documents, answer_query, answer_with_memory_and_rag
+    f, image_id = get_image_file(content, size)
+    if response_type == "base64":
+        return base64_json_response(f, image_id)
+    # served from the file: the server can use sendfile, and GET /images/<id>
+    # answers If-None-Match and Range requests for it
+    response = send_image(f, image_id, as_attachment=True, download_name="generated.png")
+    response.headers["Content-Location"] = f"/images/{image_id}"
+    return response
+
+@api_blueprint.route("/images/<image_id>", methods=["GET"])
+@require_api_key
+def get_image(image_id):
+    """A cached image by id (its ETag), with conditional and Range support."""
+    f = openai_service.image_cache.open(image_id) if openai_service.image_cache is not None else None
+    if f is None:
+        return jsonify({"error": "Image not found"}), 404
+    if request.headers.get("response-type", "image").lower() == "base64":
+        return base64_json_response(f, image_id)
+    return send_image(f, image_id, conditional=True, max_age=31536000)
+
+@api_blueprint.route("/generateImage/batch", methods=["POST"])
+@require_api_key
+@require_content("prompts", expected_type=list)
+def generate_image_batch():
+    """
+    Generate several images concurrently (at most IMAGE_BATCH_CONCURRENCY at a time).
+    { "prompts": ["A red elephant", "..."], "size": "1024x1024" }   # size optional
+    Streams NDJSON, one line per prompt in completion order:
+    {"index": 0, "prompt": "...", "id": "..."} (fetch from GET /images/<id>) with the
+    image cache on, {"index": 0, "prompt": "...", "base64": "..."} without it,
+    or {"index": 0, "prompt": "...", "error": "..."}.
+    """
+    data = request.get_json()
+    prompts = data["prompts"]
+    if len(prompts) > Config.IMAGE_BATCH_MAX_PROMPTS:
+        return jsonify({"error": f"At most {Config.IMAGE_BATCH_MAX_PROMPTS} prompts per request"}), 413
+    size, error = parse_image_size(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    def lines():
+        for result in generate_images(prompts, size):
+            if "id" in result:
+                result["url"] = f"/images/{result['id']}"
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+from app.rag_service import RERANKERS, RETRIEVAL_MODES, answer_query, answer_with_memory_and_rag, stream_answer_query
+from app import ingest_service
+from app.metadata import validate_filter, validate_metadata
+from app.vector_store import DEFAULT_COLLECTION, content_id, validate_name
+
+def parse_collection(value):
+    """Validate an optional collection name; returns (name, error)."""
+    if value is None:
+        return DEFAULT_COLLECTION, None
+    try:
+        return validate_name(value), None
+    except ValueError as e:
+        return None, str(e)
 
 @api_blueprint.route("/upload_docs", methods=["POST"])
+@admit_request
 @require_content("texts", expected_type=list)
 def upload_docs():
     """
     Uploads a list of texts to store in FAISS.
     Example request:
     {
-      "texts": ["Lebanon is a country in the Middle East.", "Beirut is its capital."]
+      "texts": ["Lebanon is a country in the Middle East.", "Beirut is its capital."],
+      "background": false,  # optional, true returns a job id immediately
+      "collection": "geo",  # optional, defaults to "default"
+      "metadata": {"source": "wiki"}  # optional, one object for all texts
+                                      # or a list aligned with "texts"
     }
     """
     data = request.get_json()
     texts = data.get("texts", [])
     if not texts:
         return jsonify({"error": "No texts provided"}), 400
-    add_documents(texts)
+    collection, error = parse_collection(data.get("collection"))
+    if error:
+        return jsonify({"error": error}), 400
+    metadatas, error = parse_metadatas(data.get("metadata"), len(texts))
+    if error:
+        return jsonify({"error": error}), 400
+    documents = list(zip(texts, metadatas)) if metadatas else texts
+    if data.get("background"):
+        return _job_accepted(ingest_service.start_job(documents, collection=collection))
+
+    job = ingest_service.ingest(documents, collection=collection)
+    if job.status != "completed":
+        return jsonify({"error": "Some documents could not be stored", "job": job.to_dict()}), 502
     return jsonify({"message": f"Stored {len(texts)} documents."})
 
+@api_blueprint.route("/ingest", methods=["POST"])
+@require_api_key
+def ingest():
+    """
+    Background ingestion of a large corpus, streamed to disk first.
+    Send either an NDJSON body (Content-Type: application/x-ndjson, one JSON
+    string or {"text": ..., "metadata": {...}} per line) or a multipart upload in field "file"
+    (.ndjson/.jsonl, or plain text with documents separated by blank lines).
+    The target collection is taken from the optional ?collection= argument.
+    """
+    collection, error = parse_collection(request.args.get("collection"))
+    if error:
+        return jsonify({"error": error}), 400
+    upload = request.files.get("file")
+    # the filename picks the format; a part without one arrives as a form field
+    if "file" in request.form or (upload is not None and not upload.filename):
+        return jsonify({"error": "The multipart 'file' part needs a filename"}), 400
+    if upload is not None:
+        fmt = "ndjson" if upload.filename.endswith((".ndjson", ".jsonl")) else "text"
+        path = ingest_service.spool(upload.stream)
+    elif request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        fmt = "ndjson"
+        path = ingest_service.spool(request.stream)
+    else:
+        return jsonify({"error": "Send an NDJSON body or a multipart 'file' upload"}), 415
+    return _job_accepted(ingest_service.start_file_job(path, fmt, collection=collection))
+
+@api_blueprint.route("/ingest/<job_id>", methods=["GET"])
+@require_api_key
+def ingest_status(job_id):
+    job = ingest_service.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job.to_dict())
+
+def _job_accepted(job):
+    body = job.to_dict()
+    body["status_url"] = f"/ingest/{job.id}"
+    return jsonify(body), 202
+
+def parse_metadatas(value, count):
+    """Validate optional per-document metadata; returns (list or None, error)."""
+    if value is None:
+        return None, None
+    metadatas = [value] * count if isinstance(value, dict) else value
+    if not isinstance(metadatas, list) or len(metadatas) != count:
+        return None, "'metadata' must be an object or a list with one entry per text"
+    try:
+        for metadata in metadatas:
+            validate_metadata(metadata)
+    except ValueError as e:
+        return None, str(e)
+    return metadatas, None
+
+MAX_TOP_K = 100
+MAX_FETCH_K = 1000
+
+def parse_search_kwargs(data):
+    """Pick optional per-request search knobs out of `data`; returns (kwargs, error)."""
+    search_kwargs = {}
+    top_k = data.get("top_k")
+    if top_k is not None:
+        if not isinstance(top_k, int) or isinstance(top_k, bool) or not 0 < top_k <= MAX_TOP_K:
+            return None, f"'top_k' must be an integer between 1 and {MAX_TOP_K}"
+        search_kwargs["top_k"] = top_k
+    fetch_k = data.get("fetch_k")
+    if fetch_k is not None:
+        least = top_k or 1
+        if not isinstance(fetch_k, int) or isinstance(fetch_k, bool) or not least <= fetch_k <= MAX_FETCH_K:
+            return None, f"'fetch_k' must be an integer between top_k and {MAX_FETCH_K}"
+        search_kwargs["fetch_k"] = fetch_k
+    reranker = data.get("rerank")
+    if reranker is not None:
+        if reranker not in RERANKERS:
+            return None, f"'rerank' must be one of {', '.join(RERANKERS)}"
+        search_kwargs["reranker"] = reranker
+    for field in ("nprobe", "ef_search"):
+        value = data.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+            return None, f"'{field}' must be a positive integer"
+        search_kwargs[field] = value
+    min_similarity = data.get("min_similarity")
+    if min_similarity is not None:
+        if not isinstance(min_similarity, (int, float)) or isinstance(min_similarity, bool) \
+                or not -1 <= min_similarity <= 1:
+            return None, "'min_similarity' must be a number between -1 and 1"
+        search_kwargs["min_similarity"] = float(min_similarity)
+    mode = data.get("mode")
+    if mode is not None:
+        if mode not in RETRIEVAL_MODES:
+            return None, f"'mode' must be one of {', '.join(RETRIEVAL_MODES)}"
+        search_kwargs["mode"] = mode
+    if data.get("collection") is not None:
+        collection, error = parse_collection(data["collection"])
+        if error:
+            return None, error
+        search_kwargs["collection"] = collection
+    if data.get("filter") is not None:
+        try:
+            search_kwargs["where"] = validate_filter(data["filter"])
+        except ValueError as e:
+            return None, str(e)
+    return search_kwargs, None
+
+def rag_cache_extra(search_kwargs):
+    """Cache-key suffix: answers only match for the same model and search options."""
+    return f"{CHAT_MODEL}|" + ",".join(
+        f"{k}={json.dumps(v, sort_keys=True) if isinstance(v, dict) else v}"
+        for k, v in sorted(search_kwargs.items())
+    )
+
 @api_blueprint.route("/ask_rag", methods=["POST"])
+@admit_request
 @require_content("query")
 def ask_rag():
     """
     Ask a question using RAG.
     Example:
     {
-      "query": "What is the capital of Lebanon?"
+      "query": "What is the capital of Lebanon?",
+      "nprobe": 32,       # optional, IVF indexes
+      "ef_search": 128,   # optional, HNSW indexes
+      "mode": "hybrid",   # optional: vector | hybrid | lexical
+      "collection": "geo", # optional, defaults to "default"
+      "filter": {"source": {"$in": ["wiki", "faq"]}},  # optional metadata filter
+      "min_similarity": 0.3, # optional, drop chunks less similar than this
+      "top_k": 3,         # optional, chunks put in the prompt
+      "rerank": "mmr",    # optional: none | mmr | cross_encoder
+      "fetch_k": 20       # optional, candidates to re-rank (default top_k * RAG_FETCH_K_FACTOR)
     }
     """
     data = request.get_json()
     query = data.get("query", "")
     if not query:
         return jsonify({"error": "Query missing"}), 400
-    answer = answer_query(query)
-    return jsonify({"response": answer})
+    search_kwargs, error = parse_search_kwargs(data)
+    if error:
+        return jsonify({"error": error}), 400
+    if wants_stream():
+        return sse_response(stream_answer_query(query, **search_kwargs))
+    answer, cache_status = cached_call(
+        "rag", query, lambda: answer_query(query, **search_kwargs),
+        extra=rag_cache_extra(search_kwargs), bypass=cache_bypassed(),
+    )
+    return with_cache_status(jsonify({"response": answer}), cache_status)
+
+from app import rag_service
+
+MAX_DOCUMENT_ID_LENGTH = 256
+
+def _document_id_error(doc_id):
+    if not isinstance(doc_id, str) or not doc_id.strip() or len(doc_id) > MAX_DOCUMENT_ID_LENGTH:
+        return f"Document ids must be non-empty strings of at most {MAX_DOCUMENT_ID_LENGTH} characters"
+    return None
+
+@api_blueprint.route("/documents", methods=["POST"])
+@require_api_key
+def upsert_documents():
+    """
+    Insert or replace documents by id; texts without an id get one derived
+    from their content, so re-uploading the same text is a no-op.
+    {
+      "documents": [{"id": "faq-1", "text": "...", "metadata": {"source": "faq"}}, {"text": "..."}],
+      "collection": "geo"   # optional
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("documents")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Missing or empty 'documents' field"}), 400
+    collection, error = parse_collection(data.get("collection"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    ids, texts, metadatas = [], [], []
+    for i, item in enumerate(items):
+        item = {"text": item} if isinstance(item, str) else item
+        text = item.get("text") if isinstance(item, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            return jsonify({"error": f"Invalid item at index {i} in 'documents'"}), 400
+        doc_id = item.get("id") or content_id(text)
+        error = _document_id_error(doc_id)
+        if error:
+            return jsonify({"error": error}), 400
+        ids.append(doc_id)
+        texts.append(text)
+        metadatas.append(item.get("metadata"))
+    try:
+        counts = rag_service.upsert_documents(texts, ids=ids, collection=collection, metadatas=metadatas)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"ids": ids, **counts})
+
+@api_blueprint.route("/documents/<doc_id>", methods=["GET"])
+@require_api_key
+def get_document(doc_id):
+    collection, error = parse_collection(request.args.get("collection"))
+    if error:
+        return jsonify({"error": error}), 400
+    text = rag_service.get_document(doc_id, collection)
+    if text is None:
+        return jsonify({"error": "Unknown document id"}), 404
+    return jsonify({"id": doc_id, "text": text, "metadata": rag_service.get_metadata(doc_id, collection)})
+
+@api_blueprint.route("/documents/<doc_id>", methods=["PUT"])
+@require_api_key
+@require_content("text")
+def put_document(doc_id):
+    error = _document_id_error(doc_id)
+    collection, collection_error = parse_collection(request.args.get("collection"))
+    if error or collection_error:
+        return jsonify({"error": error or collection_error}), 400
+    data = request.get_json()
+    try:
+        counts = rag_service.upsert_documents(
+            [data["text"]], ids=[doc_id], collection=collection, metadatas=[data.get("metadata")]
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"id": doc_id, **counts}), 201 if counts["added"] else 200
+
+@api_blueprint.route("/documents/<doc_id>", methods=["DELETE"])
+@require_api_key
+def delete_document(doc_id):
+    collection, error = parse_collection(request.args.get("collection"))
+    if error:
+        return jsonify({"error": error}), 400
+    if not rag_service.delete_documents([doc_id], collection):
+        return jsonify({"error": "Unknown document id"}), 404
+    return "", 204
+
+@api_blueprint.route("/documents/search", methods=["POST"])
+@require_api_key
+@require_content("query")
+def search_documents():
+    """
+    Raw retrieval without an answer: the top_k hits with their ids, scores
+    and metadata.
+    {"query": "capital of Lebanon", "top_k": 5, "collection": "geo", "filter": {"tenant": "acme"}}
+    """
+    data = request.get_json()
+    search_kwargs, error = parse_search_kwargs(data)
+    if error:
+        return jsonify({"error": error}), 400
+    hits = rag_service.retrieve_context(data["query"], **search_kwargs)
+    return jsonify({"results": hits})
+
+@api_blueprint.route("/documents/compact", methods=["POST"])
+@require_api_key
+def compact_documents():
+    """Reclaim the space of deleted documents (runs in the background)."""
+    collection, error = parse_collection(request.args.get("collection"))
+    if error:
+        return jsonify({"error": error}), 400
+    rag_service.compact_store(collection, wait=False)
+    return jsonify({"collection": collection, "status": "compacting"}), 202
+
+@api_blueprint.route("/ask_rag/batch", methods=["POST"])
+@admit_request
+@require_content("queries", expected_type=list)
+def ask_rag_batch():
+    """
+    Answer many questions in one request. Retrieval is batched; answers are
+    streamed back as NDJSON, one line per question in completion order.
+    {
+      "queries": ["What is the capital of Lebanon?", "..."],
+      "nprobe": 32, "ef_search": 128, "collection": "geo", "filter": {...}   # optional
+    }
+    Each line: {"index": 0, "query": "...", "response": "...", "sources": [{"id", "score"}]}
+    or {"index": 0, "query": "...", "error": "..."}.
+    """
+    data = request.get_json()
+    queries = data["queries"]
+    if len(queries) > Config.RAG_BATCH_MAX_QUERIES:
+        return jsonify({"error": f"At most {Config.RAG_BATCH_MAX_QUERIES} queries per request"}), 413
+    search_kwargs, error = parse_search_kwargs(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-from app.rag_service import answer_with_memory_and_rag
+    def lines():
+        for result in rag_service.answer_queries(queries, **search_kwargs):
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+from app.rag_service import (
+    answer_with_memory_and_rag,
+    embedding_batcher,
+    embedding_cache,
+    stream_answer_with_memory_and_rag,
+)
+from app.single_flight import single_flight
+
+@api_blueprint.route("/embedding_cache", methods=["GET"])
+@require_api_key
+def embedding_cache_stats():
+    """Hit/miss counters of the embedding cache, for sizing it."""
+    return jsonify(embedding_cache.stats())
+
+@api_blueprint.route("/embedding_batcher", methods=["GET"])
+@require_api_key
+def embedding_batcher_stats():
+    """Queue-time and batch-size histograms of the embedding micro-batcher."""
+    return jsonify(embedding_batcher.stats())
+
+@api_blueprint.route("/single_flight", methods=["GET"])
+@require_api_key
+def single_flight_stats():
+    """Upstream calls made vs. identical concurrent calls collapsed into them."""
+    return jsonify(single_flight.stats())
 
 @api_blueprint.route("/chat_rag_memory", methods=["POST"])
 @require_api_key
@@ -141,7 +667,8 @@ def chat_rag_memory():
     Example:
     {
       "session_id": "user123",
-      "query": "What is its capital?"
+      "query": "What is its capital?",
+      "collection": "geo"   # optional, defaults to "default"
     }
     """
     data = request.get_json()
@@ -150,6 +677,14 @@ def chat_rag_memory():
 
     if not query:
         return jsonify({"error": "Query missing"}), 400
+    collection, error = parse_collection(data.get("collection"))
+    if error:
+        return jsonify({"error": error}), 400
 
-    answer = answer_with_memory_and_rag(session_id, query)
-    return jsonify({"response": answer})
+    usage = {}
+    if wants_stream():
+        return sse_response(
+            stream_answer_with_memory_and_rag(session_id, query, usage, collection=collection), usage
+        )
+    answer = answer_with_memory_and_rag(session_id, query, usage, collection=collection)
+    return jsonify({"response": answer, **usage})
@@ -0,0 +1,108 @@
+# app/serving.py
+"""Production serving with pre-fork workers.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The master imports the app once (preload_app): every collection in
+RAG_STORE_DIR is loaded and the OpenAI SDK imported (`prefork`) before
+WEB_WORKERS workers with WEB_THREADS threads each are forked. Workers
+share those pages copy-on-write: index and document files are mmap'd,
+and gc.freeze() keeps the workers' collector from writing to the objects
+built in the master.
+
+In each worker `after_fork` reconnects what must not be shared across a
+fork (the SQLite handles of the embedding cache, memory store and image
+cache; the OpenAI clients and rate limiter rebuild themselves), warms the OpenAI clients and, with RAG_STORE_DIR, follows
+the snapshots the other workers publish so a document uploaded through
+one worker is searchable in all of them within RAG_RELOAD_INTERVAL.
+
+GET /ready reports whether this process's index and clients are warm: the
+index once the master loaded it and, in a following worker, once its
+first refresh succeeded.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+
+from app import memory_service, openai_client, openai_service, rag_service, vector_store
+from app.config import Config
+
+log = logging.getLogger(__name__)
+
+_index_loaded = False
+
+
+def cpu_count():
+    """CPUs this process may run on, which in a container can be fewer than the host's."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        return os.cpu_count() or 1
+
+
+def workers():
+    return Config.WEB_WORKERS or cpu_count()
+
+
+def mark_index_loaded(loaded=True):
+    global _index_loaded
+    _index_loaded = loaded
+
+
+def warm_clients():
+    """Build the OpenAI clients, unless there is no API key (fake mode)."""
+    if os.getenv("OPENAI_API_KEY"):
+        openai_client.warm_up()
+
+
+def warm_clients_in_background():
+    """Warm the clients without holding up startup; /ready turns 200 when done."""
+    threading.Thread(target=warm_clients, name="warm-clients", daemon=True).start()
+
+
+def readiness():
+    """(ready, checks) for this process; "clients" is None when not needed (fake mode)."""
+    clients = openai_client.clients_ready() if os.getenv("OPENAI_API_KEY") else None
+    checks = {"index": _index_loaded, "clients": clients}
+    return all(value is not False for value in checks.values()), checks
+
+
+# --- gunicorn hooks (see gunicorn.conf.py) ---
+
+def prefork():
+    """In the master, once the app is loaded and before any worker is forked."""
+    openai_client._sdk()  # imported once here instead of in every worker
+    gc.freeze()
+
+
+def after_fork():
+    """In each worker, right after the fork."""
+    gc.enable()
+    rag_service.embedding_cache.reopen()
+    memory_service.reopen_store()
+    if openai_service.image_cache is not None:
+        openai_service.image_cache.reopen()
+    warm_clients()
+    if Config.RAG_STORE_DIR and Config.RAG_RELOAD_INTERVAL > 0:
+        # not ready until this worker has caught up with the snapshots published since the fork
+        mark_index_loaded(False)
+        vector_store.follow_snapshots()
+        threading.Thread(
+            target=_follow_snapshots, args=(Config.RAG_RELOAD_INTERVAL,), name="snapshot-follower", daemon=True
+        ).start()
+
+
+def worker_exit():
+    vector_store.flush_all()
+
+
+def _follow_snapshots(interval):
+    while True:
+        try:
+            rag_service.refresh_stores()
+            mark_index_loaded()
+        except Exception:
+            log.exception("Reloading snapshots failed")
+        time.sleep(interval)
@@ -0,0 +1,110 @@
+# app/single_flight.py
+"""Coalescing of identical in-flight upstream calls ("single flight").
+
+The first caller for a key (the leader) makes the call; callers arriving
+with the same key while it is in flight wait for it and receive the same
+result, or the same exception. Nothing is kept once the call returns, so
+this only collapses concurrent duplicates; caching is the response and
+embedding caches' job.
+
+Threaded callers (Flask workers) use `do`, coroutines (the ASGI app) use
+`do_async`. Async flights are shared per event loop and run as a task, so
+a waiter that is cancelled does not cancel the call for the others.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+
+from app.config import Config
+from app.metrics import registry
+
+
+def flight_key(model, payload):
+    """Key for a call to `model` with `payload` (canonical JSON, hashed)."""
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return f"{model}:{hashlib.sha256(body.encode('utf-8')).hexdigest()}"
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # (kind, key) -> _Flight
+        self._tasks = {}    # (loop, kind, key) -> asyncio.Task
+        self._stats = {}    # kind -> {"calls", "collapsed"}
+
+    def _count(self, kind, collapsed):
+        counters = self._stats.setdefault(kind, {"calls": 0, "collapsed": 0})
+        counters["collapsed" if collapsed else "calls"] += 1
+
+    def do(self, kind, key, fn):
+        """Return `fn()`, sharing one call among concurrent callers of `key`."""
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return fn()
+        with self._lock:
+            flight = self._flights.get((kind, key))
+            leader = flight is None
+            if leader:
+                flight = self._flights[(kind, key)] = _Flight()
+            self._count(kind, not leader)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[(kind, key)]
+            flight.done.set()
+
+    async def do_async(self, kind, key, fn):
+        """Async version of `do`; `fn()` returns an awaitable."""
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return await fn()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get((loop, kind, key))
+            leader = task is None
+            if leader:
+                task = self._tasks[(loop, kind, key)] = loop.create_task(fn())
+                task.add_done_callback(lambda _: self._forget(loop, kind, key))
+            self._count(kind, not leader)
+        return await asyncio.shield(task)
+
+    def _forget(self, loop, kind, key):
+        with self._lock:
+            self._tasks.pop((loop, kind, key), None)
+
+    def stats(self):
+        """Per kind: upstream calls made and calls collapsed into them."""
+        with self._lock:
+            stats = {kind: dict(counters) for kind, counters in self._stats.items()}
+            in_flight = len(self._flights) + len(self._tasks)
+        return {"enabled": Config.SINGLE_FLIGHT_ENABLED, "in_flight": in_flight, "kinds": stats}
+
+
+single_flight = SingleFlight()
+registry.register(
+    "single_flight_calls_total", "Calls made through single-flight, by kind and whether they were collapsed.",
+    lambda: {(kind, collapsed): counters[field]
+             for kind, counters in single_flight.stats()["kinds"].items()
+             for collapsed, field in (("false", "calls"), ("true", "collapsed"))},
+    kind="counter", labels=("kind", "collapsed"),
+)
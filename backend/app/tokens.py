@@ -0,0 +1,43 @@
+# app/tokens.py
+"""Token counting for budgeting prompts and embedding batches.
+
+Uses tiktoken when it is installed, otherwise a ~4 characters/token
+estimate, which is close enough for packing batches under API limits.
+"""
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # optional dependency
+    tiktoken = None
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+# chat history is re-counted on every turn, so counts are cached per message text
+@lru_cache(maxsize=16384)
+def count_tokens(text):
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return max(1, (len(text) + 3) // 4) if text else 0
+
+
+def truncate_tokens(text, max_tokens, keep="end"):
+    """Cut `text` to about `max_tokens`, keeping its start or its end."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    enc = _get_encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        ids = ids[-max_tokens:] if keep == "end" else ids[:max_tokens]
+        return enc.decode(ids)
+    chars = max_tokens * 4
+    return text[-chars:] if keep == "end" else text[:chars]
@@ -0,0 +1,814 @@
+# app/vector_store.py
+"""Thread-safe FAISS vector stores, one per named collection.
+
+A `VectorStore` owns an index, its document table and its snapshot
+directory. Concurrency model:
+
+  - searches take the shared side of a reader-writer lock, so any number
+    of them run in parallel (FAISS releases the GIL while searching)
+  - a batch is applied (index.add + documents.extend) under the exclusive
+    side, so readers see either none or all of it and `index.ntotal`
+    always matches `len(documents)`
+  - everything slow happens outside the exclusive section: embeddings are
+    computed by the caller, rebuilds train on a copy of the vectors and
+    snapshots are written while only holding the shared side
+
+Writers are additionally serialized by a mutex, so a snapshot or a
+rebuild swap never interleaves with a half-finished add.
+
+Collections live side by side in RAG_STORE_DIR: the default collection at
+its root (the layout of a single-store deployment), every other one in
+collections/<name>.
+
+Several worker processes can serve the same RAG_STORE_DIR: each follows
+the snapshots the others publish (`refresh_all`, and `refresh` before
+every write once `follow_snapshots()` is on), so a write made through one
+worker reaches the others within RAG_RELOAD_INTERVAL seconds. Each
+refresh -> write -> snapshot sequence holds an exclusive lock on the
+store's directory, and a store with unsaved changes that finds a newer
+snapshot loads it and re-applies its own changes on top, so concurrent
+writers merge instead of overwriting each other's snapshots.
+"""
+import atexit
+import hashlib
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+from app import rag_index, rag_store
+from app.lexical_index import BM25Index
+from app.metadata import MetadataTable
+from app.config import Config
+
+log = logging.getLogger(__name__)
+
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_DIR = "collections"
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class RWLock:
+    """Many readers or one writer; a waiting writer holds back new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def _tuned(idx):
+    """Apply the configured default nprobe / efSearch to `idx`."""
+    if isinstance(idx, faiss.IndexIVF):
+        idx.nprobe = Config.RAG_NPROBE
+    elif isinstance(idx, faiss.IndexHNSW):
+        idx.hnsw.efSearch = Config.RAG_EF_SEARCH
+    return idx
+
+
+def _target():
+    """The configured (kind, storage) of the index."""
+    return rag_index.resolve(Config.RAG_INDEX_TYPE, Config.RAG_VECTOR_STORAGE)
+
+
+def _new_index(dim):
+    # IVF kinds and int8/pq storage need training data, so they start out
+    # flat / full precision and are rebuilt later
+    kind, storage = _target()
+    if rag_index.needs_training(kind, storage):
+        kind = "flat"
+    if rag_index.needs_training(kind, storage):
+        storage = "fp32"
+    return _tuned(rag_index.build_index(
+        kind, dim, hnsw_m=Config.RAG_HNSW_M, storage=storage, metric=Config.RAG_METRIC
+    ))
+
+
+def _keeps_vectors(storage):
+    # a full-precision copy is kept next to quantized indexes, for re-ranking and rebuilds
+    return storage != "fp32"
+
+
+def content_id(text):
+    """Default document id: derived from the text, so re-uploads are deduplicated."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class VectorStore:
+    """Documents with stable ids over one FAISS index.
+
+    Row r of the index is row r of the document, id and metadata tables,
+    and of the BM25 index kept alongside for keyword search. Searches can
+    be restricted by a metadata filter, which is evaluated to a row bitmap
+    and handed to FAISS as an IDSelector. Deleting or replacing a
+    document only tombstones its row (searches skip it through an
+    IDSelector); `compact` rebuilds the indexes and tables without them.
+
+    With the cosine metric (RAG_METRIC) vectors and queries are
+    L2-normalized on the way in and scores are cosine similarities;
+    with l2 they are negated squared L2 distances.
+
+    When the index stores quantized vectors (RAG_VECTOR_STORAGE), a
+    full-precision copy is kept in an mmap'd table: searches can re-rank
+    their candidates with it (RAG_RERANK_FACTOR) and rebuilds train on it
+    instead of on the lossy reconstruction.
+    """
+
+    def __init__(self, name, dim, directory=None):
+        self.name = name
+        self.dim = dim
+        self.directory = directory
+        self.generation = 0  # bumped on every change of the searchable state
+        self._index = _new_index(dim)
+        self._index_mapped = False  # read-only mapping of a snapshot's index file
+        self._documents = rag_store.DocumentTable()
+        self._ids = rag_store.DocumentTable()  # row -> document id
+        self._by_id = {}                      # live document id -> row
+        self._deleted = set()                 # tombstoned rows
+        self._selector = None                 # (IDSelectorNot, IDSelectorBatch) over _deleted
+        self._lexical = BM25Index()           # BM25 over the same rows
+        self._metadata = MetadataTable(Config.RAG_METADATA_BITMAP_FIELDS)
+        self._vectors = rag_store.VectorTable(dim) if _keeps_vectors(_target()[1]) else None
+        self._rw = RWLock()
+        self._mutex = threading.RLock()
+        self._rebuild_thread = None
+        self._built_size = 0  # corpus size at the last (re)build
+        self._pending_adds = 0
+        self._flush_timer = None
+        self._snapshot_path = None  # the snapshot the in-memory state is based on
+        self._journal = {}  # document id -> "upsert" | "delete", changes since that snapshot
+        self._lock_depth = 0  # directory lock is held (and re-entered) under the mutex
+
+    @property
+    def ntotal(self):
+        """Rows in the index, including tombstoned ones."""
+        with self._rw.read():
+            return self._index.ntotal
+
+    @property
+    def deleted(self):
+        with self._rw.read():
+            return len(self._deleted)
+
+    @property
+    def kind(self):
+        with self._rw.read():
+            return rag_index.index_kind(self._index)
+
+    @property
+    def storage(self):
+        with self._rw.read():
+            return rag_index.index_storage(self._index)
+
+    @property
+    def metric(self):
+        with self._rw.read():
+            return rag_index.index_metric(self._index)
+
+    def __len__(self):
+        with self._rw.read():
+            return len(self._by_id)
+
+    def documents(self):
+        """A copy of all live document texts, in insertion order."""
+        with self._rw.read():
+            return [self._documents[r] for r in sorted(self._by_id.values())]
+
+    def get(self, doc_id):
+        """The text of document `doc_id`, or None."""
+        with self._rw.read():
+            row = self._by_id.get(doc_id)
+            return None if row is None else self._documents[row]
+
+    def metadata(self, doc_id):
+        """The metadata of document `doc_id`, or None."""
+        with self._rw.read():
+            row = self._by_id.get(doc_id)
+            return None if row is None else self._metadata.row(row)
+
+    def vectors(self, doc_ids):
+        """Full-precision vectors of `doc_ids`, as a (len(doc_ids), dim) array; zeros for ids not stored."""
+        with self._rw.read():
+            rows = np.array([self._by_id.get(doc_id, -1) for doc_id in doc_ids], dtype=np.int64)
+            out = np.zeros((len(rows), self.dim), dtype=np.float32)
+            live = rows >= 0
+            out[live] = self._full_vectors(rows[live])
+            return out
+
+    def changed(self, ids, texts, metadatas=None):
+        """Positions of (id, text, metadata) entries that are not already stored as-is."""
+        metadatas = metadatas or [None] * len(ids)
+        with self._rw.read():
+            return [i for i, doc_id in enumerate(ids) if not self._same(doc_id, texts[i], metadatas[i])]
+
+    def _same(self, doc_id, text, metadata):
+        row = self._by_id.get(doc_id)
+        return (
+            row is not None
+            and self._documents[row] == text
+            and self._metadata.row(row) == {k: v for k, v in (metadata or {}).items() if v is not None}
+        )
+
+    # --- writes ---
+
+    def add(self, texts, embeddings, snapshot=True):
+        """Append texts under their content ids; duplicates are skipped."""
+        return self.upsert([content_id(t) for t in texts], texts, embeddings, snapshot)
+
+    def upsert(self, ids, texts, embeddings, snapshot=True, metadatas=None):
+        """Insert or replace documents by id, as one atomic batch.
+
+        `metadatas` holds an optional dict of scalar fields per document.
+        Returns {"added", "updated", "unchanged"} counts. With snapshot=False
+        the change is only counted as pending, so bulk ingestion can write a
+        single snapshot at the end. Raises ValueError for invalid metadata.
+        """
+        with self._mutex, self._directory_lock():
+            if _following:
+                self.refresh()
+            counts, applied = self._apply_upsert(ids, texts, embeddings, metadatas)
+            if applied:
+                self._record(applied, "upsert")
+                self._changed(snapshot)
+        self._maybe_rebuild()
+        return counts
+
+    def _apply_upsert(self, ids, texts, embeddings, metadatas):
+        # caller holds the mutex; returns (counts, ids applied)
+        counts = {"added": 0, "updated": 0, "unchanged": 0}
+        metadatas = metadatas or [None] * len(ids)
+        rows, replaced = {}, []
+        for i, (doc_id, text) in enumerate(zip(ids, texts)):
+            if doc_id in rows:
+                rows[doc_id] = i  # repeated id in one batch: last one wins
+                continue
+            row = self._by_id.get(doc_id)
+            if row is not None and self._same(doc_id, text, metadatas[i]):
+                counts["unchanged"] += 1
+                continue
+            if row is not None:
+                replaced.append(row)
+            counts["added" if row is None else "updated"] += 1
+            rows[doc_id] = i
+        if not rows:
+            return counts, []
+        keep = list(rows.values())
+        matrix = np.ascontiguousarray(np.vstack([embeddings[i] for i in keep]), dtype=np.float32)
+        if self._index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            faiss.normalize_L2(matrix)  # the whole batch in one pass, in place
+        analyzed = BM25Index.analyze([texts[i] for i in keep])
+        new_metadata = [metadatas[i] for i in keep]
+        self._metadata.check(new_metadata)  # before anything is applied
+        index = self._index
+        if self._index_mapped:
+            index = _tuned(rag_store.writable(index))  # readers keep using the mapping meanwhile
+        with self._rw.write():
+            self._index, self._index_mapped = index, False
+            start = self._index.ntotal
+            # metadata first: it is the step that can refuse a batch, before the index holds its rows
+            self._metadata.append(new_metadata)
+            self._index.add(matrix)
+            if self._vectors is not None:
+                self._vectors.append(matrix)
+            self._lexical.add(analyzed)
+            self._documents.extend(texts[i] for i in keep)
+            self._ids.extend(rows)
+            self._by_id.update((doc_id, start + n) for n, doc_id in enumerate(rows))
+            self._tombstone(replaced)
+        return counts, list(rows)
+
+    def delete(self, ids, snapshot=True):
+        """Remove documents by id; returns how many existed."""
+        with self._mutex, self._directory_lock():
+            if _following:
+                self.refresh()
+            deleted = self._apply_delete(ids)
+            if deleted:
+                self._record(deleted, "delete")
+                self._changed(snapshot)
+        self._maybe_rebuild()
+        return len(deleted)
+
+    def _apply_delete(self, ids):
+        # caller holds the mutex; returns the ids that existed
+        with self._rw.write():
+            deleted = [doc_id for doc_id in set(ids) if doc_id in self._by_id]
+            if deleted:
+                self._tombstone([self._by_id.pop(doc_id) for doc_id in deleted])
+        return deleted
+
+    def _record(self, ids, op):
+        # caller holds the mutex; what `_merge_latest` re-applies over another process's snapshot
+        if self.directory:
+            self._journal.update(dict.fromkeys(ids, op))
+
+    def _tombstone(self, rows):
+        # caller holds the write lock
+        if rows:
+            self._deleted.update(rows)
+            batch = faiss.IDSelectorBatch(np.fromiter(self._deleted, dtype=np.int64))
+            self._selector = (faiss.IDSelectorNot(batch), batch)
+        self.generation += 1
+
+    def _changed(self, snapshot):
+        # caller holds the mutex
+        if not self.directory:
+            return
+        self._pending_adds += 1
+        if not snapshot:
+            return
+        if Config.RAG_SNAPSHOT_INTERVAL <= 0 or self._pending_adds >= max(1, Config.RAG_SNAPSHOT_EVERY):
+            self.snapshot()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(Config.RAG_SNAPSHOT_INTERVAL, self._flush_later)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush_later(self):
+        with self._mutex:
+            self._flush_timer = None
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Snapshot of collection %s failed", self.name)
+
+    def compact(self, wait=True):
+        """Drop tombstoned rows by rebuilding the index in its current kind, storage and metric."""
+        with self._rw.read():
+            current = self._settings()
+        self.rebuild(current[0], wait=wait, storage=current[1], metric=current[2])
+
+    def _settings(self):
+        # caller holds the lock
+        index = self._index
+        return rag_index.index_kind(index), rag_index.index_storage(index), rag_index.index_metric(index)
+
+    def rebuild(self, kind=None, wait=True, storage=None, metric=None):
+        """Retrain the index as `kind` (default RAG_INDEX_TYPE) on the live vectors.
+
+        `storage` (default RAG_VECTOR_STORAGE) is the vector precision and
+        `metric` (default RAG_METRIC) the metric of the new index; switching
+        from l2 to cosine normalizes the stored vectors. With wait=False the
+        rebuild runs in a background thread; searches and uploads keep using
+        the old index until the new one is swapped in.
+        """
+        kind, storage = rag_index.resolve(kind or Config.RAG_INDEX_TYPE, storage or Config.RAG_VECTOR_STORAGE)
+        metric = metric or Config.RAG_METRIC
+        with self._mutex:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                thread = self._rebuild_thread
+            else:
+                thread = threading.Thread(target=self._rebuild, args=(kind, storage, metric), daemon=True)
+                self._rebuild_thread = thread
+                thread.start()
+        if wait:
+            thread.join()
+
+    def _rebuild(self, kind, storage, metric):
+        with self._rw.read():
+            start_n = self._index.ntotal
+            dead = set(self._deleted)
+            old_documents = self._documents
+            live = np.array([r for r in range(start_n) if r not in dead], dtype=np.int64)
+            vectors = self._full_vectors(live)
+        if start_n == 0:
+            return
+        if metric == "cosine":
+            faiss.normalize_L2(vectors)  # a no-op if they already are
+        lexical = BM25Index()
+        lexical.add(BM25Index.analyze(old_documents[int(r)] for r in live))
+        if len(live):
+            new_index = rag_index.build_index(
+                kind, self.dim, vectors,
+                nlist=Config.RAG_NLIST or None,
+                pq_m=Config.RAG_PQ_M,
+                hnsw_m=Config.RAG_HNSW_M,
+                storage=storage,
+                metric=metric,
+            )
+        else:
+            new_index = _new_index(self.dim)
+        new_vectors = None
+        if _keeps_vectors(rag_index.index_storage(new_index)):
+            new_vectors = rag_store.VectorTable(self.dim)
+            new_vectors.append(vectors)
+        del vectors
+        with self._mutex:
+            # catch up with rows added or deleted while we were training;
+            # holding the mutex keeps writers out, so reading needs no lock
+            n = self._index.ntotal
+            extra = np.array([r for r in range(start_n, n) if r not in self._deleted], dtype=np.int64)
+            if len(extra):
+                extra_vectors = self._full_vectors(extra)
+                if metric == "cosine":
+                    faiss.normalize_L2(extra_vectors)
+                new_index.add(extra_vectors)
+                if new_vectors is not None:
+                    new_vectors.append(extra_vectors)
+            rows = np.concatenate([live, extra])
+            new_row = {int(old): new for new, old in enumerate(rows)}
+            documents, ids = rag_store.DocumentTable(), rag_store.DocumentTable()
+            documents.extend(self._documents[int(r)] for r in rows)
+            ids.extend(self._ids[int(r)] for r in rows)
+            lexical.add(BM25Index.analyze(documents[len(live) + i] for i in range(len(extra))))
+            by_id = {doc_id: new_row[row] for doc_id, row in self._by_id.items()}
+            # rows deleted or replaced while we were training are in the new index too
+            stale = [new_row[int(r)] for r in live if int(r) in self._deleted]
+            metadata = self._metadata.take(rows)
+            with self._rw.write():
+                self._index, self._index_mapped = _tuned(new_index), False
+                self._lexical = lexical
+                self._metadata = metadata
+                self._vectors = new_vectors
+                self._documents, self._ids, self._by_id = documents, ids, by_id
+                self._deleted, self._selector = set(), None
+                self._tombstone(stale)
+                self._built_size = new_index.ntotal
+                self.generation += 1
+            if self.directory:
+                self.snapshot()
+
+    def _maybe_rebuild(self):
+        target = _target()
+        with self._rw.read():
+            n = self._index.ntotal
+            dead = len(self._deleted)
+            current = self._settings()
+        if dead and dead >= max(Config.RAG_COMPACT_MIN_DELETED, n * Config.RAG_COMPACT_RATIO):
+            self.rebuild(current[0], wait=False, storage=current[1], metric=current[2])
+            return
+        if not rag_index.needs_training(*target):
+            return
+        if current[:2] != target:
+            due = n >= Config.RAG_ANN_MIN_VECTORS
+        else:
+            due = n >= self._built_size * Config.RAG_REBUILD_GROWTH
+        if due:
+            self.rebuild(target[0], wait=False, storage=target[1])
+
+    # --- persistence ---
+
+    def load(self):
+        """Restore from the latest snapshot in `directory`; returns the live document count.
+
+        Raises ValueError if the snapshot holds vectors of another dimension
+        (EMBEDDING_DIMENSIONS changed), rather than serving a store every
+        search and upload would fail on.
+        """
+        path = rag_store.current_snapshot(self.directory) if self.directory else None
+        loaded = rag_store.load_snapshot(self.directory, with_rows=True) if path else None
+        if loaded is not None and loaded[0].d != self.dim:
+            raise ValueError(
+                f"Snapshot {path} of collection {self.name!r} holds {loaded[0].d}-dimensional vectors, "
+                f"but embeddings are {self.dim}-dimensional: restore EMBEDDING_DIMENSIONS or "
+                f"re-embed the documents into a new RAG_STORE_DIR"
+            )
+        with self._mutex:
+            self._snapshot_path = path
+            if loaded is not None:
+                index, documents, ids, deleted, metadata, vectors = loaded
+                if ids is None:  # snapshot from before document ids
+                    ids = rag_store.DocumentTable()
+                    ids.extend(content_id(t) for t in documents)
+                if metadata is None:  # ... or before metadata
+                    metadata = MetadataTable(Config.RAG_METADATA_BITMAP_FIELDS)
+                    metadata.append([None] * len(documents))
+                if vectors is None and _keeps_vectors(rag_index.index_storage(index)):
+                    # best effort for snapshots from before the full-precision copy
+                    vectors = rag_store.VectorTable(self.dim)
+                    vectors.append(rag_index.all_vectors(index))
+                deleted = set(int(r) for r in deleted)
+                by_id = {ids[r]: r for r in range(len(ids)) if r not in deleted}
+                # postings are not persisted; re-analyzing is cheaper than embedding
+                lexical = BM25Index()
+                lexical.add(BM25Index.analyze(documents))
+                with self._rw.write():
+                    self._index, self._index_mapped = _tuned(index), True
+                    self._lexical = lexical
+                    self._metadata = metadata
+                    self._vectors = vectors
+                    self._documents, self._ids, self._by_id = documents, ids, by_id
+                    self._deleted, self._selector = set(), None
+                    self._tombstone(list(deleted))
+                    self._built_size = index.ntotal
+            return len(self)
+
+    def snapshot(self):
+        """Write a snapshot now if the store has a directory; returns its path."""
+        if not self.directory:
+            return None
+        with self._mutex, self._directory_lock():
+            current = rag_store.current_snapshot(self.directory)
+            if current is not None and current != self._snapshot_path:
+                # another process published since: build on its snapshot, not over it
+                if self._rebuilding():
+                    return None  # the rebuild publishes once it has swapped in
+                self._merge_latest()
+            # readers keep searching while the files are written
+            with self._rw.read():
+                path = rag_store.save_snapshot(
+                    self.directory, self._index, self._documents, self._ids, self._deleted,
+                    self._metadata, self._vectors,
+                )
+            # re-point the index and tables at the new files so the heap copies are released
+            index = _tuned(rag_store.read_index(os.path.join(path, rag_store.INDEX_FILE)))
+            documents, ids, _, _, vectors = rag_store.open_tables(path, with_metadata=False)
+            with self._rw.write():
+                self._index, self._index_mapped = index, True
+                self._documents, self._ids, self._vectors = documents, ids, vectors
+            self._pending_adds = 0
+            self._journal = {}
+            self._snapshot_path = path
+            return path
+
+    def refresh(self):
+        """Catch up with a newer snapshot published by another process; returns True if it did.
+
+        Unsaved changes of this store are re-applied on top of it. Skipped
+        while a rebuild is running.
+        """
+        if not self.directory:
+            return False
+        with self._mutex:
+            if self._rebuilding() or rag_store.current_snapshot(self.directory) in (None, self._snapshot_path):
+                return False
+            with self._directory_lock():
+                current = rag_store.current_snapshot(self.directory)
+                if current is None or current == self._snapshot_path:
+                    return False
+                self._merge_latest()
+                return True
+
+    def _merge_latest(self):
+        # caller holds the mutex and the directory lock: load the published
+        # snapshot and re-apply the changes this store has not published yet
+        upserted = [doc_id for doc_id, op in self._journal.items() if op == "upsert" and doc_id in self._by_id]
+        deleted = [doc_id for doc_id, op in self._journal.items() if op == "delete"]
+        if upserted:
+            with self._rw.read():
+                rows = np.array([self._by_id[doc_id] for doc_id in upserted], dtype=np.int64)
+                texts = [self._documents[int(r)] for r in rows]
+                metadatas = [self._metadata.row(int(r)) for r in rows]
+                vectors = self._full_vectors(rows)
+        self.load()
+        if upserted:
+            self._apply_upsert(upserted, texts, vectors, metadatas)
+        if deleted:
+            self._apply_delete(deleted)
+
+    def _rebuilding(self):
+        thread = self._rebuild_thread
+        return thread is not None and thread.is_alive() and thread is not threading.current_thread()
+
+    @contextmanager
+    def _directory_lock(self):
+        # caller holds the mutex, which makes the depth count safe; the flock
+        # keeps other processes out of this directory until the outermost exit
+        if not self.directory or self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        with rag_store.directory_lock(self.directory):
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+
+    def flush(self):
+        """Snapshot if there are unsaved changes."""
+        with self._mutex:
+            if self.directory and self._pending_adds:
+                self.snapshot()
+
+    # --- reads ---
+
+    def search(self, query_emb, top_k, nprobe=None, ef_search=None, where=None, min_similarity=None):
+        """Return the `top_k` nearest live documents to `query_emb`.
+
+        Each hit is {"id", "text", "score", "metadata"}; the score is the
+        cosine similarity or the negated squared L2 distance (see the class
+        docstring), so higher is better. `nprobe` (IVF) and `ef_search`
+        (HNSW) trade recall for latency per call. `where` is an optional
+        metadata filter (see app.metadata). Hits less similar than
+        `min_similarity` are dropped.
+        """
+        query = np.asarray(query_emb).reshape(1, -1)
+        return self.search_batch(query, top_k, nprobe, ef_search, where, min_similarity)[0]
+
+    def search_lexical(self, query, top_k, where=None):
+        """BM25 keyword search; hits look like `search` hits with BM25 scores."""
+        with self._rw.read():
+            allow = self._filter_bits(where) if where is not None else None
+            pairs = self._lexical.search(query, top_k, exclude=self._deleted, allow=allow)
+            return [self._hit(r, score) for r, score in pairs]
+
+    def search_batch(self, query_matrix, top_k, nprobe=None, ef_search=None, where=None, min_similarity=None):
+        """`search` for every row of `query_matrix` in a single FAISS call.
+
+        With a filter the search is pre-filtered: FAISS only considers the
+        matching rows, and small subsets (<= RAG_FILTER_EXACT_MAX rows) are
+        scored exactly without touching the index structure at all. Over a
+        quantized index, RAG_RERANK_FACTOR * top_k candidates are re-ranked
+        by their full-precision distance.
+
+        With the l2 metric, `min_similarity` is compared against
+        1 - d^2 / 2, which is the cosine similarity for unit-length vectors
+        such as OpenAI embeddings.
+        """
+        with self._rw.read():
+            cosine = self._index.metric_type == faiss.METRIC_INNER_PRODUCT
+            queries = np.array(query_matrix, dtype=np.float32, order="C")  # a copy: normalized in place
+            if cosine:
+                faiss.normalize_L2(queries)
+            results = self._search_batch(queries, top_k, nprobe, ef_search, where, cosine)
+        if min_similarity is not None:
+            threshold = min_similarity if cosine else 2 * min_similarity - 2  # on -d^2
+            results = [[h for h in hits if h["score"] >= threshold] for hits in results]
+        return results
+
+    def _search_batch(self, queries, top_k, nprobe, ef_search, where, cosine):
+        # caller holds the read lock
+        bits = sel = None
+        if where is not None:
+            bits = self._filter_bits(where)
+            rows = np.flatnonzero(np.unpackbits(bits, bitorder="little")[: self._index.ntotal])
+            if len(rows) <= Config.RAG_FILTER_EXACT_MAX:
+                vectors = self._full_vectors(rows)
+                return [self._rank(q, rows, top_k, cosine, vectors) for q in queries]
+            sel = faiss.IDSelectorBitmap(self._index.ntotal, faiss.swig_ptr(bits))
+        elif self._selector:
+            sel = self._selector[0]
+        rerank = self._vectors is not None and Config.RAG_RERANK_FACTOR > 1
+        fetch_k = top_k * Config.RAG_RERANK_FACTOR if rerank else top_k
+        params = rag_index.search_params(self._index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+        distances, rows = self._index.search(queries, fetch_k, params=params)
+        if rerank:
+            return [self._rank(q, row_ids[row_ids >= 0], top_k, cosine) for q, row_ids in zip(queries, rows)]
+        sign = 1.0 if cosine else -1.0  # higher is better either way
+        return [
+            [self._hit(int(r), sign * float(d)) for d, r in zip(row_distances, row_ids) if r >= 0]
+            for row_distances, row_ids in zip(distances, rows)
+        ]
+
+    def _filter_bits(self, where):
+        # caller holds the read lock; rows matching `where`, minus tombstones
+        bits = self._metadata.evaluate(where)
+        if self._deleted:
+            dead = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+            np.bitwise_and.at(bits, dead >> 3, ~(np.uint8(1) << (dead & 7).astype(np.uint8)))
+        return bits
+
+    def _full_vectors(self, rows):
+        # caller holds the lock; exact unless an old quantized snapshot lacked the copy
+        if self._vectors is not None:
+            return self._vectors.take(rows)
+        if not len(rows):
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return self._index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+
+    def _rank(self, query, rows, top_k, cosine, vectors=None):
+        # exact ranking of `rows` for one query
+        if not len(rows):
+            return []
+        vectors = self._full_vectors(rows) if vectors is None else vectors
+        scores = vectors @ query if cosine else -((vectors - query) ** 2).sum(axis=1)
+        k = min(top_k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [self._hit(int(rows[i]), float(scores[i])) for i in best]
+
+    def _hit(self, r, score):
+        return {
+            "id": self._ids[r],
+            "text": self._documents[r],
+            "score": score,
+            "metadata": self._metadata.row(r),
+        }
+
+
+# --- collection registry ---
+
+_stores = {}
+_registry_lock = threading.Lock()
+_root_dir = None
+_following = False
+
+
+def validate_name(name):
+    if not isinstance(name, str) or not _NAME_RE.match(name):
+        raise ValueError("Collection names are 1-64 letters, digits, '_' or '-'")
+    return name
+
+
+def _directory(name):
+    if not _root_dir:
+        return None
+    if name == DEFAULT_COLLECTION:
+        return _root_dir
+    return os.path.join(_root_dir, COLLECTIONS_DIR, name)
+
+
+def get_store(name=DEFAULT_COLLECTION, dim=1536, create=True):
+    """Return the store for collection `name`, creating it if `create`."""
+    validate_name(name)
+    with _registry_lock:
+        store = _stores.get(name)
+        if store is None and create:
+            store = _stores[name] = VectorStore(name, dim, _directory(name))
+        return store
+
+
+def collections():
+    with _registry_lock:
+        return dict(_stores)
+
+
+def open_root(directory, dim=1536):
+    """Enable persistence under `directory` and load every collection found there.
+
+    Returns the total number of documents loaded.
+    """
+    global _root_dir
+    with _registry_lock:
+        _root_dir = directory
+        names = {DEFAULT_COLLECTION}
+        sub = os.path.join(directory, COLLECTIONS_DIR)
+        if os.path.isdir(sub):
+            names.update(n for n in os.listdir(sub) if _NAME_RE.match(n))
+        for name in names:
+            store = _stores.get(name)
+            if store is None:
+                store = _stores[name] = VectorStore(name, dim)
+            store.directory = _directory(name)
+        stores = list(_stores.values())
+    return sum(store.load() for store in stores)
+
+
+def follow_snapshots():
+    """Refresh a store before each write, for workers sharing RAG_STORE_DIR."""
+    global _following
+    _following = True
+
+
+def refresh_all(dim=1536):
+    """Pick up snapshots, and collections, published by other processes.
+
+    Returns the names of the collections that were (re)loaded.
+    """
+    with _registry_lock:
+        root = _root_dir
+    if not root:
+        return []
+    sub = os.path.join(root, COLLECTIONS_DIR)
+    names = set(n for n in os.listdir(sub) if _NAME_RE.match(n)) if os.path.isdir(sub) else set()
+    reloaded = []
+    for name in sorted(names | {DEFAULT_COLLECTION}):
+        store = get_store(name, dim)
+        if store.refresh():
+            reloaded.append(name)
+    return reloaded
+
+
+@atexit.register
+def flush_all():
+    """Snapshot every collection with unsaved changes (also run at exit)."""
+    for store in collections().values():
+        store.flush()
@@ -0,0 +1,96 @@
+"""Recall-vs-latency benchmark of the RAG index kinds against flat search.
+
+Usage:
+    python -m benchmarks.ann_benchmark --n 100000 --dim 256 --queries 500
+    python -m benchmarks.ann_benchmark --out ann.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app import rag_index
+
+
+def synthetic_corpus(n, dim, n_clusters=256, seed=0):
+    """Clustered gaussian data, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, size=n)
+    data = centers[labels] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    return np.ascontiguousarray(data, dtype=np.float32)
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    hits = sum(len(set(f[:k]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def timed_search(index, queries, k, params=None):
+    # one query per call, like retrieve_context
+    start = time.perf_counter()
+    results = [index.search(q.reshape(1, -1), k, params=params)[1][0] for q in queries]
+    elapsed = time.perf_counter() - start
+    return np.vstack(results), 1000 * elapsed / len(queries)
+
+
+def run(n, dim, n_queries, k):
+    data = synthetic_corpus(n, dim)
+    queries = synthetic_corpus(n_queries, dim, seed=1)
+    results = []
+
+    flat = rag_index.build_index("flat", dim, data)
+    truth, flat_ms = timed_search(flat, queries, k)
+    results.append({"kind": "flat", "recall": 1.0, "ms_per_query": flat_ms})
+
+    sweeps = {
+        "ivf_flat": ("nprobe", [1, 4, 16, 64]),
+        "ivf_pq": ("nprobe", [1, 4, 16, 64]),
+        "hnsw": ("ef_search", [16, 32, 64, 128]),
+    }
+    for kind, (knob, values) in sweeps.items():
+        t0 = time.perf_counter()
+        index = rag_index.build_index(kind, dim, data, pq_m=_pq_m(dim))
+        build_s = time.perf_counter() - t0
+        for value in values:
+            params = rag_index.search_params(index, **{knob: value})
+            found, ms = timed_search(index, queries, k, params)
+            results.append({
+                "kind": kind,
+                knob: value,
+                "recall": recall_at_k(found, truth),
+                "ms_per_query": ms,
+                "speedup": flat_ms / ms if ms else None,
+                "build_s": build_s,
+            })
+    return {"n": n, "dim": dim, "queries": n_queries, "k": k, "results": results}
+
+
+def _pq_m(dim):
+    # largest of the usual sub-quantizer counts that divides dim
+    return next(m for m in (64, 32, 16, 8, 4, 2, 1) if dim % m == 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    report = run(args.n, args.dim, args.queries, args.k)
+    for row in report["results"]:
+        knob = next((f"{key}={row[key]}" for key in ("nprobe", "ef_search") if key in row), "")
+        print(f"{row['kind']:9s} {knob:14s} recall@{args.k}={row['recall']:.3f} "
+              f"{row['ms_per_query']:.3f} ms/query")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
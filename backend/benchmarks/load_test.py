@@ -0,0 +1,192 @@
+"""Open-loop load test of the API endpoints at a target request rate.
+
+Requests are started on a fixed schedule (--rps across all endpoints,
+round-robin over --endpoints) whether or not earlier ones have finished,
+and latency is measured from the scheduled start, so a saturated server
+shows up as growing latency instead of a silently lower request rate.
+
+Without --url the app is started in this process (threaded werkzeug
+server) against a local mock of the OpenAI API (benchmarks.mock_openai),
+so the numbers include realistic upstream latency but no real API calls
+or costs; the reported RSS is then the app's. Against an external --url,
+pass --pid to report that process's RSS.
+
+Usage:
+    python -m benchmarks.load_test --rps 20 --duration 30 --out load.json
+    python -m benchmarks.load_test --endpoints ask_rag --rps 50 --latency chat=fixed:300
+    python -m benchmarks.load_test --url http://localhost:5000 --api-key $API_KEY --pid 1234
+"""
+import argparse
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmarks import mock_openai
+from benchmarks.report import environment, latency_summary, rss_bytes, write_report
+
+TOPICS = ["billing", "passwords", "holidays", "shipping", "refunds", "security", "onboarding", "invoices"]
+
+
+def _sentence(rng, i):
+    topic = rng.choice(TOPICS)
+    return f"Policy {i} about {topic}: requests about {topic} are handled within {rng.randint(1, 30)} days."
+
+
+def _question(rng, pool):
+    return f"What is the policy {rng.randrange(pool)} about {rng.choice(TOPICS)}?"
+
+
+def request_factories(rng, prompt_pool, sessions):
+    """endpoint -> function returning (method, path, json body) of the next request."""
+    counter = itertools.count()
+    return {
+        "chat": lambda: ("POST", "/chat", {"content": _question(rng, prompt_pool)}),
+        "ask_rag": lambda: ("POST", "/ask_rag", {"query": _question(rng, prompt_pool)}),
+        "chat_rag_memory": lambda: ("POST", "/chat_rag_memory", {
+            "session_id": f"load-{rng.randrange(sessions)}", "query": _question(rng, prompt_pool),
+        }),
+        "upload_docs": lambda: ("POST", "/upload_docs", {
+            "texts": [_sentence(rng, next(counter)) for _ in range(8)], "collection": "load-test",
+        }),
+    }
+
+
+def run(base_url, api_key, endpoints, rps, duration, concurrency=256, prompt_pool=1000, sessions=100,
+        seed_docs=200, no_cache=False, seed=0):
+    rng = random.Random(seed)
+    factories = request_factories(rng, prompt_pool, sessions)
+    headers = {"x-api-key": api_key}
+    if no_cache:
+        headers["cache-control"] = "no-cache"
+    client = httpx.Client(base_url=base_url, headers=headers, timeout=120,
+                          limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency))
+
+    # a corpus for the RAG endpoints to retrieve from
+    for start in range(0, seed_docs, 50):
+        texts = [_sentence(rng, i) for i in range(start, min(seed_docs, start + 50))]
+        client.post("/upload_docs", json={"texts": texts}).raise_for_status()
+
+    samples = {e: [] for e in endpoints}
+    statuses = {e: {} for e in endpoints}
+    lock = threading.Lock()
+
+    def fire(endpoint, method, path, body, scheduled):
+        try:
+            status = client.request(method, path, json=body).status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            statuses[endpoint][str(status)] = statuses[endpoint].get(str(status), 0) + 1
+            if status == 200:
+                samples[endpoint].append(elapsed)
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    interval = 1.0 / rps
+    total = int(rps * duration)
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    for i, endpoint in zip(range(total), itertools.cycle(endpoints)):
+        scheduled = started + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pool.submit(fire, endpoint, *factories[endpoint](), scheduled)
+    pool.shutdown(wait=True)
+    elapsed = time.perf_counter() - started
+    client.close()
+
+    results = []
+    for endpoint in endpoints:
+        sent = sum(statuses[endpoint].values())
+        ok = len(samples[endpoint])
+        results.append({
+            "endpoint": endpoint,
+            "sent": sent,
+            "ok": ok,
+            "error_rate": (sent - ok) / sent if sent else 0.0,
+            "statuses": statuses[endpoint],
+            "throughput_rps": ok / elapsed,
+            "latency": latency_summary(samples[endpoint]),
+        })
+    return {
+        "target_rps": rps,
+        "duration_s": elapsed,
+        "throughput_rps": sum(r["ok"] for r in results) / elapsed,
+        "results": results,
+        "rss_before_bytes": rss_before,
+    }
+
+
+def _serve_app(port):
+    """Start the app in-process; the environment must already point at the mock."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from app import create_app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", port, create_app(), threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="app", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="running app to test (default: start one in-process on the mock)")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY", "load-test-key"))
+    parser.add_argument("--pid", type=int, help="process whose RSS to report, with --url")
+    parser.add_argument("--endpoints", nargs="+", default=["chat", "ask_rag", "chat_rag_memory", "upload_docs"],
+                        choices=["chat", "ask_rag", "chat_rag_memory", "upload_docs"])
+    parser.add_argument("--rps", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=256, help="max requests in flight")
+    parser.add_argument("--prompt-pool", type=int, default=1000, help="distinct questions (bounds cache hit rates)")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--seed-docs", type=int, default=200, help="documents uploaded before the run")
+    parser.add_argument("--no-cache", action="store_true", help="send Cache-Control: no-cache")
+    # mock upstream, when the app runs in-process
+    parser.add_argument("--latency", action="append", metavar="OP=SPEC", help="see benchmarks.mock_openai")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    mock = app_server = None
+    base_url = args.url
+    if base_url is None:
+        mock = mock_openai.start(latency=mock_openai.parse_latency(args.latency), error_rate=args.error_rate,
+                                 rate_limit_rate=args.rate_limit_rate, seed=0)
+        # the SDK reads these; they must be set before the app is imported
+        os.environ.update({"OPENAI_BASE_URL": mock.base_url, "OPENAI_API_KEY": "mock", "API_KEY": args.api_key})
+        app_server = _serve_app(args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    report = run(base_url, args.api_key, args.endpoints, args.rps, args.duration, args.concurrency,
+                 args.prompt_pool, args.sessions, args.seed_docs, args.no_cache)
+    report["rss_bytes"] = rss_bytes(args.pid) if args.url else rss_bytes()
+    report["environment"] = environment()
+    if mock is not None:
+        report["upstream"] = {"latency": {op: lat.spec for op, lat in mock.latency.items()}, "calls": mock.stats()}
+        app_server.shutdown()
+        mock.shutdown()
+
+    for row in report["results"]:
+        lat = row["latency"]
+        print(f"{row['endpoint']:16s} ok={row['ok']:<6d} err={row['error_rate']:.1%} "
+              f"{row['throughput_rps']:.1f} rps  p50={lat.get('p50_ms', 0):.0f}ms "
+              f"p95={lat.get('p95_ms', 0):.0f}ms p99={lat.get('p99_ms', 0):.0f}ms")
+    if args.out:
+        write_report(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
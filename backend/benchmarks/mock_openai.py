@@ -0,0 +1,253 @@
+"""Offline stand-in for the OpenAI HTTP API, with realistic latency and failures.
+
+Fake mode answers instantly, which says nothing about behaviour under real
+upstream latency. This server speaks enough of the API for the app's
+calls (chat completions incl. streaming, embeddings, image generation)
+and adds, per operation:
+
+  - a latency distribution: fixed:MS, uniform:LO:HI, lognormal:MEDIAN:SIGMA
+    (for streamed chats the time to the first token; later tokens follow
+    every --stream-interval-ms)
+  - a share of 500 errors (--error-rate) and of 429s with Retry-After
+    (--rate-limit-rate)
+
+Point the app at it through the SDK's own environment variables:
+
+    python -m benchmarks.mock_openai --port 8089 --latency chat=lognormal:700:0.4
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock python -m app.main
+
+Embeddings are deterministic unit vectors derived from the text, so the
+same text always gets the same vector and caching behaves as with the API.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# the 1x1 PNG fake mode serves
+PNG_B64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR4nGNgYAAAAAMAASsJTYQAAAAASUVORK5CYII="
+
+ROUTES = {
+    "/v1/chat/completions": "chat",
+    "/v1/embeddings": "embeddings",
+    "/v1/images/generations": "images",
+}
+
+DEFAULT_LATENCY = {
+    "chat": "lognormal:800:0.5",
+    "embeddings": "lognormal:80:0.3",
+    "images": "lognormal:6000:0.3",
+}
+
+
+class Latency:
+    """A latency distribution parsed from "fixed:MS", "uniform:LO:HI" or "lognormal:MEDIAN:SIGMA"."""
+
+    def __init__(self, spec):
+        kind, *params = spec.split(":")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"Invalid latency '{spec}'")
+
+    def sample(self, rng):
+        """One latency in seconds."""
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(*self.params)
+        else:
+            median, sigma = self.params
+            ms = rng.lognormvariate(np.log(median), sigma) if median > 0 else 0.0
+        return ms / 1000
+
+
+def fake_embedding(text, dims):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dims).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+class MockOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=None, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, stream_interval_ms=20, completion_words=60, seed=None):
+        super().__init__(address, _Handler)
+        specs = {**DEFAULT_LATENCY, **(latency or {})}
+        self.latency = {op: Latency(spec) for op, spec in specs.items()}
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stream_interval = stream_interval_ms / 1000
+        self.completion_words = completion_words
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {op: {"requests": 0, "errors": 0, "rate_limited": 0} for op in specs}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def draw(self, operation):
+        """(status, latency in seconds) for the next call to `operation`."""
+        with self._lock:
+            counts = self.counts[operation]
+            counts["requests"] += 1
+            roll = self._rng.random()
+            latency = self.latency[operation].sample(self._rng)
+            if roll < self.rate_limit_rate:
+                counts["rate_limited"] += 1
+                return 429, latency / 10  # upstream rejects quickly
+            if roll < self.rate_limit_rate + self.error_rate:
+                counts["errors"] += 1
+                return 500, latency
+            return 200, latency
+
+    def stats(self):
+        with self._lock:
+            return {op: dict(c) for op, c in self.counts.items()}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        operation = ROUTES.get(self.path.split("?")[0])
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length") or 0)) or b"{}")
+        if operation is None:
+            return self._json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+        status, latency = self.server.draw(operation)
+        time.sleep(latency)
+        if status == 429:
+            return self._json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                              {"retry-after": str(self.server.retry_after)})
+        if status == 500:
+            return self._json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+        getattr(self, f"_{operation}")(body)
+
+    def _json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chat(self, body):
+        prompt = next((m.get("content") for m in reversed(body.get("messages", [])) if m.get("role") == "user"), "")
+        words = (["Mock", "answer:"] + str(prompt).split())[: self.server.completion_words]
+        words += ["lorem"] * (self.server.completion_words - len(words))
+        base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": body.get("model", "mock")}
+        if not body.get("stream"):
+            return self._json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(str(prompt).split()), "completion_tokens": len(words),
+                          "total_tokens": len(str(prompt).split()) + len(words)},
+            })
+
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.server.stream_interval)
+            delta = {"content": word + " "} if i else {"role": "assistant", "content": word + " "}
+            self._chunk(base, delta, None)
+        self._chunk(base, {}, "stop")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _chunk(self, base, delta, finish_reason):
+        event = {**base, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _embeddings(self, body):
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        dims = body.get("dimensions") or 1536
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(texts):
+            vec = fake_embedding(text, dims)
+            embedding = base64.b64encode(vec.tobytes()).decode("ascii") if as_base64 else vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(t.split()) for t in texts)
+        self._json(200, {"object": "list", "data": data, "model": body.get("model", "mock"),
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _images(self, body):
+        self._json(200, {"created": int(time.time()), "data": [{"b64_json": PNG_B64}]})
+
+
+def start(**options):
+    """Run a MockOpenAI on a background thread; returns the server (see `base_url`)."""
+    server = MockOpenAI(**options)
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+def parse_latency(values):
+    """["chat=fixed:100", ...] -> {"chat": "fixed:100"}."""
+    latency = {}
+    for value in values or ():
+        operation, _, spec = value.partition("=")
+        if operation not in DEFAULT_LATENCY:
+            raise ValueError(f"Unknown operation '{operation}'")
+        Latency(spec)  # validate
+        latency[operation] = spec
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", action="append", metavar="OP=SPEC",
+                        help="e.g. chat=lognormal:800:0.5, embeddings=fixed:50, images=uniform:3000:9000")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of 429 responses")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--stream-interval-ms", type=float, default=20)
+    parser.add_argument("--completion-words", type=int, default=60)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = MockOpenAI(
+        (args.host, args.port), latency=parse_latency(args.latency), error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        stream_interval_ms=args.stream_interval_ms, completion_words=args.completion_words, seed=args.seed,
+    )
+    print(f"mock OpenAI API on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Memory-vs-recall benchmark of reduced-precision vector storage.
+
+For every storage setting (fp32, fp16, int8, pq) and optional shortened
+dimensions, reports bytes per vector of the serialized index and recall@k
+against exact full-dimension search, with and without full-precision
+re-ranking of RAG_RERANK_FACTOR * k candidates.
+
+Synthetic data has no Matryoshka structure, so `--dims` only says
+something about real text-embedding-3 vectors: pass them with `--data`
+(an (n, dim) float32 .npy file, ideally normalized embeddings).
+
+Usage:
+    python -m benchmarks.quantization_benchmark --n 100000 --dim 256
+    python -m benchmarks.quantization_benchmark --data emb.npy --dims 1536 512 256 --out q.json
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from app import rag_index
+from benchmarks.ann_benchmark import _pq_m, recall_at_k, synthetic_corpus
+
+
+def truncate(vectors, dims):
+    """First `dims` components, re-normalized (how shortened embeddings are produced)."""
+    short = np.ascontiguousarray(vectors[:, :dims])
+    norms = np.linalg.norm(short, axis=1, keepdims=True)
+    return short / np.where(norms == 0, 1, norms)
+
+
+def rerank(data, queries, candidates, k):
+    found = []
+    for q, rows in zip(queries, candidates):
+        rows = rows[rows >= 0]
+        distances = ((data[rows] - q) ** 2).sum(axis=1)
+        found.append(rows[np.argsort(distances)[:k]])
+    return found
+
+
+def run(data, queries, k, dims_list, rerank_factor, kind="flat"):
+    n, dim = data.shape
+    flat = rag_index.build_index("flat", dim, data)
+    _, truth = flat.search(queries, k)
+    results = []
+    for dims in dims_list:
+        short_data = truncate(data, dims) if dims < dim else data
+        short_queries = truncate(queries, dims) if dims < dim else queries
+        for storage in rag_index.STORAGE_KINDS:
+            t0 = time.perf_counter()
+            index = rag_index.build_index(kind, dims, short_data, pq_m=_pq_m(dims), storage=storage)
+            build_s = time.perf_counter() - t0
+            row = {
+                "dims": dims,
+                "storage": storage,
+                "bytes_per_vector": len(faiss.serialize_index(index)) / n,
+                "build_s": build_s,
+            }
+            t0 = time.perf_counter()
+            _, found = index.search(short_queries, k)
+            row["ms_per_query"] = 1000 * (time.perf_counter() - t0) / len(queries)
+            row["recall"] = recall_at_k(found, truth)
+            if rerank_factor > 1:
+                # re-rank against full-dimension, full-precision vectors, as the store does
+                t0 = time.perf_counter()
+                _, candidates = index.search(short_queries, k * rerank_factor)
+                reranked = rerank(data, queries, candidates, k)
+                row["ms_per_query_reranked"] = 1000 * (time.perf_counter() - t0) / len(queries)
+                row["recall_reranked"] = recall_at_k(reranked, truth)
+            results.append(row)
+    return {"n": n, "dim": dim, "queries": len(queries), "k": k, "kind": kind,
+            "rerank_factor": rerank_factor, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", help=".npy file of real embeddings (default: synthetic)")
+    parser.add_argument("--n", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--dims", type=int, nargs="*", help="shortened dimensions to try as well")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--kind", default="flat", choices=rag_index.INDEX_KINDS)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.data:
+        vectors = np.load(args.data).astype(np.float32)
+        data, queries = vectors[args.queries:], vectors[: args.queries]
+    else:
+        data = synthetic_corpus(args.n, args.dim)
+        queries = synthetic_corpus(args.queries, args.dim, seed=1)
+    dim = data.shape[1]
+    dims_list = sorted({dim, *(d for d in args.dims or () if d < dim)}, reverse=True)
+
+    report = run(data, queries, args.k, dims_list, args.rerank_factor, args.kind)
+    for row in report["results"]:
+        line = (f"dims={row['dims']:<5d} {row['storage']:5s} {row['bytes_per_vector']:8.1f} B/vector "
+                f"recall@{args.k}={row['recall']:.3f}")
+        if "recall_reranked" in row:
+            line += f" reranked={row['recall_reranked']:.3f}"
+        print(line)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Micro-benchmark of rag_service.add_documents / retrieve_context over synthetic corpora.
+
+For each corpus size, documents are added through `add_documents` in
+batches (vector index, lexical index, ids and, with --store-dir,
+snapshots included), then `retrieve_context` is timed per query for each
+retrieval mode. Reports ingest throughput, query latency percentiles and
+the process RSS after each build.
+
+Embeddings come from a synthetic clustered corpus instead of the API
+(`rag_service.embed_text` is swapped for a lookup of the document's row),
+so the numbers are the store's own cost. 10M vectors need dim * 40 MB of
+RAM for the vectors alone; use a small --dim for the largest sizes.
+
+Usage:
+    python -m benchmarks.rag_benchmark --sizes 10000 100000 --dim 256
+    python -m benchmarks.rag_benchmark --sizes 1000000 10000000 --dim 64 --kind ivf_pq --out rag.json
+"""
+import argparse
+import re
+import time
+
+import numpy as np
+
+from app import rag_index, rag_service, vector_store
+from app.config import Config
+from benchmarks.report import environment, latency_summary, rss_bytes, write_report
+
+_ROW_RE = re.compile(r"^(doc|query) (\d+)\b")
+
+
+class SyntheticEmbedder:
+    """Deterministic clustered vectors for "doc <i> ..." and "query <j> ..." texts."""
+
+    def __init__(self, dim, n_clusters=256, seed=0):
+        self.dim = dim
+        rng = np.random.default_rng(seed)
+        self.centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+
+    def vector(self, kind, i):
+        rng = np.random.default_rng((0 if kind == "doc" else 1, i))
+        center = self.centers[rng.integers(len(self.centers))]
+        return center + 0.3 * rng.standard_normal(self.dim).astype(np.float32)
+
+    def __call__(self, texts):
+        vectors = []
+        for text in texts:
+            kind, i = _ROW_RE.match(text).groups()
+            vectors.append(self.vector(kind, int(i)))
+        return vectors
+
+
+def document(i):
+    return f"doc {i} about topic {i % 97} with keyword k{i % 1013}"
+
+
+def query(j):
+    return f"query {j} topic {j % 97} keyword k{j % 1013}"
+
+
+def run(n, dim, batch, n_queries, top_k, modes, collection):
+    t0 = time.perf_counter()
+    for start in range(0, n, batch):
+        rag_service.add_documents([document(i) for i in range(start, min(n, start + batch))], collection)
+    ingest_s = time.perf_counter() - t0
+    store = rag_service.get_store(collection)
+
+    rows = []
+    for mode in modes:
+        rag_service.retrieve_context(query(0), top_k=top_k, collection=collection, mode=mode)  # warm up
+        latencies = []
+        for j in range(n_queries):
+            t0 = time.perf_counter()
+            rag_service.retrieve_context(query(j), top_k=top_k, collection=collection, mode=mode)
+            latencies.append(time.perf_counter() - t0)
+        rows.append({"mode": mode, "latency": latency_summary(latencies)})
+
+    return {
+        "n": n,
+        "kind": store.kind,
+        "storage": store.storage,
+        "ingest_s": ingest_s,
+        "docs_per_s": n / ingest_s,
+        "rss_bytes": rss_bytes(),
+        "queries": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=10000, help="documents per add_documents call")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=["vector", "hybrid"], choices=rag_service.RETRIEVAL_MODES)
+    parser.add_argument("--kind", choices=rag_index.INDEX_KINDS, help="index kind (default RAG_INDEX_TYPE)")
+    parser.add_argument("--storage", choices=rag_index.STORAGE_KINDS, help="default RAG_VECTOR_STORAGE")
+    parser.add_argument("--store-dir", help="snapshot into this directory while adding (default: in memory)")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.kind:
+        Config.RAG_INDEX_TYPE = args.kind
+    if args.storage:
+        Config.RAG_VECTOR_STORAGE = args.storage
+    if args.store_dir:
+        rag_service.load_store(args.store_dir)
+    rag_service.embedding_dim = args.dim
+    rag_service.embed_text = SyntheticEmbedder(args.dim)
+
+    results = []
+    for n in args.sizes:
+        collection = f"bench-{n}"
+        row = run(n, args.dim, args.batch, args.queries, args.top_k, args.modes, collection)
+        results.append(row)
+        # let the next size start from an empty heap
+        vector_store._stores.pop(collection, None)
+        latencies = " ".join(f"{q['mode']} p50={q['latency']['p50_ms']:.2f}ms p99={q['latency']['p99_ms']:.2f}ms"
+                             for q in row["queries"])
+        print(f"n={n:<9d} {row['kind']}/{row['storage']} {row['docs_per_s']:,.0f} docs/s "
+              f"rss={row['rss_bytes'] / 2**20:,.0f} MiB  {latencies}")
+
+    report = {"dim": args.dim, "top_k": args.top_k, "batch": args.batch, "results": results,
+              "environment": environment()}
+    if args.out:
+        write_report(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Shared helpers for benchmark reports, and a regression check between two of them.
+
+Reports are JSON files; every latency block has the shape produced by
+`latency_summary` ({"count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"}).
+`compare` walks two reports side by side and flags latency percentiles that
+grew, and throughputs that shrank, by more than the tolerance.
+
+Usage:
+    python -m benchmarks.report baseline.json current.json --tolerance 0.2
+    (exit status 1 when something regressed, so CI can fail the job)
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms")
+HIGHER_IS_BETTER = ("throughput_rps", "docs_per_s")
+
+
+def latency_summary(seconds):
+    """Percentiles of a list of latencies given in seconds."""
+    if not len(seconds):
+        return {"count": 0}
+    ms = 1000 * np.asarray(seconds, dtype=np.float64)
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(ms.max()),
+    }
+
+
+def rss_bytes(pid=None):
+    """Current resident set size of `pid` (default: this process)."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        # peak rather than current RSS, but better than nothing off Linux (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def _metrics(node, path=()):
+    """Yield (path, name, value) for every compared metric in a report."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in LOWER_IS_BETTER + HIGHER_IS_BETTER and isinstance(value, (int, float)):
+                yield path, key, value
+            else:
+                yield from _metrics(value, path + (str(key),))
+    elif isinstance(node, list):
+        for i, value in enumerate(node):
+            # list rows are matched by their identifying fields, not their position
+            label = ",".join(f"{k}={value[k]}" for k in ("endpoint", "n", "mode", "kind") if isinstance(value, dict) and k in value)
+            yield from _metrics(value, path + (label or str(i),))
+
+
+def compare(baseline, current, tolerance=0.2):
+    """Return [(metric, baseline value, current value)] that regressed by more than `tolerance`."""
+    base = {(path, name): value for path, name, value in _metrics(baseline)}
+    regressions = []
+    for path, name, value in _metrics(current):
+        old = base.get((path, name))
+        if not old:
+            continue
+        change = (value - old) / old
+        if (name in LOWER_IS_BETTER and change > tolerance) or (name in HIGHER_IS_BETTER and change < -tolerance):
+            regressions.append(("/".join(path + (name,)), old, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.tolerance)
+    for metric, old, new in regressions:
+        print(f"REGRESSION {metric}: {old:.3f} -> {new:.3f}")
+    if not regressions:
+        print("no regressions")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Gunicorn settings for production serving (see app/serving.py).
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+Command-line flags and GUNICORN_CMD_ARGS still override these.
+"""
+import gc
+import os
+
+# no collections in the master while the app loads, so its objects are not
+# scattered over pages the workers would then copy (gc.freeze() before forking)
+gc.disable()
+
+from app import serving  # noqa: E402
+from app.config import Config  # noqa: E402
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+preload_app = True  # load the index once in the master, shared copy-on-write
+worker_class = "gthread"
+workers = serving.workers()
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    serving.prefork()
+
+
+def post_fork(server, worker):
+    serving.after_fork()
+
+
+def worker_exit(server, worker):
+    serving.worker_exit()
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from app.asgi import application, flask_app
+
+flask_app.config["TESTING"] = True
+HEADERS = {"x-api-key": "my-secret-key"}
+
+
+def call(method, path, body=None, headers=None):
+    """Drive the ASGI app directly and return (status, headers, body)."""
+    raw = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 1234),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in {
+            "content-type": "application/json", **(headers or {})}.items()],
+    }
+    messages = [{"type": "http.request", "body": raw, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    start = sent[0]
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+def test_async_chat():
+    status, _, body = call("POST", "/chat", {"content": "Hello!"}, HEADERS)
+    assert status == 200
+    assert json.loads(body)["response"] == "(test) Echo: Hello!"
+
+
+def test_async_chat_requires_key_and_content():
+    assert call("POST", "/chat", {"content": "Hello!"})[0] == 401
+    assert call("POST", "/chat", {"content": ""}, HEADERS)[0] == 400
+
+
+def test_async_generate_image_bytes():
+    status, headers, body = call(
+        "POST", "/generateImage", {"content": "A red elephant"}, {**HEADERS, "response-type": "image"}
+    )
+    assert status == 200
+    assert headers[b"content-type"] == b"image/png"
+    assert body.startswith(b"\x89PNG")
+
+
+def test_async_rag_and_memory():
+    status, _, _ = call("POST", "/ask_rag", {"query": "What is the capital of Lebanon?"}, HEADERS)
+    assert status == 200
+    status, _, body = call("POST", "/chat_rag_memory", {"session_id": "asgi", "query": "Hi"}, HEADERS)
+    assert status == 200
+    assert "Memory+RAG" in json.loads(body)["response"]
+
+
+def test_other_routes_fall_through_to_flask():
+    status, _, body = call("GET", "/", headers=HEADERS)
+    assert status == 200
+    assert json.loads(body)["response"] == "Hello, World!"
@@ -0,0 +1,57 @@
+import openai
+import pytest
+
+from benchmarks import mock_openai
+from benchmarks.report import compare, latency_summary
+
+
+@pytest.fixture
+def mock():
+    server = mock_openai.start(
+        latency={"chat": "fixed:1", "embeddings": "fixed:1", "images": "fixed:1"}, completion_words=4, seed=0,
+    )
+    yield server
+    server.shutdown()
+
+
+def test_mock_speaks_the_sdk(mock):
+    client = openai.OpenAI(api_key="mock", base_url=mock.base_url, max_retries=0)
+    chat = client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hello"}])
+    assert chat.choices[0].message.content == "Mock answer: hello lorem"
+
+    stream = client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}], stream=True)
+    assert "".join(c.choices[0].delta.content or "" for c in stream) == "Mock answer: hi lorem "
+
+    first = client.embeddings.create(model="m", input=["a", "b"], dimensions=16)
+    again = client.embeddings.create(model="m", input="a", dimensions=16)
+    assert len(first.data[0].embedding) == 16
+    assert first.data[0].embedding == again.data[0].embedding != first.data[1].embedding
+    assert client.images.generate(model="m", prompt="x").data[0].b64_json == mock_openai.PNG_B64
+    assert mock.stats()["chat"]["requests"] == 2
+
+
+def test_mock_rate_limits_with_retry_after(mock):
+    mock.rate_limit_rate = 1.0
+    client = openai.OpenAI(api_key="mock", base_url=mock.base_url, max_retries=0)
+    with pytest.raises(openai.RateLimitError) as e:
+        client.embeddings.create(model="m", input="a")
+    assert e.value.response.headers["retry-after"] == "1"
+    assert mock.stats()["embeddings"]["rate_limited"] == 1
+
+
+def test_latency_specs():
+    assert mock_openai.parse_latency(["chat=uniform:10:20"]) == {"chat": "uniform:10:20"}
+    for bad in (["chat=normal:1"], ["chat=fixed"], ["audio=fixed:1"]):
+        with pytest.raises(ValueError):
+            mock_openai.parse_latency(bad)
+
+
+def test_compare_flags_regressions():
+    baseline = {"results": [{"endpoint": "chat", "throughput_rps": 10.0, "latency": latency_summary([0.1, 0.2])}]}
+    slower = {"results": [{"endpoint": "chat", "throughput_rps": 7.0, "latency": latency_summary([0.3, 0.4])}]}
+    regressions = compare(baseline, slower, tolerance=0.2)
+    assert {metric for metric, _, _ in regressions} == {
+        "results/endpoint=chat/throughput_rps", "results/endpoint=chat/latency/p50_ms",
+        "results/endpoint=chat/latency/p95_ms", "results/endpoint=chat/latency/p99_ms",
+    }
+    assert compare(baseline, baseline) == []
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from app import context_builder, memory_service
+from app.tokens import count_tokens
+from tests.test_routes import client
+
+
+def _fill(session_id, turns, size=50):
+    for i in range(turns):
+        memory_service.add_to_memory(session_id, "user", f"question {i} " + "x " * size)
+        memory_service.add_to_memory(session_id, "assistant", f"answer {i} " + "y " * size)
+
+
+def test_packs_within_budget_and_reports_savings():
+    memory_service.clear_memory("budget")
+    _fill("budget", 3, size=200)
+    chunks = ["relevant " * 100, "also relevant " * 100, "marginal " * 100]
+
+    messages, usage = context_builder.build_messages("budget", "What now?", chunks, budget=400)
+
+    assert usage["prompt_tokens"] <= 400
+    assert usage["prompt_tokens_saved"] > 0
+    assert messages[-1] == {"role": "user", "content": "What now?"}
+    # the most relevant chunk wins over the others
+    assert messages[-2]["content"].count("also relevant") == 0
+    assert "relevant" in messages[-2]["content"]
+
+
+def test_everything_fits_saves_nothing():
+    memory_service.clear_memory("small")
+    _fill("small", 1, size=2)
+    messages, usage = context_builder.build_messages("small", "Hi", ["short chunk"], budget=3000)
+    assert usage["prompt_tokens_saved"] == 0
+    assert len(messages) == 4
+
+
+def test_history_keeps_newest_messages():
+    memory_service.clear_memory("recent")
+    _fill("recent", 2, size=100)
+    budget = count_tokens("Hi") + 300
+    messages, _ = context_builder.build_messages("recent", "Hi", [], budget=budget, rag_share=0)
+    history = [m for m in messages if m["role"] != "system"][:-1]
+    assert history and history[-1]["content"].startswith("answer 1")
+
+
+def test_old_turns_roll_into_summary():
+    memory_service.clear_memory("summary")
+    for i in range(4):
+        context_builder.remember_turn("summary", f"question {i}", f"answer {i}")
+
+    summary = memory_service.get_summary("summary")
+    assert "question 0" in summary and "answer 0" in summary
+    messages, _ = context_builder.build_messages("summary", "next", [])
+    assert messages[0]["content"].startswith(context_builder.SUMMARY_HEADER)
+
+
+def test_concurrent_turns_fold_each_message_once(monkeypatch):
+    def slow_summarize(summary, messages):
+        time.sleep(0.01)  # a completion call: concurrent folds would overlap here
+        return "|".join(filter(None, [summary] + [m["content"] for m in messages]))
+
+    monkeypatch.setattr(context_builder, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(context_builder, "summarize", slow_summarize)
+    memory_service.clear_memory("concurrent")
+    turns = [threading.Thread(target=context_builder.remember_turn, args=("concurrent", f"q{i}", f"a{i}"))
+             for i in range(10)]
+    for t in turns:
+        t.start()
+    for t in turns:
+        t.join()
+    for _ in range(200):
+        if "concurrent" not in context_builder._pending_folds:
+            break
+        time.sleep(0.01)
+
+    folded = memory_service.get_summary("concurrent").split("|")
+    kept = [m["content"] for m in memory_service.get_memory("concurrent")]
+    assert len(folded) == len(set(folded)) == 15
+    assert sorted(folded + kept) == sorted([f"q{i}" for i in range(10)] + [f"a{i}" for i in range(10)])
+
+
+def test_chat_rag_memory_reports_token_savings():
+    data = {"session_id": "usage", "query": "Tell me about Lebanon"}
+    response = client.post("/chat_rag_memory", json=data, headers={"x-api-key": "my-secret-key"})
+    assert response.status_code == 200
+    assert "prompt_tokens_saved" in response.json
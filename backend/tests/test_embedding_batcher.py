@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from app import openai_client, rag_service
+from app.embedding_batcher import EmbeddingBatcher
+from app.embedding_cache import EmbeddingCache
+from app.metrics import Histogram
+from tests.test_routes import client
+
+
+def _recording_embed(calls, fail=False):
+    def embed(texts):
+        calls.append(list(texts))
+        if fail:
+            raise RuntimeError("rate limited")
+        return [float(len(t)) for t in texts]
+    return embed
+
+
+def test_concurrent_requests_share_one_batch():
+    calls = []
+    batcher = EmbeddingBatcher(_recording_embed(calls), window_ms=200, max_inputs=4)
+    futures = [batcher.submit(["a"]), batcher.submit(["bb", "a"]), batcher.submit(["ccc"])]
+    assert [f.result(5) for f in futures] == [[1.0], [2.0, 1.0], [3.0]]
+    assert calls == [["a", "bb", "ccc"]]  # duplicates sent once
+
+    stats = batcher.stats()
+    assert stats["requests"] == 3 and stats["batches"] == 1
+    assert stats["batch_size"]["count"] == 1 and stats["batch_size"]["sum"] == 3
+    assert stats["queue_ms"]["count"] == 3
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    calls = []
+    batcher = EmbeddingBatcher(_recording_embed(calls), window_ms=60_000, max_inputs=3)
+    futures = [batcher.submit([f"t{i}"]) for i in range(5)]
+    assert [f.result(5) for f in futures[:3]] == [[2.0]] * 3
+    assert calls == [["t0", "t1", "t2"]]
+    assert not futures[3].done()  # the rest waits for its own window
+
+
+def test_slow_batch_does_not_hold_up_the_next():
+    release = threading.Event()
+
+    def embed(texts):
+        if texts == ["slow"]:
+            release.wait(5)  # e.g. retrying with backoff
+        return [float(len(t)) for t in texts]
+
+    batcher = EmbeddingBatcher(embed, window_ms=1, max_inputs=8, concurrency=2)
+    slow = batcher.submit(["slow"])
+    while batcher.batches < 1:
+        time.sleep(0.001)
+    assert batcher.submit(["fast"]).result(2) == [4.0]
+    assert not slow.done()
+    release.set()
+    assert slow.result(5) == [4.0]
+
+
+def test_errors_reach_every_caller_in_the_batch():
+    batcher = EmbeddingBatcher(_recording_embed([], fail=True), window_ms=50, max_inputs=8)
+    futures = [batcher.submit(["x"]), batcher.submit(["y"])]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(5)
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram((1, 10))
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+    assert histogram.snapshot() == {"buckets": {"1": 2, "10": 3, "+Inf": 4}, "count": 4, "sum": 56.5}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    def create(model, input):
+        calls.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t))] * 4) for t in input])
+
+    monkeypatch.setattr(rag_service, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(openai_client, "create_embeddings", create)
+    monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache())
+    monkeypatch.setattr(rag_service, "embedding_batcher", EmbeddingBatcher(
+        rag_service._create_embeddings, window_ms=100, max_inputs=4,
+    ))
+    return calls
+
+
+def test_embed_text_batches_concurrent_queries(upstream):
+    start = threading.Barrier(3)
+
+    def embed(query):
+        start.wait()
+        return rag_service.embed_text([query])[0][0]
+
+    with ThreadPoolExecutor(3) as pool:
+        assert list(pool.map(embed, ["q", "qq", "qqq"])) == [1.0, 2.0, 3.0]
+    assert sorted(map(len, upstream[0])) == [1, 2, 3] and len(upstream) == 1
+
+    rag_service.embed_text([f"doc {i}" for i in range(4)])  # bulk requests go direct
+    assert len(upstream) == 2 and rag_service.embedding_batcher.stats()["requests"] == 3
+
+
+def test_embed_text_async_uses_the_batcher(upstream):
+    async def main():
+        return await asyncio.gather(*(rag_service.embed_text_async([q]) for q in ("a", "bb")))
+
+    results = asyncio.run(main())
+    assert [r[0][0] for r in results] == [1.0, 2.0]
+    assert sorted(upstream[0]) == ["a", "bb"] and len(upstream) == 1
+
+
+def test_stats_endpoint():
+    assert client.get("/embedding_batcher").status_code == 401
+    stats = client.get("/embedding_batcher", headers={"x-api-key": "my-secret-key"}).json
+    assert {"queue_ms", "batch_size", "window_ms", "max_inputs"} <= set(stats)
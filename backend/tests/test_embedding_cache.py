@@ -0,0 +1,91 @@
+import sqlite3
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app import openai_client, rag_service
+from app.embedding_cache import EmbeddingCache, cache_key
+
+
+def _vec(value, dim=4):
+    return np.full((dim,), value, dtype=np.float32)
+
+
+def test_memory_tier_hits_and_lru_eviction():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put_many(["a", "b", "c"], [_vec(1), _vec(2), _vec(3)])
+
+    found = cache.get_many(["a", "b", "c"])
+    assert found[0] is None  # evicted, oldest
+    assert found[2][0] == 3
+    assert cache.stats()["hits_memory"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_tier_survives_new_instance(tmp_path):
+    path = str(tmp_path / "emb.sqlite")
+    EmbeddingCache(path=path).put_many(["k"], [_vec(7)])
+
+    cache = EmbeddingCache(path=path)
+    assert cache.get_many(["k"])[0][0] == 7
+    assert cache.stats()["hits_disk"] == 1
+
+
+def test_disk_tier_size_eviction(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "emb.sqlite"), max_bytes=16 * 10)
+    cache.put_many([f"k{i}" for i in range(20)], [_vec(i) for i in range(20)])
+    assert cache.stats()["disk_bytes"] <= 16 * 10
+    assert cache.stats()["evictions"] > 0
+
+
+def test_failed_disk_write_is_rolled_back(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "emb.sqlite"))
+    with pytest.raises(sqlite3.Error):
+        cache.put_many(["good", ("not", "bindable")], [_vec(1), _vec(2)])
+    assert cache.stats()["disk_bytes"] == 0
+    cache.put_many(["next"], [_vec(3)])  # the connection is not left inside the failed transaction
+    assert EmbeddingCache(path=str(tmp_path / "emb.sqlite")).get_many(["good", "next"])[1][0] == 3
+    assert EmbeddingCache(path=str(tmp_path / "emb.sqlite")).get_many(["good"]) == [None]
+
+
+def test_embed_text_only_sends_misses(monkeypatch):
+    sent = []
+
+    def create(model, input):
+        sent.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t))] * 4) for t in input])
+
+    monkeypatch.setattr(rag_service, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(openai_client, "create_embeddings", create)
+    monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache())
+    rag_service.embedding_cache.put_many(
+        [cache_key(rag_service.EMBEDDING_MODEL, "cached")], [_vec(42)]
+    )
+
+    result = rag_service.embed_text(["x", "cached", "yy", "x"])
+
+    assert sent == [["x", "yy"]]
+    assert [v[0] for v in result] == [1.0, 42.0, 2.0, 1.0]
+
+
+def test_shortened_embeddings_request_dimensions(monkeypatch):
+    sent = []
+
+    def create(model, input, dimensions=None):
+        sent.append(dimensions)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0] * 256) for _ in input])
+
+    monkeypatch.setattr(rag_service, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(openai_client, "create_embeddings", create)
+    monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache())
+    monkeypatch.setattr("app.config.Config.EMBEDDING_DIMENSIONS", 256)
+    monkeypatch.setattr(rag_service, "embedding_dim", 256)
+    rag_service.embedding_cache.put_many(
+        [cache_key(rag_service.EMBEDDING_MODEL, "cached")], [_vec(42)]  # a full-size entry
+    )
+
+    result = rag_service.embed_text(["cached"])
+
+    assert sent == [256]
+    assert len(result[0]) == 256
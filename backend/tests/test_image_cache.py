@@ -0,0 +1,178 @@
+import base64
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from app import memory_service, openai_client, openai_service, rag_service, serving
+from app.image_cache import ImageCache, image_id, iter_base64
+from tests.test_routes import client
+
+HEADERS = {"x-api-key": "my-secret-key"}
+PNG_B64 = openai_service._TEST_PNG_B64
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = ImageCache(str(tmp_path / "images"))
+    monkeypatch.setattr(openai_service, "image_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    prompts = []
+
+    def generate(model, prompt, size=None):
+        prompts.append((prompt, size))
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=PNG_B64)])
+
+    monkeypatch.setattr(openai_service, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(openai_client, "generate_image", generate)
+    return prompts
+
+
+def test_put_and_stream_base64_in_slices(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    data = os.urandom(10_000)
+    key = image_id("m", "p")
+    with cache.put_base64(key, base64.b64encode(data).decode()) as f:
+        assert f.read() == data
+    with cache.open(key) as f:
+        assert f.read() == data
+    assert cache.open(image_id("m", "p", "1024x1024")) is None
+    assert cache.open("../../etc/passwd") is None
+    chunks = list(iter_base64(cache.open(key), chunk_size=3 * 100))
+    assert len(chunks) > 1 and "".join(chunks) == base64.b64encode(data).decode()
+
+
+def _put(cache, key, size=1000):
+    cache.put_base64(key, base64.b64encode(b"x" * size).decode()).close()
+
+
+def _cached(cache, key):
+    f = cache.open(key)
+    if f is not None:
+        f.close()
+    return f is not None
+
+
+def test_evicts_least_recently_served(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=2500, touch_seconds=0)
+    keys = [image_id("m", str(i)) for i in range(3)]
+    for key in keys[:2]:
+        _put(cache, key)
+    assert _cached(cache, keys[0])  # served again, so keys[1] is now the oldest
+    _put(cache, keys[2])
+    assert not _cached(cache, keys[1])
+    assert _cached(cache, keys[0]) and _cached(cache, keys[2])
+    assert cache.stats()["bytes"] == 2000
+
+
+def test_hits_refresh_the_index_at_most_every_touch_seconds(tmp_path):
+    cache = ImageCache(str(tmp_path), touch_seconds=3600)
+    key = image_id("m", "popular")
+    _put(cache, key)
+    writes = cache._db.total_changes
+    assert all(_cached(cache, key) for _ in range(20))
+    assert cache._db.total_changes == writes
+
+    cache.touch_seconds = 0
+    assert _cached(cache, key)
+    assert cache._db.total_changes == writes + 1
+
+
+def test_workers_share_the_size_cap(tmp_path):
+    workers = [ImageCache(str(tmp_path), max_bytes=2500) for _ in range(2)]
+    for i in range(6):
+        _put(workers[i % 2], image_id("m", str(i)))
+    assert sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(tmp_path) for name in names if name.endswith(".png")) == 2000
+    assert workers[0].stats()["bytes"] == workers[1].stats()["bytes"] == 2000
+
+
+def test_open_image_survives_eviction(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=1500)
+    key = image_id("m", "served")
+    _put(cache, key)
+    f = cache.open(key)
+    _put(ImageCache(str(tmp_path), max_bytes=1500), image_id("m", "newer"))  # another worker evicts it
+    assert not os.path.exists(cache.path(key))
+    assert "".join(iter_base64(f)) == base64.b64encode(b"x" * 1000).decode()
+
+
+def test_indexes_images_already_on_disk(tmp_path):
+    key = image_id("m", "old")
+    os.makedirs(tmp_path / key[:2])
+    (tmp_path / key[:2] / f"{key}.png").write_bytes(b"x" * 1000)
+    cache = ImageCache(str(tmp_path), max_bytes=1500)
+    assert cache.stats()["bytes"] == 1000
+    _put(cache, image_id("m", "new"))
+    assert not _cached(cache, key)
+
+
+def test_worker_reconnects_the_index_after_fork(cache, monkeypatch):
+    monkeypatch.setattr(rag_service.embedding_cache, "reopen", lambda: None)
+    monkeypatch.setattr(memory_service, "reopen_store", lambda: None)
+    inherited = cache._db
+    serving.after_fork()
+    assert cache._db is not inherited
+    _put(cache, image_id("m", "after fork"))
+    assert _cached(cache, image_id("m", "after fork"))
+
+
+def test_repeated_prompt_is_generated_once(cache, upstream):
+    headers = {**HEADERS, "response-type": "image"}
+    first = client.post("/generateImage", json={"content": "A red elephant"}, headers=headers)
+    second = client.post("/generateImage", json={"content": "A red elephant"}, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data == base64.b64decode(PNG_B64)
+    assert first.headers["ETag"] == second.headers["ETag"]
+    client.post("/generateImage", json={"content": "A red elephant", "size": "1024x1536"}, headers=headers)
+    assert upstream == [("A red elephant", None), ("A red elephant", "1024x1536")]
+
+    response = client.post("/generateImage", json={"content": "A red elephant"},
+                           headers={**HEADERS, "response-type": "base64"})
+    assert response.is_streamed
+    assert response.get_json() == {"base64": PNG_B64, "version": "0.1.0"}
+
+    bad = client.post("/generateImage", json={"content": "x", "size": "13x13"}, headers=headers)
+    assert bad.status_code == 400
+
+
+def test_cached_image_supports_etag_and_range(cache):
+    created = client.post("/generateImage", json={"content": "A blue whale"},
+                          headers={**HEADERS, "response-type": "image"})
+    url = created.headers["Content-Location"]
+    etag = created.headers["ETag"]
+
+    assert client.get(url).status_code == 401
+    full = client.get(url, headers=HEADERS)
+    assert full.status_code == 200 and full.data.startswith(b"\x89PNG")
+    assert client.get(url, headers={**HEADERS, "If-None-Match": etag}).status_code == 304
+    partial = client.get(url, headers={**HEADERS, "Range": "bytes=0-3"})
+    assert partial.status_code == 206 and partial.data == b"\x89PNG"
+    assert client.get(url, headers={**HEADERS, "response-type": "base64"}).get_json()["base64"] == PNG_B64
+    assert client.get("/images/" + "0" * 64, headers=HEADERS).status_code == 404
+
+
+def test_batch_endpoint(cache, upstream):
+    prompts = ["a cat", "a dog", "a cat"]
+    response = client.post("/generateImage/batch", json={"prompts": prompts}, headers=HEADERS)
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1, 2]
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[0]["id"] == by_index[2]["id"] != by_index[1]["id"]
+    assert client.get(by_index[1]["url"], headers=HEADERS).status_code == 200
+    assert sorted(set(upstream)) == [("a cat", None), ("a dog", None)]
+
+    too_many = {"prompts": ["x"] * 100}
+    assert client.post("/generateImage/batch", json=too_many, headers=HEADERS).status_code == 413
+
+
+def test_batch_endpoint_without_cache():
+    response = client.post("/generateImage/batch", json={"prompts": ["a cat"]}, headers=HEADERS)
+    assert [json.loads(line) for line in response.data.decode().splitlines()] == [
+        {"index": 0, "prompt": "a cat", "base64": PNG_B64},
+    ]
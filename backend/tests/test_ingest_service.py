@@ -0,0 +1,107 @@
+import io
+import time
+
+from app import ingest_service, rag_service
+from app.tokens import count_tokens
+from tests.test_routes import client
+
+HEADERS = {"x-api-key": "my-secret-key"}
+
+
+def test_chunk_text_respects_budget():
+    text = " ".join(f"word{i}" for i in range(2000))
+    chunks = ingest_service.chunk_text(text, max_tokens=100)
+    assert len(chunks) > 1
+    assert all(count_tokens(c) <= 110 for c in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_iter_batches_packs_by_inputs_and_tokens():
+    batches = list(ingest_service.iter_batches(["a"] * 10, max_tokens=1000, max_inputs=4))
+    assert [len(b) for b in batches] == [4, 4, 2]
+
+    batches = list(ingest_service.iter_batches(["x" * 40] * 10, max_tokens=25, max_inputs=100))
+    assert all(len(b) == 2 for b in batches)
+
+
+def test_failed_batch_does_not_lose_others(monkeypatch):
+    embed_text = rag_service.embed_text
+
+    def flaky(batch):
+        if "bad" in batch:
+            raise RuntimeError("upstream down")
+        return embed_text(batch)
+
+    monkeypatch.setattr(rag_service, "embed_text", flaky)
+    monkeypatch.setattr(ingest_service.Config, "INGEST_BATCH_INPUTS", 1)
+    before = rag_service.get_store().ntotal
+
+    job = ingest_service.ingest(["good one", "bad", "good two"])
+
+    assert job.status == "completed_with_errors"
+    assert job.chunks_stored == 2 and job.chunks_failed == 1
+    assert rag_service.get_store().ntotal == before + 2
+
+
+def test_failed_batch_is_not_retried_on_top_of_the_client(monkeypatch):
+    calls = []
+
+    def failing(batch):
+        calls.append(batch)
+        raise RuntimeError("retries exhausted")
+
+    monkeypatch.setattr(rag_service, "embed_text", failing)
+    job = ingest_service.ingest(["never stored, attempt counting"])
+    assert job.chunks_failed == 1 and len(calls) == 1
+
+
+def test_finished_jobs_are_pruned(monkeypatch):
+    old = ingest_service.start_job([])
+    for _ in range(100):
+        if old.finished_at:
+            break
+        time.sleep(0.01)
+    monkeypatch.setattr(ingest_service.Config, "INGEST_JOB_TTL", 0)
+    new = ingest_service.start_job([])
+    assert ingest_service.get_job(old.id) is None
+    assert ingest_service.get_job(new.id) is new
+
+
+def _wait_for(job_id):
+    for _ in range(100):
+        body = client.get(f"/ingest/{job_id}", headers=HEADERS).get_json()
+        if body["status"] not in ("queued", "running"):
+            return body
+        time.sleep(0.02)
+    raise AssertionError("ingest job did not finish")
+
+
+def test_ingest_ndjson_stream():
+    body = '"Lebanon is a country."\n{"text": "Beirut is its capital."}\n\n'
+    response = client.post("/ingest", data=body, headers={**HEADERS, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 202
+
+    status = _wait_for(response.get_json()["job_id"])
+    assert status["status"] == "completed"
+    assert status["documents"] == 2
+
+
+def test_ingest_file_upload():
+    data = {"file": (io.BytesIO(b"First doc.\n\nSecond doc.\n"), "corpus.txt")}
+    response = client.post("/ingest", data=data, headers=HEADERS, content_type="multipart/form-data")
+    assert response.status_code == 202
+    assert _wait_for(response.get_json()["job_id"])["documents"] == 2
+
+
+def test_ingest_upload_without_filename_is_rejected():
+    unnamed = {"file": (io.BytesIO(b"Unnamed doc.\n"),)}
+    response = client.post("/ingest", data=unnamed, headers=HEADERS, content_type="multipart/form-data")
+    assert response.status_code == 400
+    empty = b'--B\r\nContent-Disposition: form-data; name="file"; filename=""\r\n\r\nUnnamed doc.\r\n--B--\r\n'
+    response = client.post("/ingest", data=empty, headers=HEADERS, content_type="multipart/form-data; boundary=B")
+    assert response.status_code == 400
+
+
+def test_ingest_status_unknown_job():
+    response = client.get("/ingest/nope", headers=HEADERS)
+    assert response.status_code == 404
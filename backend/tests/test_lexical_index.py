@@ -0,0 +1,90 @@
+import time
+
+import numpy as np
+import pytest
+
+from app import rag_service
+from app.lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+from app.vector_store import VectorStore
+from tests.test_routes import client
+
+
+def _index(texts):
+    index = BM25Index()
+    index.add(BM25Index.analyze(texts))
+    return index
+
+
+def test_tokenize_keeps_identifiers():
+    tokens = tokenize("Error ERR_CONN_RESET on SKU AB-1234, see v2.3.1")
+    assert {"err_conn_reset", "ab-1234", "ab", "1234", "v2.3.1"} <= set(tokens)
+
+
+def test_bm25_ranks_and_excludes():
+    index = _index([
+        "the cat sat on the mat",
+        "the dog chased the cat around the cat tree",
+        "order AB-1234 shipped",
+        "nothing relevant here",
+    ])
+    assert [row for row, _ in index.search("cat", 2)] == [1, 0]
+    assert index.search("ab-1234", 3)[0][0] == 2
+    assert index.search("1234", 3)[0][0] == 2
+    assert [row for row, _ in index.search("cat", 5, exclude={1})] == [0]
+    assert index.search("zebra", 3) == []
+
+
+def test_postings_grow_incrementally():
+    index = BM25Index()
+    for i in range(100):
+        index.add(BM25Index.analyze([f"common token{i}"]))
+    assert len(index) == 100
+    assert len(index.search("common", 1000)) == 100
+    assert index.search("token57", 1)[0][0] == 57
+
+
+def test_reciprocal_rank_fusion():
+    a = [{"id": "x", "text": "x"}, {"id": "y", "text": "y"}]
+    b = [{"id": "y", "text": "y"}, {"id": "z", "text": "z"}]
+    fused = reciprocal_rank_fusion([a, b], top_k=3, k=60)
+    assert [h["id"] for h in fused] == ["y", "x", "z"]
+    assert fused[0]["score"] == pytest.approx(1 / 62 + 1 / 61)
+
+
+def test_hybrid_finds_exact_identifiers():
+    store = VectorStore("hybrid", 4)
+    texts = ["Reset the router", "Order SKU-9931 was delayed", "Router lights explained"]
+    # the dense vectors put the SKU document farthest from the query
+    store.add(texts, [np.array([1, 0, 0, 0.1 * i], dtype=np.float32) for i in range(3)])
+    query = np.array([1, 0, 0, 0], dtype=np.float32)
+    assert store.search(query, 1)[0]["text"] == "Reset the router"
+    fused = rag_service._fuse(store.search(query, 3), store.search_lexical("where is sku-9931", 3), 1)
+    assert fused[0]["text"] == "Order SKU-9931 was delayed"
+
+
+def test_lexical_mode_skips_embeddings(monkeypatch):
+    rag_service.add_documents(["Invoice INV-2024-007 is overdue."], collection="lexical")
+
+    def no_embeddings(texts):
+        raise AssertionError("lexical mode must not embed")
+
+    monkeypatch.setattr(rag_service, "embed_text", no_embeddings)
+    start = time.perf_counter()
+    hits = rag_service.retrieve_context("INV-2024-007", mode="lexical", collection="lexical")
+    assert time.perf_counter() - start < 0.05
+    assert hits[0]["text"] == "Invoice INV-2024-007 is overdue."
+
+
+def test_lexical_index_follows_deletes_and_compaction():
+    store = VectorStore("lex-crud", 4)
+    store.upsert(["a", "b"], ["alpha beta", "beta gamma"], [np.ones(4, dtype=np.float32)] * 2)
+    store.delete(["a"])
+    assert [h["id"] for h in store.search_lexical("beta", 5)] == ["b"]
+    store.compact()
+    assert [h["id"] for h in store.search_lexical("beta", 5)] == ["b"]
+    assert store.search_lexical("alpha", 5) == []
+
+
+def test_ask_rag_rejects_unknown_mode():
+    response = client.post("/ask_rag", json={"query": "x", "mode": "fuzzy"})
+    assert response.status_code == 400
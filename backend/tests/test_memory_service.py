@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from app.memory_service import InMemorySessionStore, SQLiteSessionStore
+
+
+def _msg(i):
+    return {"role": "user", "content": f"message {i}"}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(max_messages=3, idle_ttl=3600, max_sessions=100, max_bytes=1 << 20):
+        if request.param == "memory":
+            return InMemorySessionStore(max_messages, idle_ttl, max_sessions, max_bytes)
+        store = SQLiteSessionStore(str(tmp_path / "mem.sqlite"), max_messages, idle_ttl, max_sessions, max_bytes)
+        store._appends = 99  # evict on the next append
+        return store
+    return make
+
+
+def test_ring_buffer_keeps_newest(make_store):
+    store = make_store(max_messages=3)
+    for i in range(5):
+        store.append("s", _msg(i))
+    assert store.recent("s", 10) == [_msg(2), _msg(3), _msg(4)]
+    assert store.recent("s", 2) == [_msg(3), _msg(4)]
+
+
+def test_idle_sessions_expire(make_store):
+    store = make_store(idle_ttl=0.01)
+    store.append("s", _msg(0))
+    time.sleep(0.02)
+    assert store.recent("s", 5) == []
+
+
+def test_expired_history_does_not_come_back(make_store):
+    store = make_store(idle_ttl=0.05)
+    store.append("s", _msg("old secret"))
+    store.set_summary("s", "old summary")
+    time.sleep(0.1)
+    store.append("s", _msg("new"))
+    assert store.recent("s", 5) == [_msg("new")]
+    assert store.get_summary("s") == ""
+
+    time.sleep(0.1)
+    store.set_summary("s", "fresh")
+    assert (store.recent("s", 5), store.get_summary("s")) == ([], "fresh")
+
+
+def test_lru_eviction_over_session_limit(make_store):
+    store = make_store(max_sessions=2)
+    store.append("a", _msg(0))
+    store.append("b", _msg(0))
+    store.recent("a", 1)  # touch a, so b is least recently used
+    if isinstance(store, SQLiteSessionStore):
+        store._appends = 99
+    store.append("c", _msg(0))
+    assert store.recent("b", 1) == []
+    assert store.recent("a", 1) == [_msg(0)]
+    assert store.stats()["sessions"] <= 2
+
+
+def test_memory_accounting_and_clear():
+    store = InMemorySessionStore(max_messages=2, idle_ttl=3600, max_sessions=10, max_bytes=1 << 20)
+    for i in range(10):
+        store.append("s", _msg(i))
+    two_messages = store.stats()["bytes"]
+    store.append("t", _msg(0))
+    store.clear("s")
+    assert store.stats()["bytes"] == two_messages / 2
+
+
+def test_sqlite_sessions_shared_between_instances(tmp_path):
+    path = str(tmp_path / "mem.sqlite")
+    SQLiteSessionStore(path, 5, 3600, 100, 1 << 20).append("s", _msg(1))
+    assert SQLiteSessionStore(path, 5, 3600, 100, 1 << 20).recent("s", 5) == [_msg(1)]
@@ -0,0 +1,177 @@
+import numpy as np
+import pytest
+
+from app import rag_service
+from app.metadata import MetadataTable, validate_filter
+from app.vector_store import VectorStore
+from tests.test_routes import client
+
+DIM = 8
+
+ROWS = [
+    {"tenant": "acme", "source": "wiki", "year": 2021},
+    {"tenant": "acme", "source": "faq", "year": 2023, "public": True},
+    {"tenant": "globex", "source": "wiki", "year": 2019},
+    None,
+    {"tenant": "globex", "date": "2024-03-01", "public": False},
+]
+
+
+def _rows(table, where):
+    return np.flatnonzero(np.unpackbits(table.evaluate(where), bitorder="little")[: table.n]).tolist()
+
+
+@pytest.fixture(params=[(), ("tenant", "source")], ids=["scan", "bitmap"])
+def table(request):
+    table = MetadataTable(request.param)
+    table.append(ROWS)
+    return table
+
+
+@pytest.mark.parametrize("where, rows", [
+    ({"tenant": "acme"}, [0, 1]),
+    ({"source": {"$in": ["faq", "blog"]}}, [1]),
+    ({"tenant": {"$ne": "acme"}}, [2, 3, 4]),
+    ({"source": {"$nin": ["wiki"]}}, [1, 3, 4]),
+    ({"year": {"$gte": 2020, "$lt": 2024}}, [0, 1]),
+    ({"date": {"$gt": "2024-01-01"}}, [4]),
+    ({"public": True}, [1]),
+    ({"public": "true"}, []),
+    ({"$or": [{"year": 2019}, {"public": False}]}, [2, 4]),
+    ({"$not": {"tenant": "acme"}, "source": "wiki"}, [2]),
+    ({"unknown": "x"}, []),
+])
+def test_evaluate(table, where, rows):
+    assert _rows(table, where) == rows
+
+
+def test_type_mismatch_and_invalid_filters():
+    table = MetadataTable()
+    table.append(ROWS)
+    with pytest.raises(ValueError):
+        table.check([{"year": "last year"}])
+    with pytest.raises(ValueError):
+        table.check([{"nested": {"a": 1}}])
+    with pytest.raises(ValueError):  # a new field takes its first value's type
+        table.check([{"edition": 2}, {"edition": "second"}])
+    for where in ([], {"$xor": []}, {"a": {"$regex": "x"}}, {"a": {"$in": "x"}}, {"$or": []}):
+        with pytest.raises(ValueError):
+            validate_filter(where)
+
+
+def test_take_write_read_roundtrip(tmp_path):
+    table = MetadataTable(("tenant",))
+    table.append(ROWS)
+    compacted = table.take([4, 0, 2])
+    assert [compacted.row(r) for r in range(3)] == [ROWS[4], ROWS[0], ROWS[2]]
+    assert _rows(compacted, {"tenant": "globex"}) == [0, 2]
+
+    compacted.write(str(tmp_path))
+    loaded = MetadataTable.read(str(tmp_path), ("tenant",))
+    assert loaded.fields == compacted.fields
+    assert [loaded.row(r) for r in range(3)] == [ROWS[4], ROWS[0], ROWS[2]]
+    assert _rows(loaded, {"tenant": "globex"}) == [0, 2]
+    assert MetadataTable.read(str(tmp_path / "missing")) is None
+
+
+def _vec(k):
+    v = np.zeros(DIM, dtype=np.float32)
+    v[k % DIM] = 1.0
+    v[(k + 3) % DIM] = 0.01 * k
+    return v
+
+
+def _store(n, monkeypatch, exact_max):
+    monkeypatch.setattr("app.config.Config.RAG_FILTER_EXACT_MAX", exact_max)
+    store = VectorStore("filtered", DIM)
+    store.upsert(
+        [f"d{k}" for k in range(n)], [f"doc {k}" for k in range(n)], [_vec(k) for k in range(n)],
+        metadatas=[{"tenant": "acme" if k % 3 == 0 else "globex", "k": k} for k in range(n)],
+    )
+    return store
+
+
+@pytest.mark.parametrize("exact_max", [0, 10_000], ids=["faiss-selector", "exact"])
+def test_filtered_search_only_returns_matches(monkeypatch, exact_max):
+    store = _store(60, monkeypatch, exact_max)
+    store.delete(["d0"])
+    hits = store.search(_vec(1), 10, where={"tenant": "acme"})
+    assert len(hits) == 10
+    assert all(h["metadata"]["tenant"] == "acme" for h in hits)
+    assert "d0" not in [h["id"] for h in hits]
+    assert hits[0]["id"] == "d9"  # same axis as doc 1, nearest among acme rows
+    assert hits == sorted(hits, key=lambda h: -h["score"])
+
+    batched = store.search_batch(np.vstack([_vec(1), _vec(2)]), 3, where={"k": {"$lt": 10}})
+    assert [h["id"] for h in batched[0]][0] == "d1"
+    assert all(h["metadata"]["k"] < 10 for hits in batched for h in hits)
+    assert store.search(_vec(1), 5, where={"tenant": "initech"}) == []
+
+
+def test_filtered_search_matches_unfiltered_ranking(monkeypatch):
+    exact = _store(60, monkeypatch, 10_000).search(_vec(4), 5, where={"tenant": "globex"})
+    selected = _store(60, monkeypatch, 0).search(_vec(4), 5, where={"tenant": "globex"})
+    assert [h["id"] for h in exact] == [h["id"] for h in selected]
+    for a, b in zip(exact, selected):
+        assert a["score"] == pytest.approx(b["score"], abs=1e-4)
+
+
+def test_metadata_updates_and_survives_compaction(tmp_path):
+    store = VectorStore("meta-crud", DIM, str(tmp_path))
+    store.upsert(["a", "b"], ["doc a", "doc b"], [_vec(1), _vec(2)], metadatas=[{"tenant": "acme"}, None])
+    assert store.upsert(["a"], ["doc a"], [_vec(1)], metadatas=[{"tenant": "acme"}])["unchanged"] == 1
+    assert store.upsert(["a"], ["doc a"], [_vec(1)], metadatas=[{"tenant": "globex"}])["updated"] == 1
+    assert store.metadata("a") == {"tenant": "globex"}
+    with pytest.raises(ValueError):
+        store.upsert(["c"], ["doc c"], [_vec(3)], metadatas=[{"tenant": 7}])
+    assert store.get("c") is None
+
+    store.compact()
+    reloaded = VectorStore("meta-crud", DIM, str(tmp_path))
+    assert reloaded.load() == 2
+    assert [h["id"] for h in reloaded.search(_vec(1), 5, where={"tenant": "globex"})] == ["a"]
+    assert reloaded.metadata("b") == {}
+
+
+def test_new_field_of_mixed_types_leaves_store_intact(tmp_path):
+    store = VectorStore("meta-mixed", DIM, str(tmp_path))
+    store.upsert(["a"], ["doc a"], [_vec(1)])
+    with pytest.raises(ValueError):
+        store.upsert(["b", "c"], ["doc b", "doc c"], [_vec(2), _vec(3)], metadatas=[{"year": 2020}, {"year": "abc"}])
+    assert len(store) == store._index.ntotal == 1
+    assert [h["id"] for h in store.search(_vec(3), 5)] == ["a"]
+
+
+def test_filter_through_routes():
+    headers = {"x-api-key": "my-secret-key"}
+    body = {"documents": [
+        {"id": "hr-1", "text": "Holidays are 25 days.", "metadata": {"team": "hr"}},
+        {"id": "it-1", "text": "Reset your password in the portal.", "metadata": {"team": "it"}},
+    ], "collection": "meta-api"}
+    assert client.post("/documents", json=body, headers=headers).status_code == 200
+    response = client.post("/documents/search", json={
+        "query": "days", "top_k": 5, "collection": "meta-api", "filter": {"team": "it"},
+    }, headers=headers)
+    assert [h["id"] for h in response.json["results"]] == ["it-1"]
+    assert response.json["results"][0]["metadata"] == {"team": "it"}
+    assert client.get("/documents/hr-1?collection=meta-api", headers=headers).json["metadata"] == {"team": "hr"}
+
+    bad = client.post("/documents/search", json={"query": "x", "filter": {"team": {"$regex": "i"}}}, headers=headers)
+    assert bad.status_code == 400
+    bad = client.post("/documents", json={"documents": [{"text": "x", "metadata": {"team": ["a"]}}]},
+                      headers=headers)
+    assert bad.status_code == 400
+    bad = client.post("/upload_docs", json={"texts": ["x", "y"], "metadata": [{"a": 1}]})
+    assert bad.status_code == 400
+
+
+def test_upload_docs_metadata_and_lexical_filter():
+    response = client.post("/upload_docs", json={
+        "texts": ["Parking pass AB-1 for acme.", "Parking pass AB-2 for globex."],
+        "metadata": [{"tenant": "acme"}, {"tenant": "globex"}],
+        "collection": "meta-upload",
+    })
+    assert response.status_code == 200
+    hits = rag_service.retrieve_context("parking pass", top_k=5, collection="meta-upload",
+                                        mode="lexical", where={"tenant": "globex"})
+    assert [h["text"] for h in hits] == ["Parking pass AB-2 for globex."]
@@ -0,0 +1,121 @@
+import re
+from types import SimpleNamespace
+
+from app import metrics, openai_client, openai_service, rag_service
+from app.config import Config
+from app.metrics import Registry, server_timing, stage
+from tests import test_asgi
+from tests.test_routes import client
+
+HEADERS = {"x-api-key": "my-secret-key"}
+
+
+def _sample(text, name, **labels):
+    """Value of one sample in a Prometheus text exposition, or None."""
+    label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    pattern = "^" + re.escape(name + (f"{{{label_text}}}" if labels else "")) + r" (\S+)$"
+    match = re.search(pattern, text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("path",))
+    requests.inc(path='/a"b')
+    requests.inc(2, path='/a"b')
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(5)
+    registry.register("queue_depth", "Depth.", lambda: {("x",): 3, ("y",): None}, labels=("queue",))
+    registry.register("broken", "Raises.", lambda: 1 / 0)
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{path="/a\\"b"} 3' in text
+    assert _sample(text, "latency_seconds_bucket", le="0.1") == 1
+    assert _sample(text, "latency_seconds_bucket", le="+Inf") == 2
+    assert _sample(text, "latency_seconds_count") == 2
+    assert _sample(text, "queue_depth", queue="x") == 3
+    assert 'queue="y"' not in text and "broken" not in text
+
+
+def test_stages_feed_histogram_and_request_timings():
+    before = metrics.stage_seconds.snapshot(stage="unit_test")["count"]
+    metrics.start_request()
+    with stage("unit_test"):
+        pass
+    with stage("unit_test"):
+        pass
+    assert metrics.stage_seconds.snapshot(stage="unit_test")["count"] == before + 2
+    assert [name for name, _ in metrics.request_timings()] == ["unit_test", "unit_test"]
+    assert server_timing([("a", 0.001), ("b", 0.002), ("a", 0.003)], total=0.01) == \
+        "a;dur=4.0, b;dur=2.0, total;dur=10.0"
+
+
+def test_metrics_endpoint_reports_stages_and_gauges():
+    client.post("/upload_docs", json={"texts": ["Paris is the capital of France."], "collection": "metrics"})
+    client.post("/chat_rag_memory", json={"session_id": "m1", "query": "Capital?", "collection": "metrics"},
+                headers=HEADERS)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    for name in ("embed", "search", "memory_read", "memory_write"):
+        assert _sample(text, "stage_duration_seconds_count", stage=name) >= 1
+    assert _sample(text, "rag_documents", collection="metrics") == 1
+    assert _sample(text, "process_resident_memory_bytes") > 0
+    assert _sample(text, "http_request_duration_seconds_count",
+                   endpoint="/chat_rag_memory", method="POST", status="200") >= 1
+
+
+def test_metrics_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", False)
+    assert client.get("/metrics").status_code == 404
+
+
+def test_server_timing_header(monkeypatch):
+    assert "Server-Timing" not in client.post("/chat", json={"content": "no timing"}, headers=HEADERS).headers
+
+    monkeypatch.setattr(Config, "SERVER_TIMING_ENABLED", True)
+    body = {"session_id": "m2", "query": "Capital?", "collection": "metrics"}
+    response = client.post("/chat_rag_memory", json=body, headers=HEADERS)
+    names = [part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")]
+    assert {"embed", "search", "memory_read", "memory_write", "total"} <= set(names)
+
+    _, headers, _ = test_asgi.call("POST", "/chat_rag_memory", body, HEADERS)
+    assert b"search;dur=" in headers[b"server-timing"]
+
+
+def test_token_usage_is_counted(monkeypatch):
+    usage = SimpleNamespace(prompt_tokens=12, completion_tokens=5)
+    monkeypatch.setattr(openai_client, "call", lambda *args: SimpleNamespace(usage=usage))
+    before = metrics.tokens_total.value(model="usage-test", type="prompt")
+
+    openai_client.create_chat_completion(model="usage-test", messages=[{"role": "user", "content": "x"}])
+    assert metrics.tokens_total.value(model="usage-test", type="prompt") == before + 12
+    assert metrics.tokens_total.value(model="usage-test", type="completion") == 5
+
+
+def test_streamed_usage_is_counted(monkeypatch):
+    sent = {}
+
+    def create(timeout, **kwargs):
+        sent.update(kwargs)
+        delta = SimpleNamespace(delta=SimpleNamespace(content="Beirut"))
+        usage = SimpleNamespace(prompt_tokens=30, completion_tokens=2)
+        return iter([SimpleNamespace(choices=[delta], usage=None), SimpleNamespace(choices=[], usage=usage)])
+
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(openai_client, "call", lambda operation, fn, *args: fn(fake, 1))
+    monkeypatch.setattr(openai_service, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(rag_service, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(openai_service, "CHAT_MODEL", "stream-usage-test")
+    monkeypatch.setattr(rag_service, "retrieve_context", lambda query, **kwargs: [])
+    stages = metrics.stage_seconds.snapshot(stage="completion")["count"]
+
+    assert list(rag_service.stream_answer_query("capital of Lebanon?")) == ["Beirut"]
+    assert sent["stream"] and sent["stream_options"] == {"include_usage": True}
+    assert metrics.tokens_total.value(model="stream-usage-test", type="prompt") == 30
+    assert metrics.tokens_total.value(model="stream-usage-test", type="completion") == 2
+    assert metrics.stage_seconds.snapshot(stage="completion")["count"] == stages + 1
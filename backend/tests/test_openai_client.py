@@ -0,0 +1,119 @@
+import httpx
+import openai
+import pytest
+
+from app import openai_client
+from app.openai_client import CircuitBreaker, RetryBudget, UpstreamUnavailable
+from app.rate_limiter import InMemoryBuckets, RateLimited, RateLimiter
+from tests.test_routes import client
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _server_error():
+    return openai.InternalServerError("boom", response=httpx.Response(500, request=REQUEST), body=None)
+
+
+def _rate_limited(retry_after):
+    response = httpx.Response(429, request=REQUEST, headers={"retry-after": str(retry_after)})
+    return openai.RateLimitError("slow down", response=response, body=None)
+
+
+@pytest.fixture(autouse=True)
+def fresh_policy(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(openai_client, "_breakers", {})
+    monkeypatch.setattr(openai_client, "_budget", None)
+    monkeypatch.setattr(openai_client.time, "sleep", sleeps.append)
+    monkeypatch.setattr(openai_client, "get_client", lambda: None)
+    return sleeps
+
+
+def test_retries_then_succeeds(fresh_policy):
+    errors = [_server_error(), _rate_limited(2)]
+
+    def fn(client, timeout):
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert openai_client.call("chat", fn) == "ok"
+    assert len(fresh_policy) == 2
+    assert fresh_policy[1] == 2.0  # Retry-After honoured
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(openai_client.Config, "OPENAI_MAX_RETRIES", 2)
+    calls = []
+
+    def fn(client, timeout):
+        calls.append(timeout)
+        raise _server_error()
+
+    with pytest.raises(openai.InternalServerError):
+        openai_client.call("embeddings", fn)
+    assert len(calls) == 3
+    assert calls[0] == openai_client.Config.OPENAI_TIMEOUT_EMBEDDINGS
+
+
+def test_every_attempt_takes_upstream_budget(monkeypatch):
+    monkeypatch.setattr(openai_client.Config, "OPENAI_MAX_RETRIES", 2)
+    limiter = RateLimiter(InMemoryBuckets(), model_limits={"m": (2, 0)}, burst_seconds=60, max_wait=0)
+    monkeypatch.setattr(openai_client, "get_limiter", lambda: limiter)
+    calls = []
+
+    def fn(client, timeout):
+        calls.append(1)
+        if len(calls) < 3:
+            raise _server_error()
+        return "ok"
+
+    # room for two requests a minute: the first attempt and one retry, not a second retry
+    with pytest.raises(RateLimited):
+        openai_client.call("chat", fn, model="m", tokens=1)
+    assert len(calls) == 2
+
+
+def test_circuit_opens_and_fails_fast(monkeypatch):
+    monkeypatch.setattr(openai_client.Config, "OPENAI_MAX_RETRIES", 0)
+    monkeypatch.setattr(openai_client.Config, "OPENAI_BREAKER_THRESHOLD", 2)
+
+    def failing(client, timeout):
+        raise _server_error()
+
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            openai_client.call("images", failing)
+    with pytest.raises(UpstreamUnavailable):
+        openai_client.call("images", lambda c, t: "never called")
+    # other operations have their own breaker
+    assert openai_client.call("chat", lambda c, t: "ok") == "ok"
+
+
+def test_breaker_half_open_probe():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure()
+    breaker.before_call("chat")  # the single probe is let through
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call("chat")
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0.5, min_tokens=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_open_circuit_returns_503(monkeypatch):
+    def unavailable(prompt):
+        raise UpstreamUnavailable("chat", retry_after=7)
+
+    monkeypatch.setattr("app.routes.get_chat_response", unavailable)
+    response = client.post("/chat", json={"content": "Hi"}, headers={"x-api-key": "my-secret-key"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
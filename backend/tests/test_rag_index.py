@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from app import rag_index
+from app.vector_store import VectorStore
+
+
+def _vectors(n=500, dim=16, seed=0):
+    return np.random.default_rng(seed).random((n, dim), dtype=np.float32)
+
+
+@pytest.mark.parametrize("kind", rag_index.INDEX_KINDS)
+def test_build_and_search_each_kind(kind):
+    data = _vectors()
+    index = rag_index.build_index(kind, 16, data, pq_m=4)
+    assert index.ntotal == len(data)
+    assert rag_index.index_kind(index) == kind
+
+    params = rag_index.search_params(index, nprobe=8, ef_search=64)
+    _, ids = index.search(data[:5], 1, params=params)
+    if kind != "ivf_pq":  # PQ codes are lossy, the nearest hit may differ
+        assert list(ids[:, 0]) == [0, 1, 2, 3, 4]
+
+
+def test_unknown_kind_rejected():
+    with pytest.raises(ValueError):
+        rag_index.build_index("annoy", 16)
+
+
+def test_rebuild_keeps_vectors():
+    store = VectorStore("rebuild", 16)
+    store.add([f"doc {i}" for i in range(500)], _vectors())
+    store.rebuild("ivf_flat")
+    assert store.kind == "ivf_flat"
+    assert store.ntotal == 500
+    assert store.search(_vectors()[7], 1, nprobe=64)[0]["text"] == "doc 7"
+
+
+@pytest.mark.parametrize("kind", rag_index.INDEX_KINDS)
+@pytest.mark.parametrize("storage", rag_index.STORAGE_KINDS)
+def test_build_each_storage(kind, storage):
+    data = _vectors(n=1000)
+    index = rag_index.build_index(kind, 16, data, pq_m=4, storage=storage)
+    assert (rag_index.index_kind(index), rag_index.index_storage(index)) == rag_index.resolve(kind, storage)
+    assert index.ntotal == len(data)
+    if rag_index.index_storage(index) in ("fp16", "int8"):
+        assert np.abs(rag_index.all_vectors(index) - data).max() < 0.01
+
+
+def test_unknown_storage_rejected():
+    with pytest.raises(ValueError):
+        rag_index.build_index("flat", 16, storage="int4")
+    with pytest.raises(ValueError):
+        rag_index.build_index("flat", 16, storage="int8")  # nothing to train on
+
+
+def test_quantized_store_reranks_at_full_precision(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.config.Config.RAG_VECTOR_STORAGE", "pq")
+    monkeypatch.setattr("app.config.Config.RAG_PQ_M", 2)
+    data = _vectors(n=2000)
+    queries = _vectors(n=50, seed=1)
+    truth = [int(np.argmin(((data - q) ** 2).sum(axis=1))) for q in queries]
+    store = VectorStore("quantized", 16, str(tmp_path))
+    store.add([f"doc {i}" for i in range(len(data))], data)
+    assert (store.kind, store.storage) == ("flat", "fp32")  # pq needs training data first
+    store.rebuild("flat")
+    assert store.storage == "pq"
+
+    def recall():
+        return np.mean([store.search(q, 1)[0]["text"] == f"doc {t}" for q, t in zip(queries, truth)])
+
+    coarse = recall()
+    monkeypatch.setattr("app.config.Config.RAG_RERANK_FACTOR", 20)
+    assert recall() > coarse
+    hit = store.search(queries[3], 1)[0]
+    assert hit["text"] == f"doc {truth[3]}"
+    assert hit["score"] == pytest.approx(-float(((data[truth[3]] - queries[3]) ** 2).sum()), abs=1e-5)
+
+    # the full-precision copy is snapshotted, so a reload re-ranks the same way
+    reloaded = VectorStore("quantized", 16, str(tmp_path))
+    assert reloaded.load() == len(data)
+    assert reloaded.storage == "pq"
+    assert reloaded.search(queries[3], 1)[0]["score"] == hit["score"]
+
+    # and rebuilding back to fp32 restores the exact vectors rather than PQ reconstructions
+    reloaded.rebuild("flat", storage="fp32")
+    assert reloaded.search(data[11], 1)[0]["score"] == 0.0
@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+
+import faiss
+import numpy as np
+import pytest
+
+from app import rag_store
+
+
+def _index(n, dim=8):
+    index = faiss.IndexFlatL2(dim)
+    if n:
+        index.add(np.arange(n * dim, dtype=np.float32).reshape(n, dim))
+    return index
+
+
+def test_snapshot_roundtrip(tmp_path):
+    docs = ["Lebanon is a country.", "Beirut is its capital.", "héllo ✓"]
+    rag_store.save_snapshot(str(tmp_path), _index(3), docs)
+
+    index, table = rag_store.load_snapshot(str(tmp_path))
+    assert index.ntotal == 3
+    assert len(table) == 3
+    assert list(table) == docs
+    assert table[-1] == "héllo ✓"
+
+
+def test_snapshot_appends_to_loaded_table(tmp_path):
+    rag_store.save_snapshot(str(tmp_path), _index(1), ["first"])
+    index, table = rag_store.load_snapshot(str(tmp_path))
+    table.extend(["second", "third"])
+    index = rag_store.writable(index)  # the loaded index is a read-only mapping
+    index.add(np.ones((2, 8), dtype=np.float32))
+    rag_store.save_snapshot(str(tmp_path), index, table)
+
+    index, table = rag_store.load_snapshot(str(tmp_path))
+    assert index.ntotal == 3
+    assert list(table) == ["first", "second", "third"]
+    snaps = [d for d in os.listdir(tmp_path) if d.startswith("snap-")]
+    assert len(snaps) <= rag_store.KEEP_SNAPSHOTS
+
+
+def test_load_without_snapshot(tmp_path):
+    assert rag_store.load_snapshot(str(tmp_path)) is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc/self/status")
+def test_loaded_index_is_not_copied_onto_the_heap(tmp_path):
+    index = faiss.IndexFlatL2(64)
+    index.add(np.random.default_rng(0).random((200_000, 64), dtype=np.float32))  # ~51 MB
+    rag_store.save_snapshot(str(tmp_path), index, [""] * index.ntotal)
+    # in a fresh process, so the measurement only sees the load
+    code = (
+        "import sys; from app import rag_store\n"
+        "def anon():\n"
+        "    return next(int(l.split()[1]) for l in open('/proc/self/status') if l.startswith('RssAnon'))\n"
+        "before = anon(); index, _ = rag_store.load_snapshot(sys.argv[1]); index.search(index.reconstruct_n(0, 1), 1)\n"
+        "print((anon() - before) * 1024)"
+    )
+    out = subprocess.run([sys.executable, "-c", code, str(tmp_path)], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert int(out.stdout) < 5_000_000
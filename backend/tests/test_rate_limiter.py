@@ -0,0 +1,147 @@
+import asyncio
+import threading
+
+import pytest
+
+from app import openai_client, rate_limiter
+from app.rate_limiter import InMemoryBuckets, RateLimited, RateLimiter, SQLiteBuckets, parse_model_limits
+from tests.test_asgi import call as asgi_call
+from tests.test_routes import client
+
+HEADERS = {"x-api-key": "my-secret-key"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake wall clock; sleeping advances it."""
+    now = [1000.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    async def async_sleep(seconds):
+        sleep(seconds)
+
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: now[0])
+    monkeypatch.setattr(rate_limiter.time, "sleep", sleep)
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", async_sleep)
+    return now, sleeps
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def buckets(request, tmp_path):
+    return InMemoryBuckets() if request.param == "memory" else SQLiteBuckets(str(tmp_path / "limits.sqlite"))
+
+
+def test_bucket_refills_at_its_rate(clock, buckets):
+    now, _ = clock
+    demand = [("b", 1, 1.0, 3)]  # 1 token/s, burst of 3
+    assert [buckets.take(demand) for _ in range(4)] == [0, 0, 0, pytest.approx(1.0)]
+    now[0] += 2
+    assert [buckets.take(demand) for _ in range(3)] == [0, 0, pytest.approx(1.0)]
+
+
+def test_buckets_are_taken_all_or_nothing(clock, buckets):
+    assert buckets.take([("small", 1, 1.0, 1)]) == 0
+    # "small" is empty, so "big" must not be charged either
+    assert buckets.take([("big", 5, 1.0, 5), ("small", 1, 1.0, 1)]) == pytest.approx(1.0)
+    assert buckets.take([("big", 5, 1.0, 5)]) == 0
+
+
+def test_sqlite_buckets_are_shared_between_processes(clock, tmp_path):
+    path = str(tmp_path / "limits.sqlite")
+    first, second = SQLiteBuckets(path), SQLiteBuckets(path)  # e.g. two workers
+    assert first.take([("b", 2, 1.0, 2)]) == 0
+    assert second.take([("b", 1, 1.0, 2)]) == pytest.approx(1.0)
+
+
+def test_upstream_budget_queues(clock):
+    _, sleeps = clock
+    limiter = RateLimiter(InMemoryBuckets(), model_limits={"m": (60, 0)}, burst_seconds=1, max_wait=2)
+    limiter.acquire_upstream("m", 10)
+    limiter.acquire_upstream("m", 10)  # waits one second for the next token
+    assert sleeps == [pytest.approx(1.0)]
+    limiter.acquire_upstream("other-model", 10)  # no limit configured
+    assert len(sleeps) == 1
+
+
+def test_upstream_budget_sheds_beyond_max_wait(clock):
+    limiter = RateLimiter(InMemoryBuckets(), upstream_tpm=60, burst_seconds=10, max_wait=2)
+    asyncio.run(limiter.acquire_upstream_async("m", 10))
+    with pytest.raises(RateLimited) as e:
+        asyncio.run(limiter.acquire_upstream_async("m", 10))  # 10 tokens at 1/s
+    assert e.value.retry_after == 10
+
+
+def test_async_upstream_budget_takes_sqlite_buckets_off_the_loop(clock, tmp_path):
+    limiter = RateLimiter(SQLiteBuckets(str(tmp_path / "limits.sqlite")), upstream_rpm=60, burst_seconds=1)
+    on_loop = []
+    take = limiter.buckets.take
+
+    def recording_take(demands):
+        on_loop.append(threading.current_thread() is threading.main_thread())
+        return take(demands)
+
+    limiter.buckets.take = recording_take
+    asyncio.run(limiter.acquire_upstream_async("m", 1))
+    assert on_loop == [False]
+
+
+def test_parse_model_limits():
+    assert parse_model_limits("gpt-4o-mini=500/200000, text-embedding-3-small=3000") == {
+        "gpt-4o-mini": (500.0, 200000.0), "text-embedding-3-small": (3000.0, 0.0),
+    }
+    assert parse_model_limits("") == {}
+
+
+def test_openai_client_takes_budget_before_calling(monkeypatch):
+    limiter = RateLimiter(InMemoryBuckets(), model_limits={"gpt-4o-mini": (0, 600)}, burst_seconds=60)
+    monkeypatch.setattr(openai_client, "get_limiter", lambda: limiter)
+    monkeypatch.setattr(openai_client, "get_client", lambda: None)
+    tokens = openai_client.estimated_tokens({"messages": [{"role": "user", "content": "hi"}]})
+    assert tokens > 500  # the assumed completion is counted up front
+
+    sent = []
+    openai_client.call("chat", lambda c, t: sent.append(1), model="gpt-4o-mini", tokens=tokens)
+    with pytest.raises(RateLimited):
+        openai_client.call("chat", lambda c, t: sent.append(1), model="gpt-4o-mini", tokens=tokens)
+    assert sent == [1]
+    assert openai_client.estimated_tokens({"input": ["a" * 40, "b" * 40]}) >= 2
+
+
+def test_per_key_limit_returns_429_with_retry_after(monkeypatch):
+    limiter = RateLimiter(InMemoryBuckets(), client_rpm=60, burst_seconds=2)
+    monkeypatch.setattr("app.routes.get_limiter", lambda: limiter)
+    assert client.get("/", headers=HEADERS).status_code == 200
+    assert client.get("/", headers=HEADERS).status_code == 200
+    response = client.get("/", headers=HEADERS)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+    # other keys have their own buckets; bad keys are refused before admission
+    assert client.get("/", headers={"x-api-key": "wrong"}).status_code == 401
+
+
+def test_keyless_routes_are_limited_per_client_address(monkeypatch):
+    limiter = RateLimiter(InMemoryBuckets(), client_rpm=60, burst_seconds=1)
+    monkeypatch.setattr("app.routes.get_limiter", lambda: limiter)
+    monkeypatch.setattr("app.asgi.get_limiter", lambda: limiter)
+    body = {"texts": ["rate limited upload"], "collection": "limits"}
+    assert client.post("/upload_docs", json=body).status_code == 200
+    # made-up keys share the address's bucket instead of getting their own
+    response = client.post("/ask_rag/batch", json={"queries": ["q"]}, headers={"x-api-key": "made-up"})
+    assert response.status_code == 429 and response.headers["Retry-After"] == "1"
+    assert client.post("/ask_rag", json={"query": "q"}, environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code != 429
+    # a valid key is charged to its own bucket
+    assert client.post("/ask_rag", json={"query": "q"}, headers=HEADERS).status_code != 429
+    assert asgi_call("POST", "/ask_rag", {"query": "q"})[0] == 429
+
+
+def test_per_key_limit_under_asgi(monkeypatch):
+    limiter = RateLimiter(InMemoryBuckets(), client_rpm=60, burst_seconds=1)
+    monkeypatch.setattr("app.asgi.get_limiter", lambda: limiter)
+    assert asgi_call("POST", "/chat", {"content": "Hello!"}, HEADERS)[0] == 200
+    status, headers, _ = asgi_call("POST", "/chat", {"content": "Hello!"}, HEADERS)
+    assert status == 429 and headers[b"retry-after"] == b"1"
@@ -0,0 +1,77 @@
+import sys
+
+import numpy as np
+import pytest
+
+from app import rag_service, rerank
+from tests.test_routes import client
+
+HEADERS = {"x-api-key": "my-secret-key"}
+
+
+def _emb(x, y):
+    v = np.zeros(rag_service.embedding_dim, dtype=np.float32)
+    v[:2] = (x, y)
+    return v
+
+
+@pytest.fixture
+def near_duplicates(monkeypatch):
+    # "a" and its copy are the two nearest hits, "b" is as relevant and says something else
+    texts = ["about a", "about a, again", "about b"]
+    rag_service.add_embeddings(texts, [_emb(1, 0), _emb(1, 0.02), _emb(0, 1)], snapshot=False, collection="mmr")
+    monkeypatch.setattr(rag_service, "embed_text", lambda texts: [_emb(1, 1) for _ in texts])
+    return "mmr"
+
+
+def test_mmr_skips_near_duplicates():
+    query = np.array([1.0, 1.0, 0.0])
+    vectors = np.array([[1.0, 0.02, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [-1.0, 0.0, 0.0]])
+    assert rerank.mmr(query, vectors, 2, lambda_mult=0.5) == [0, 2]
+    assert rerank.mmr(query, vectors, 2, lambda_mult=1.0) == [0, 1]  # relevance only
+    assert sorted(rerank.mmr(query, vectors, 10)) == [0, 1, 2, 3]
+    assert rerank.mmr(query, vectors[:0], 3) == []
+
+
+def test_retrieve_context_reranks_overfetched_hits(near_duplicates):
+    plain = rag_service.retrieve_context("q", top_k=2, collection=near_duplicates)
+    assert [hit["text"] for hit in plain] == ["about a, again", "about a"]
+
+    diverse = rag_service.retrieve_context("q", top_k=2, collection=near_duplicates, reranker="mmr")
+    assert [hit["text"] for hit in diverse] == ["about a, again", "about b"]
+    batch = rag_service.retrieve_context_batch(["q"], top_k=2, collection=near_duplicates, reranker="mmr")
+    assert batch == [diverse]
+
+    # fetch_k = top_k leaves nothing to choose from
+    same = rag_service.retrieve_context("q", top_k=2, fetch_k=2, collection=near_duplicates, reranker="mmr")
+    assert same == plain
+
+
+def test_cross_encoder_reranker(monkeypatch, near_duplicates):
+    class FakeCrossEncoder:
+        def predict(self, pairs):
+            return [float(text == "about b") for _, text in pairs]
+
+    monkeypatch.setattr(rerank, "_cross_encoder", FakeCrossEncoder())
+    hits = rag_service.retrieve_context("q", top_k=1, collection=near_duplicates, reranker="cross_encoder")
+    assert [hit["text"] for hit in hits] == ["about b"]
+
+
+def test_cross_encoder_needs_sentence_transformers(monkeypatch):
+    monkeypatch.setattr(rerank, "_cross_encoder", None)
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)
+    with pytest.raises(RuntimeError, match="sentence-transformers"):
+        rerank.cross_encode("q", ["a", "b"], 1)
+
+
+def test_routes_validate_rerank_fields(near_duplicates):
+    for bad in ({"top_k": 0}, {"top_k": 101}, {"top_k": 5, "fetch_k": 4}, {"fetch_k": 1001}, {"rerank": "llm"}):
+        response = client.post("/ask_rag", json={"query": "x", **bad}, headers=HEADERS)
+        assert response.status_code == 400, bad
+
+    response = client.post("/ask_rag", json={"query": "diverse please", "top_k": 2, "fetch_k": 3, "rerank": "mmr",
+                                             "collection": near_duplicates}, headers=HEADERS)
+    assert response.status_code == 200
+    response = client.post("/documents/search", json={"query": "x", "top_k": 2, "rerank": "mmr",
+                                                      "collection": near_duplicates}, headers=HEADERS)
+    assert [hit["text"] for hit in response.json["results"]] == ["about a, again", "about b"]
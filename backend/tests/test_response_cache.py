@@ -0,0 +1,80 @@
+import numpy as np
+
+from app import response_cache as rc
+from app.response_cache import ResponseCache
+from tests.test_routes import client
+
+HEADERS = {"x-api-key": "my-secret-key"}
+
+
+def _vec(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_exact_hit_ignores_whitespace_only():
+    cache = ResponseCache()
+    cache.put("chat", "What is  RAG?", "answer", extra="m")
+    assert cache.get("chat", "  What is\nRAG? ", extra="m") == ("answer", rc.HIT_EXACT)
+    assert cache.get("chat", "what is rag?", extra="m") == (None, rc.MISS)
+    assert cache.get("chat", "What is RAG?", extra="other-model") == (None, rc.MISS)
+
+
+def test_semantic_hit_above_threshold():
+    cache = ResponseCache(similarity=0.95)
+    cache.put("rag", "capital of lebanon?", "Beirut", embedding=_vec(1, 0, 0))
+    assert cache.get("rag", "lebanon's capital?", embedding=_vec(0.99, 0.05, 0)) == ("Beirut", rc.HIT_SEMANTIC)
+    assert cache.get("rag", "weather today?", embedding=_vec(0, 1, 0)) == (None, rc.MISS)
+
+
+def test_ttl_expiry():
+    cache = ResponseCache(ttls={"chat": 0, "rag": 0})
+    cache.put("chat", "hi", "hello", embedding=_vec(1, 0))
+    assert cache.get("chat", "hi", embedding=_vec(1, 0)) == (None, rc.MISS)
+
+
+def test_invalidate_drops_entries_and_stale_puts():
+    cache = ResponseCache()
+    generation = cache.generation("rag")
+    cache.put("rag", "q", "old answer")
+    cache.invalidate("rag")
+    cache.put("rag", "q2", "computed before invalidation", generation=generation)
+    assert cache.get("rag", "q") == (None, rc.MISS)
+    assert cache.get("rag", "q2") == (None, rc.MISS)
+
+
+def test_chat_route_reports_cache_status():
+    data = {"content": "Cache me if you can"}
+    first = client.post("/chat", json=data, headers=HEADERS)
+    second = client.post("/chat", json=data, headers=HEADERS)
+    bypass = client.post("/chat", json=data, headers={**HEADERS, "Cache-Control": "no-cache"})
+    assert first.headers["X-Cache"] == rc.MISS
+    assert second.headers["X-Cache"] == rc.HIT_EXACT
+    assert second.json == first.json
+    assert bypass.headers["X-Cache"] == rc.BYPASS
+
+
+def test_upload_invalidates_rag_answers():
+    data = {"query": "Which documents do you know?"}
+    client.post("/ask_rag", json=data, headers=HEADERS)
+    assert client.post("/ask_rag", json=data, headers=HEADERS).headers["X-Cache"] == rc.HIT_EXACT
+
+    client.post("/upload_docs", json={"texts": ["A new fact."]}, headers=HEADERS)
+    assert client.post("/ask_rag", json=data, headers=HEADERS).headers["X-Cache"] == rc.MISS
+
+
+def test_exact_hit_skips_the_embedding_call(monkeypatch):
+    from app import rag_service
+
+    embedded = []
+
+    def embed_text(texts):
+        embedded.extend(texts)
+        return [_vec(1, 0, 0) for _ in texts]
+
+    monkeypatch.setattr(rc, "response_cache", ResponseCache())
+    monkeypatch.setattr(rc, "_semantic_enabled", lambda: True)
+    monkeypatch.setattr(rag_service, "embed_text", embed_text)
+    assert rc.cached_call("chat", "What is RAG?", lambda: "answer") == ("answer", rc.MISS)
+    assert rc.cached_call("chat", "What is  RAG?", lambda: "other") == ("answer", rc.HIT_EXACT)
+    assert rc.cached_call("chat", "Explain RAG", lambda: "other") == ("answer", rc.HIT_SEMANTIC)
+    assert embedded == ["What is RAG?", "Explain RAG"]
@@ -1,4 +1,5 @@
 import os
+import json
 #os.environ["FORCE_FAKE_OPENAI"] = "1"
 from app import create_app
 
@@ -237,3 +238,59 @@ def test_chat_rag_memory_missing_session_id_defaults():
     assert response.status_code == 200
     json_data = response.get_json()
     assert "response" in json_data
+
+
+def test_ask_rag_invalid_nprobe():
+    """Search knobs must be positive integers"""
+    data = {"query": "What is the capital of Lebanon?", "nprobe": "many"}
+    response = client.post("/ask_rag", json=data, headers={"x-api-key": "my-secret-key"})
+
+    assert response.status_code == 400
+    assert "nprobe" in response.get_json()["error"]
+
+
+# --- Test Server-Sent Events streaming ---
+def _sse_events(response):
+    events = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines.get("event", "message"), json.loads(lines["data"])))
+    return events
+
+def test_chat_stream():
+    headers = {"x-api-key": "my-secret-key", "Accept": "text/event-stream"}
+    response = client.post("/chat", json={"content": "Hello there"}, headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+
+    events = _sse_events(response)
+    deltas = [data["delta"] for kind, data in events if kind == "message"]
+    assert deltas == ["(test) ", "Echo: ", "Hello ", "there"]
+    assert events[-1] == ("done", {"response": "(test) Echo: Hello there", "version": "0.1.0"})
+
+def test_chat_rag_memory_stream_updates_memory():
+    from app.memory_service import get_memory
+    headers = {"x-api-key": "my-secret-key", "Accept": "text/event-stream"}
+    data = {"session_id": "stream_user", "query": "Tell me about Lebanon"}
+    response = client.post("/chat_rag_memory", json=data, headers=headers)
+
+    events = _sse_events(response)
+    assert events[-1][0] == "done"
+    assert get_memory("stream_user")[-1] == {"role": "assistant", "content": events[-1][1]["response"]}
+
+# --- Test POST /ask_rag/batch (NDJSON) ---
+def test_ask_rag_batch_streams_ndjson():
+    client.post("/upload_docs", json={"texts": ["Beirut is the capital of Lebanon."]})
+    queries = ["What is the capital?", "Where is Lebanon?", "Who?"]
+    response = client.post("/ask_rag/batch", json={"queries": queries})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    results = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert sorted(r["index"] for r in results) == [0, 1, 2]
+    for r in results:
+        assert r["response"] == f"(test) Answer to: {queries[r['index']]}"
+        assert r["sources"] and "score" in r["sources"][0]
+
+def test_ask_rag_batch_validation():
+    assert client.post("/ask_rag/batch", json={"queries": []}).status_code == 400
+    assert client.post("/ask_rag/batch", json={"queries": ["x"], "nprobe": 0}).status_code == 400
@@ -0,0 +1,143 @@
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from app import create_app, openai_client, rag_service, serving, vector_store
+from app.config import Config
+from app.vector_store import VectorStore
+from tests.test_routes import client
+
+DIM = 8
+
+
+def _vec(k):
+    v = np.zeros(DIM, dtype=np.float32)
+    v[k % DIM] = 1.0 + k
+    return v
+
+
+def test_ready_waits_for_clients(monkeypatch):
+    assert client.get("/ready").json == {"ready": True, "index": True, "clients": None}
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(openai_client, "_client", None)
+    monkeypatch.setattr(openai_client, "_async_client", None)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json["clients"] is False
+
+    serving.warm_clients()
+    assert client.get("/ready").status_code == 200
+
+
+def test_not_ready_when_the_store_fails_to_load(monkeypatch, tmp_path):
+    monkeypatch.setattr(serving, "_index_loaded", True)
+    monkeypatch.setattr(Config, "RAG_STORE_DIR", str(tmp_path))
+
+    def broken(directory):
+        raise ValueError("snapshot has dimension 8")
+
+    monkeypatch.setattr(rag_service, "load_store", broken)
+    response = create_app().test_client().get("/ready")
+    assert response.status_code == 503 and response.json["index"] is False
+
+
+def test_worker_is_ready_after_its_first_refresh(monkeypatch):
+    monkeypatch.setattr(serving, "_index_loaded", False)
+    outcomes = [OSError("snapshot went away"), []]
+
+    def refresh_stores():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def sleep(seconds):
+        checks.append(serving.readiness()[1]["index"])
+        if not outcomes:
+            raise StopIteration
+
+    checks = []
+    monkeypatch.setattr(rag_service, "refresh_stores", refresh_stores)
+    monkeypatch.setattr(serving.time, "sleep", sleep)
+    with pytest.raises(StopIteration):
+        serving._follow_snapshots(1)
+    assert checks == [False, True]
+
+
+def test_clients_are_rebuilt_after_fork(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(openai_client, "_client", None)
+    monkeypatch.setattr(openai_client, "_async_client", None)
+    parent = openai_client.get_client()
+    assert openai_client.get_client() is parent
+
+    monkeypatch.setattr(openai_client, "_client_pid", -1)  # as seen from a forked child
+    assert not openai_client.clients_ready()
+    assert openai_client.get_client() is not parent
+
+
+def test_openai_sdk_is_imported_lazily():
+    code = "import sys; from app import create_app; create_app(); print('openai' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert out.stdout.strip() == "False"
+
+
+def test_workers_follow_each_others_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "RAG_SNAPSHOT_INTERVAL", 0)  # snapshot after every write
+    first = VectorStore("shared", DIM, str(tmp_path))
+    second = VectorStore("shared", DIM, str(tmp_path))
+    first.add(["one"], [_vec(1)])
+
+    assert second.refresh()
+    assert second.documents() == ["one"]
+    assert not second.refresh()  # already current
+
+    # a write refreshes first, so it builds on the other worker's snapshot
+    monkeypatch.setattr(vector_store, "_following", True)
+    first.add(["two"], [_vec(2)])
+    second.add(["three"], [_vec(3)])
+    assert second.documents() == ["one", "two", "three"]
+    assert first.refresh()
+    assert first.documents() == ["one", "two", "three"]
+
+
+def test_unsaved_changes_merge_into_newer_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "RAG_SNAPSHOT_INTERVAL", 0)  # snapshot after every write
+    first = VectorStore("merge", DIM, str(tmp_path))
+    second = VectorStore("merge", DIM, str(tmp_path))
+    first.upsert(["base"], ["base doc"], [_vec(0)])
+    assert second.refresh()
+
+    first.upsert(["ingest-1"], ["ingested"], [_vec(1)], snapshot=False)  # e.g. an ingest job
+    first.delete(["base"], snapshot=False)
+    second.upsert(["faq"], ["faq doc"], [_vec(2)])  # published meanwhile
+    first.flush()
+
+    reloaded = VectorStore("merge", DIM, str(tmp_path))
+    reloaded.load()
+    assert (reloaded.get("faq"), reloaded.get("ingest-1"), reloaded.get("base")) == ("faq doc", "ingested", None)
+    assert [h["id"] for h in reloaded.search(_vec(1), 3)][0] == "ingest-1"
+
+
+def test_concurrent_writers_keep_all_documents(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "_following", True)
+    stores = [VectorStore("writers", DIM, str(tmp_path)) for _ in range(3)]
+
+    def write(w):
+        for k in range(10):
+            stores[w].upsert([f"w{w}-{k}"], [f"doc {w} {k}"], [_vec(w * 10 + k)], snapshot=k % 3 == 0)
+        stores[w].flush()
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(len(stores))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    reloaded = VectorStore("writers", DIM, str(tmp_path))
+    assert reloaded.load() == 30
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from app import openai_client, openai_service, rag_service
+from app.embedding_cache import EmbeddingCache
+from app.single_flight import SingleFlight, flight_key
+from tests.test_routes import client
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def _run_concurrently(flights, n, fn, key="k"):
+    """Call flights.do n times at once; fn only returns once all n have joined."""
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(5)
+        return fn()
+
+    with ThreadPoolExecutor(n) as pool:
+        futures = [pool.submit(flights.do, "chat", key, upstream) for _ in range(n)]
+        _wait_for(lambda: flights.stats()["kinds"].get("chat", {}).get("collapsed", 0) == n - 1)
+        release.set()
+        outcomes = []
+        for f in futures:
+            try:
+                outcomes.append(f.result())
+            except Exception as e:
+                outcomes.append(e)
+    return calls, outcomes
+
+
+def test_threaded_callers_share_one_call():
+    flights = SingleFlight()
+    calls, outcomes = _run_concurrently(flights, 8, lambda: ["answer"])
+    assert len(calls) == 1
+    assert outcomes == [["answer"]] * 8
+    assert flights.stats() == {"enabled": True, "in_flight": 0, "kinds": {"chat": {"calls": 1, "collapsed": 7}}}
+
+    # finished flights are not cached: the next call goes upstream again
+    assert flights.do("chat", "k", lambda: "again") == "again"
+    assert flights.stats()["kinds"]["chat"]["calls"] == 2
+
+
+def test_threaded_error_reaches_every_caller():
+    flights = SingleFlight()
+
+    def fail():
+        raise RuntimeError("upstream down")
+
+    calls, outcomes = _run_concurrently(flights, 4, fail)
+    assert len(calls) == 1
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+
+
+def test_async_callers_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        results = await asyncio.gather(*(flights.do_async("image", "k", upstream) for _ in range(5)))
+        other = await flights.do_async("image", "other", upstream)
+        return results, other
+
+    results, other = asyncio.run(main())
+    assert results == ["answer"] * 5 and other == "answer"
+    assert len(calls) == 2
+    assert flights.stats()["kinds"] == {"image": {"calls": 2, "collapsed": 4}}
+
+
+def test_async_cancelled_waiter_does_not_cancel_the_call():
+    flights = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    async def main():
+        first = asyncio.ensure_future(flights.do_async("chat", "k", upstream))
+        second = asyncio.ensure_future(flights.do_async("chat", "k", upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "answer"
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr("app.config.Config.SINGLE_FLIGHT_ENABLED", False)
+    flights = SingleFlight()
+    assert flights.do("chat", "k", lambda: 1) == 1
+    assert flights.stats()["kinds"] == {}
+
+
+def test_flight_key_is_canonical():
+    assert flight_key("m", {"a": 1, "b": [1, 2]}) == flight_key("m", {"b": [1, 2], "a": 1})
+    assert flight_key("m", "prompt") != flight_key("other", "prompt")
+
+
+@pytest.fixture
+def flights(monkeypatch):
+    flights = SingleFlight()
+    monkeypatch.setattr(openai_service, "single_flight", flights)
+    monkeypatch.setattr(rag_service, "single_flight", flights)
+    return flights
+
+
+def test_identical_chat_prompts_share_one_completion(monkeypatch, flights):
+    release = threading.Event()
+    calls = []
+
+    def create(model, messages):
+        calls.append(messages)
+        release.wait(5)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="hi"))])
+
+    monkeypatch.setattr(openai_service, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(openai_client, "create_chat_completion", create)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(openai_service.get_chat_response, "hello") for _ in range(4)]
+        _wait_for(lambda: flights.stats()["kinds"].get("chat", {}).get("collapsed") == 3)
+        release.set()
+        assert [f.result() for f in futures] == ["hi"] * 4
+    assert calls == [[{"role": "user", "content": "hello"}]]
+
+
+def test_concurrent_embedding_misses_share_one_request(monkeypatch, flights):
+    calls = []
+
+    async def create(model, input):
+        calls.append(list(input))
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0] * 4) for _ in input])
+
+    monkeypatch.setattr(rag_service, "_is_fake_mode", lambda: False)
+    monkeypatch.setattr(openai_client, "create_embeddings_async", create)
+    monkeypatch.setattr(rag_service, "embedding_cache", EmbeddingCache())
+    monkeypatch.setattr(rag_service.embedding_batcher, "window_ms", 0)
+
+    async def main():
+        return await asyncio.gather(*(rag_service.embed_text_async(["hot query"]) for _ in range(6)))
+
+    results = asyncio.run(main())
+    assert calls == [["hot query"]]
+    assert all(r[0].tolist() == [1.0] * 4 for r in results)
+    assert flights.stats()["kinds"]["embeddings"] == {"calls": 1, "collapsed": 5}
+
+
+def test_stats_endpoint():
+    assert client.get("/single_flight").status_code == 401
+    response = client.get("/single_flight", headers={"x-api-key": "my-secret-key"})
+    assert response.status_code == 200
+    assert set(response.json) == {"enabled", "in_flight", "kinds"}
@@ -0,0 +1,267 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app import rag_index, rag_service, vector_store
+from app.config import Config
+from app.vector_store import VectorStore, content_id
+from tests.test_routes import client
+
+DIM = 8
+
+
+def _vec(k):
+    # distinct, well separated vectors: doc k is its own nearest neighbour
+    v = np.zeros(DIM, dtype=np.float32)
+    v[k % DIM] = 1000.0 + k
+    v[(k + 1) % DIM] = float(k)
+    return v
+
+
+def test_parallel_uploads_and_queries_stay_consistent():
+    store = VectorStore("stress", DIM)
+    store.add(["doc 0"], [_vec(0)])
+    writers, batches, batch_size = 4, 25, 8
+    added = [0]  # ids whose batch has been applied
+    errors = []
+    done = threading.Event()
+
+    def upload(w):
+        try:
+            for b in range(batches):
+                base = 1 + (w * batches + b) * batch_size
+                ids = range(base, base + batch_size)
+                store.add([f"doc {k}" for k in ids], [_vec(k) for k in ids], snapshot=False)
+                added.extend(ids)
+        except Exception as e:  # pragma: no cover - surfaced below
+            errors.append(e)
+
+    def query():
+        rng = np.random.default_rng()
+        while not done.is_set():
+            k = added[int(rng.integers(0, len(added)))]
+            hits = [h["text"] for h in store.search(_vec(k), 1)]
+            if hits != [f"doc {k}"]:
+                errors.append(AssertionError(f"query {k} returned {hits}"))
+
+    readers = [threading.Thread(target=query) for _ in range(4)]
+    uploaders = [threading.Thread(target=upload, args=(w,)) for w in range(writers)]
+    for t in readers + uploaders:
+        t.start()
+    for t in uploaders:
+        t.join()
+    done.set()
+    for t in readers:
+        t.join()
+
+    assert not errors
+    assert store.ntotal == len(store) == 1 + writers * batches * batch_size
+
+
+def test_collections_are_isolated():
+    rag_service.add_documents(["Apples are red."], collection="fruit")
+    rag_service.add_documents(["Carrots are orange."], collection="veg")
+    assert [h["text"] for h in rag_service.retrieve_context("colour", collection="fruit")] == ["Apples are red."]
+    assert [h["text"] for h in rag_service.retrieve_context("colour", collection="veg")] == ["Carrots are orange."]
+    assert rag_service.retrieve_context("colour", collection="missing") == []
+
+
+def test_collections_persist(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "RAG_SNAPSHOT_INTERVAL", 0)  # snapshot after every write
+    monkeypatch.setattr(vector_store, "_stores", {})
+    monkeypatch.setattr(vector_store, "_root_dir", None)
+    rag_service.load_store(str(tmp_path))
+    rag_service.add_documents(["in default"])
+    rag_service.add_documents(["in notes"], collection="notes")
+
+    monkeypatch.setattr(vector_store, "_stores", {})
+    assert rag_service.load_store(str(tmp_path)) == 2
+    assert rag_service.get_store("notes").documents() == ["in notes"]
+    assert rag_service.get_store().documents() == ["in default"]
+
+
+def test_upsert_dedup_and_delete():
+    store = VectorStore("crud", DIM)
+    counts = store.add(["a", "b", "a"], [_vec(1), _vec(2), _vec(1)])
+    assert counts == {"added": 2, "updated": 0, "unchanged": 0}
+    assert store.add(["a"], [_vec(1)])["unchanged"] == 1
+    assert store.ntotal == 2
+
+    store.upsert(["doc-x"], ["old text"], [_vec(3)])
+    assert store.upsert(["doc-x"], ["new text"], [_vec(4)]) == {"added": 0, "updated": 1, "unchanged": 0}
+    assert store.get("doc-x") == "new text"
+    hits = store.search(_vec(3), 4)
+    assert "old text" not in [h["text"] for h in hits]
+    assert hits[0]["score"] >= hits[-1]["score"]
+
+    assert store.delete(["doc-x", "missing"]) == 1
+    assert store.get("doc-x") is None
+    assert sorted(h["text"] for h in store.search(_vec(4), 4)) == ["a", "b"]
+
+
+def test_compaction_reclaims_deleted_rows(tmp_path):
+    store = VectorStore("compact", DIM, str(tmp_path))
+    store.upsert([f"d{k}" for k in range(10)], [f"doc {k}" for k in range(10)], [_vec(k) for k in range(10)])
+    store.delete([f"d{k}" for k in range(0, 10, 2)])
+    assert (store.ntotal, len(store), store.deleted) == (10, 5, 5)
+
+    store.compact()
+    assert (store.ntotal, len(store), store.deleted) == (5, 5, 0)
+    assert store.search(_vec(7), 1)[0]["id"] == "d7"
+
+    reloaded = VectorStore("compact", DIM, str(tmp_path))
+    assert reloaded.load() == 5
+    assert reloaded.get("d3") == "doc 3" and reloaded.get("d4") is None
+
+
+def test_writes_during_rebuild_stay_applied(monkeypatch):
+    store = VectorStore("rebuild-race", DIM)
+    store.upsert([f"d{k}" for k in range(10)], [f"doc {k}" for k in range(10)], [_vec(k) for k in range(10)])
+    build_index = rag_index.build_index
+
+    def build_while_writing(*args, **kwargs):
+        # runs in the rebuild thread, between reading the live rows and the swap
+        store.delete(["d3"])
+        store.upsert(["d5"], ["doc 5, revised"], [_vec(5)])
+        return build_index(*args, **kwargs)
+
+    monkeypatch.setattr(rag_index, "build_index", build_while_writing)
+    store.compact()
+    assert store.get("d3") is None
+    assert [h["id"] for h in store.search(_vec(3), 10)].count("d3") == 0
+    hits = [h for h in store.search(_vec(5), 10) if h["id"] == "d5"]
+    assert [h["text"] for h in hits] == ["doc 5, revised"]
+    assert (len(store), store.deleted) == (9, 2)
+
+
+def test_load_rejects_other_dimension(tmp_path):
+    wide = VectorStore("dims", 16, str(tmp_path))
+    wide.add(["wide"], [np.ones(16, dtype=np.float32)])
+    wide.flush()
+    store = VectorStore("dims", DIM, str(tmp_path))
+    with pytest.raises(ValueError, match="16-dimensional"):
+        store.load()
+    assert len(store) == 0 and store.search(_vec(1), 1) == []
+
+
+def test_burst_of_writes_shares_one_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "RAG_SNAPSHOT_INTERVAL", 0.2)
+    monkeypatch.setattr(Config, "RAG_SNAPSHOT_EVERY", 100)
+    store = VectorStore("burst", DIM, str(tmp_path))
+    for k in range(5):
+        store.upsert([f"d{k}"], [f"doc {k}"], [_vec(k)])
+    assert VectorStore("burst", DIM, str(tmp_path)).load() == 0
+
+    time.sleep(0.5)
+    assert VectorStore("burst", DIM, str(tmp_path)).load() == 5
+    assert len([d for d in os.listdir(tmp_path) if d.startswith("snap-")]) == 1
+
+
+def test_tombstones_survive_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "RAG_SNAPSHOT_INTERVAL", 0)  # snapshot after every write
+    store = VectorStore("tomb", DIM, str(tmp_path))
+    store.upsert(["a", "b"], ["doc a", "doc b"], [_vec(1), _vec(2)])
+    store.delete(["a"])
+    reloaded = VectorStore("tomb", DIM, str(tmp_path))
+    assert reloaded.load() == 1
+    assert [h["id"] for h in reloaded.search(_vec(1), 2)] == ["b"]
+
+
+def test_documents_endpoints():
+    headers = {"x-api-key": "my-secret-key"}
+    body = {"documents": [{"id": "faq-1", "text": "Opening hours are 9 to 5."}, "Parking is free."],
+            "collection": "docs-api"}
+    response = client.post("/documents", json=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json["added"] == 2
+    assert client.post("/documents", json=body, headers=headers).json["unchanged"] == 2
+
+    response = client.put("/documents/faq-1?collection=docs-api", json={"text": "Open 8 to 6."}, headers=headers)
+    assert response.status_code == 200 and response.json["updated"] == 1
+    assert client.get("/documents/faq-1?collection=docs-api", headers=headers).json["text"] == "Open 8 to 6."
+
+    response = client.post("/documents/search", json={"query": "hours", "top_k": 5, "collection": "docs-api"},
+                           headers=headers)
+    assert {h["id"] for h in response.json["results"]} == {"faq-1", content_id("Parking is free.")}
+    assert all("score" in h for h in response.json["results"])
+
+    assert client.delete("/documents/faq-1?collection=docs-api", headers=headers).status_code == 204
+    assert client.delete("/documents/faq-1?collection=docs-api", headers=headers).status_code == 404
+    assert client.get("/documents/faq-1?collection=docs-api", headers=headers).status_code == 404
+
+
+@pytest.mark.parametrize("name", ["", "../etc", "a b", "x" * 65, 3])
+def test_invalid_collection_names(name):
+    with pytest.raises(ValueError):
+        vector_store.validate_name(name)
+
+
+def test_routes_reject_bad_collection():
+    response = client.post("/upload_docs", json={"texts": ["x"], "collection": "../x"})
+    assert response.status_code == 400
+    response = client.post("/ask_rag", json={"query": "x", "collection": "a/b"})
+    assert response.status_code == 400
+
+
+def test_search_batch_matches_single_searches():
+    store = VectorStore("batch", DIM)
+    store.add([f"doc {k}" for k in range(20)], [_vec(k) for k in range(20)])
+    queries = np.vstack([_vec(k) for k in (3, 11, 19)])
+    batched = store.search_batch(queries, 2)
+    assert batched == [store.search(q, 2) for q in queries]
+    assert [hits[0]["text"] for hits in batched] == ["doc 3", "doc 11", "doc 19"]
+
+
+def test_cosine_metric_normalizes_and_scores_similarity(monkeypatch):
+    monkeypatch.setattr("app.config.Config.RAG_METRIC", "cosine")
+    store = VectorStore("cosine", DIM)
+    assert store.metric == "cosine"
+    vectors = [_vec(k) for k in range(10)]
+    store.add([f"doc {k}" for k in range(10)], vectors)
+    hits = store.search(3.0 * vectors[4], 3)  # scale does not matter
+    assert hits[0]["text"] == "doc 4"
+    assert hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert all(-1.0 <= h["score"] <= 1.0 + 1e-5 for h in hits)
+    assert np.linalg.norm(store._full_vectors([4])[0]) == pytest.approx(1.0, abs=1e-5)
+
+    filtered = store.search(vectors[4], 3, where={})  # exact path scores the same way
+    assert filtered[0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_min_similarity_cutoff(monkeypatch):
+    axes = np.eye(DIM, dtype=np.float32)
+    query = (axes[0] + 0.1 * axes[1]) / np.linalg.norm(axes[0] + 0.1 * axes[1])
+    for metric in ("cosine", "l2"):  # on unit vectors both cut at the same cosine
+        monkeypatch.setattr("app.config.Config.RAG_METRIC", metric)
+        store = VectorStore(f"cutoff-{metric}", DIM)
+        store.add(["x axis", "y axis", "z axis"], list(axes[:3]))
+        assert len(store.search(query, 3)) == 3
+        assert [h["text"] for h in store.search(query, 3, min_similarity=0.5)] == ["x axis"]
+        assert [h["text"] for h in store.search(query, 3, min_similarity=0.05)] == ["x axis", "y axis"]
+
+
+def test_rebuild_switches_metric(monkeypatch):
+    store = VectorStore("to-cosine", DIM)
+    store.add([f"doc {k}" for k in range(10)], [_vec(k) for k in range(10)])
+    assert store.metric == "l2"
+    store.rebuild("flat", metric="cosine")
+    assert store.metric == "cosine"
+    assert store.search(_vec(6), 1)[0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_fake_embeddings_are_deterministic():
+    texts = ["a", "bb", "ccc", "dddd", "eeeee", "f"] * 2
+    embeddings = rag_service._fake_embeddings(texts)
+    expected = [float((i + 1) % 10 + len(t) % 5) for i, t in enumerate(texts)]
+    assert [float(e[0]) for e in embeddings] == expected
+    assert all(e.shape == (rag_service.embedding_dim,) and e.dtype == np.float32 for e in embeddings)
+
+
+def test_routes_validate_min_similarity():
+    assert client.post("/ask_rag", json={"query": "x", "min_similarity": 2}).status_code == 400
+    response = client.post("/documents/search", json={"query": "x", "min_similarity": 0.99},
+                           headers={"x-api-key": "my-secret-key"})
+    assert response.status_code == 200